@@ -0,0 +1,217 @@
+"""Headless batch analysis.
+
+Reads queries from a CSV or JSONL file and runs each one through the same
+analyze -> tag -> scrape pipeline as the Streamlit app, with a bounded number
+of queries in flight and a token-bucket limit on OpenRouter requests.
+Completed results are written to `threat_analyses` in bulk, and the keys of
+committed queries are appended to a checkpoint file so an interrupted sweep
+can be resumed with the same command.
+
+Usage:
+    python batch_analyze.py queries.csv --concurrency 4 --requests-per-minute 20
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from utils.gpt_helper import GPTHelper
+from utils.instrumentation import get_logger, start_metrics_server
+from utils.threat_analyzer import ThreatAnalyzer
+from utils.pipeline import AnalysisPipeline
+from utils.rate_limiter import TokenBucket
+from utils.response_cache import ResponseCache
+
+logger = get_logger(__name__)
+
+
+def read_queries(path):
+    """Yield (key, query) pairs from a CSV or JSONL file.
+
+    CSV files use the `query` column if present, otherwise the first column.
+    JSONL lines may be objects with a `query` field or bare JSON strings.
+    The key combines the line number and the query text so a checkpoint stays
+    valid only for the file it was written against.
+    """
+    if path.endswith('.jsonl') or path.endswith('.ndjson'):
+        with open(path, encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                item = json.loads(line)
+                query = item.get('query') if isinstance(item, dict) else item
+                if query:
+                    yield _query_key(line_no, query), str(query)
+    else:
+        with open(path, encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return
+            column = 0
+            if 'query' in header:
+                column = header.index('query')
+            else:
+                # No header row, the first line is a query as well
+                if header and header[0].strip():
+                    yield _query_key(1, header[0]), header[0].strip()
+            for line_no, row in enumerate(reader, 2):
+                if len(row) > column and row[column].strip():
+                    yield _query_key(line_no, row[column]), row[column].strip()
+
+
+def _query_key(line_no, query):
+    digest = hashlib.sha1(str(query).encode('utf-8')).hexdigest()[:16]
+    return f"{line_no}:{digest}"
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+class BatchRunner:
+
+    def __init__(self, pipeline, threat_analyzer, concurrency=4, batch_size=50,
+                 checkpoint_path=None, report_every=25):
+        self.pipeline = pipeline
+        self.threat_analyzer = threat_analyzer
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.report_every = report_every
+
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._started = None
+
+    def _analyze(self, key, query):
+        result = self.pipeline.run(query, store=False)
+        return key, query, result
+
+    def _flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        self.threat_analyzer.store_responses([record for _, record in batch])
+        # Only checkpoint rows that have been committed
+        if self.checkpoint_path:
+            with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+                f.writelines(f"{key}\n" for key, _ in batch)
+
+    def _handle(self, future):
+        try:
+            key, query, result = future.result()
+        except Exception as e:
+            logger.error("Error analyzing query: %s", e)
+            self.failed += 1
+            return
+
+        if 'error' in result['response']:
+            # Left out of the checkpoint so a resumed run retries it
+            logger.warning("Analysis failed for %r: %s", query, result['response']['error'])
+            self.failed += 1
+            return
+
+        self._pending.append((key, result['analysis']))
+        self.completed += 1
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        if self.completed % self.report_every == 0:
+            self.report()
+
+    def throughput(self):
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        return self.completed / elapsed * 60 if elapsed else 0.0
+
+    def report(self):
+        elapsed = time.perf_counter() - self._started
+        print(f"{self.completed} completed, {self.failed} failed, "
+              f"{self.skipped} skipped in {elapsed:.1f}s "
+              f"({self.throughput():.1f} queries/min)")
+
+    def run(self, queries):
+        done = load_checkpoint(self.checkpoint_path) if self.checkpoint_path else set()
+        self._started = time.perf_counter()
+        in_flight = set()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency,
+                                thread_name_prefix='batch') as executor:
+            try:
+                for key, query in queries:
+                    if key in done:
+                        self.skipped += 1
+                        continue
+                    # Keep at most `concurrency` queries in flight so huge
+                    # input files are streamed rather than queued up front
+                    while len(in_flight) >= self.concurrency:
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            self._handle(future)
+                    in_flight.add(executor.submit(self._analyze, key, query))
+
+                for future in in_flight:
+                    self._handle(future)
+            finally:
+                self._flush()
+
+        self.report()
+        return {
+            'completed': self.completed,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'queries_per_minute': self.throughput()
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run threat analyses for every query in a file")
+    parser.add_argument('input', help="CSV or JSONL file with one query per row")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="queries analyzed at the same time (default: 4)")
+    parser.add_argument('--requests-per-minute', type=float, default=20,
+                        help="OpenRouter requests allowed per minute (default: 20)")
+    parser.add_argument('--burst', type=int, default=1,
+                        help="requests that may be sent back to back (default: 1)")
+    parser.add_argument('--batch-size', type=int, default=50,
+                        help="rows per bulk insert (default: 50)")
+    parser.add_argument('--checkpoint', default=None,
+                        help="checkpoint file (default: <input>.checkpoint)")
+    args = parser.parse_args(argv)
+
+    checkpoint = args.checkpoint or f"{args.input}.checkpoint"
+    limiter = TokenBucket.per_minute(args.requests_per_minute, burst=args.burst)
+
+    start_metrics_server()
+    threat_analyzer = ThreatAnalyzer()
+    gpt_helper = GPTHelper(cache=ResponseCache(db=threat_analyzer.db),
+                           rate_limiter=limiter)
+    pipeline = AnalysisPipeline(gpt_helper, threat_analyzer,
+                                max_workers=args.concurrency)
+    runner = BatchRunner(pipeline, threat_analyzer,
+                         concurrency=args.concurrency,
+                         batch_size=args.batch_size,
+                         checkpoint_path=checkpoint)
+    try:
+        summary = runner.run(read_queries(args.input))
+    finally:
+        pipeline.shutdown()
+        threat_analyzer.shutdown()
+
+    print(json.dumps(summary))
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Cold start: imports, service setup and first page render of main.py.
+
+    python -m benchmarks.bench_cold_start --runs 5
+    python -m benchmarks.bench_cold_start --importtime 15
+
+Each run is a fresh interpreter that renders main.py once through
+Streamlit's AppTest, in an empty directory so the SQLite database is
+created from scratch. The phases are the ones main.py reports through
+utils.instrumentation.record_startup, measured from the top of the script:
+
+  imports     the app's own imports (streamlit is already loaded by then)
+  services    plus the shared database, analyzer, LLM client and job queue
+  first_page  plus rendering the whole first page
+
+--importtime prints the slowest imports of one run (python -X importtime).
+No LLM requests are made.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASES = ('imports', 'services', 'first_page')
+
+CHILD = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=120).run()
+from utils.instrumentation import startup_timings
+print(json.dumps({'failed': bool(app.exception), **startup_timings()}))
+"""
+
+
+def child_env(directory):
+    env = dict(os.environ)
+    env.pop('DATABASE_URL', None)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    env['SCRAPE_CACHE_DIR'] = os.path.join(directory, 'scrape_cache')
+    env['CVE_MIRROR_URL'] = f"sqlite:///{os.path.join(directory, 'cve_mirror.db')}"
+    env['LOG_LEVEL'] = 'ERROR'
+    return env
+
+
+def cold_start():
+    with tempfile.TemporaryDirectory() as directory:
+        result = subprocess.run([sys.executable, '-c', CHILD, os.path.join(ROOT, 'main.py')],
+                                cwd=directory, env=child_env(directory),
+                                capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(top):
+    """Cumulative import times (ms) of the app's modules, slowest first."""
+    code = "import components.ui, components.visualization, utils.registry, utils.gpt_helper, utils.threat_analyzer"
+    with tempfile.TemporaryDirectory() as directory:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                cwd=directory, env=child_env(directory),
+                                capture_output=True, text=True, check=True)
+    timings = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Top-level packages only; nested lines are counted in their parent
+        if not name.startswith(' ' * 2):
+            timings.append((int(cumulative) / 1000, name.strip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--importtime', type=int, default=0, metavar='N',
+                        help="also list the N slowest top-level imports")
+    args = parser.parse_args()
+
+    runs = [cold_start() for _ in range(args.runs)]
+    failed = sum(run['failed'] for run in runs)
+    print(f"{args.runs} cold starts{f', {failed} with exceptions' if failed else ''}")
+    print(f"  {'phase':<12}{'median ms':>11}{'min ms':>9}{'max ms':>9}")
+    for phase in PHASES:
+        values = [run[phase] * 1000 for run in runs if phase in run]
+        if values:
+            print(f"  {phase:<12}{statistics.median(values):>11.0f}{min(values):>9.0f}{max(values):>9.0f}")
+
+    if args.importtime:
+        print("\nSlowest imports (cumulative ms)")
+        for ms, name in slowest_imports(args.importtime):
+            print(f"  {ms:>8.1f}  {name}")
+
+
+if __name__ == '__main__':
+    main()
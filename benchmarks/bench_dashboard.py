@@ -0,0 +1,126 @@
+"""Dashboard figure build time: whole-history DataFrame vs SQL aggregates.
+
+    python -m benchmarks.bench_dashboard --rows 100000
+
+Fills a fresh SQLite database (in a temporary directory) with --rows
+analyses spread over --days days, then times:
+
+  dataframe    the old path: load every analysis into a DataFrame, read the
+               severity out of each row's tags and draw one bar per analysis
+               (skipped above --dataframe-max-rows, it grows linearly)
+  aggregated   rollup counters (GROUP BY on analysis_tags for hourly
+               timelines), downsampled timeline
+  cached       the same figures again with the high-water mark unchanged
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+import plotly.express as px
+
+from components.visualization import ThreatVisualizer
+from utils.database import AnalysisTags, Database, ThreatAnalysis
+from utils.tags import normalize_severity, normalize_tags, unwrap_tags
+
+SEVERITIES = ['Low', 'Medium', 'High', 'Critical']
+
+
+def fill(db, rows, days, seed=7):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    analyses = []
+    tag_rows = []
+    for i in range(1, rows + 1):
+        timestamp = now - timedelta(seconds=rng.randrange(days * 86400))
+        tags = {'status': 'success', 'format': 'json', 'data': {
+            'Severity Level': rng.choice(SEVERITIES),
+            'threat_actor': f"Actor {rng.randrange(40)}",
+            'target_sector': 'Finance', 'attack_vector': 'Phishing', 'TTP': 'T1566'
+        }}
+        analyses.append({'id': i, 'timestamp': timestamp, 'query': f"bench query {i}",
+                         'response': {'api_response': {'status': 'success'}}, 'tags': tags})
+        tag_rows.append({'analysis_id': i, 'timestamp': timestamp, **normalize_tags(tags)})
+    session = db.Session()
+    try:
+        # Straight bulk inserts; the search and IoC indexes aren't needed
+        # here and the rollups are rebuilt once afterwards
+        for start in range(0, rows, 5000):
+            session.execute(ThreatAnalysis.__table__.insert(), analyses[start:start + 5000])
+            session.execute(AnalysisTags.__table__.insert(), tag_rows[start:start + 5000])
+        session.commit()
+    finally:
+        session.close()
+    db.rebuild_rollups()
+
+
+def dataframe_figures(db):
+    df = db.to_dataframe()
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df['end_time'] = df['timestamp'] + pd.Timedelta(days=1)
+    df['severity'] = df['tags'].apply(lambda tags: normalize_severity(unwrap_tags(tags).get('Severity Level')))
+    df['actor'] = df['tags'].apply(lambda tags: unwrap_tags(tags).get('threat_actor'))
+    figures = [
+        px.timeline(df, x_start='timestamp', x_end='end_time', y='query', color='severity'),
+        px.pie(values=df['severity'].value_counts().values, names=df['severity'].value_counts().index),
+        px.bar(df['actor'].value_counts().head(10)),
+    ]
+    return [fig.to_dict() for fig in figures]
+
+
+def aggregated_figures(visualizer):
+    return visualizer.dashboard_figures()
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--max-points', type=int, default=200)
+    parser.add_argument('--dataframe-max-rows', type=int, default=20000)
+    args = parser.parse_args()
+
+    previous_url = os.environ.pop('DATABASE_URL', None)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                db = Database()
+            fill(db, args.rows, args.days)
+            visualizer = ThreatVisualizer(db, max_points=args.max_points)
+
+            print(f"{args.rows} analyses over {args.days} days")
+            print(f"  {'path':<14}{'seconds':>10}")
+            if args.rows <= args.dataframe_max_rows:
+                seconds, _ = timed(dataframe_figures, db)
+                print(f"  {'dataframe':<14}{seconds:>10.3f}")
+            else:
+                print(f"  {'dataframe':<14}{'skipped':>10}")
+            seconds, figures = timed(aggregated_figures, visualizer)
+            print(f"  {'aggregated':<14}{seconds:>10.3f}")
+            seconds, _ = timed(aggregated_figures, visualizer)
+            print(f"  {'cached':<14}{seconds:>10.3f}")
+            bars = len({x for trace in figures['timeline']['data'] for x in trace['x']})
+            print(f"  timeline buckets: {bars}")
+            db.engine.dispose()
+        finally:
+            os.chdir(cwd)
+
+    if previous_url is not None:
+        os.environ['DATABASE_URL'] = previous_url
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Rows/sec for single-row vs batched analysis writes.
+
+    python -m benchmarks.bench_db_writes --rows 2000 --threads 16
+    python -m benchmarks.bench_db_writes --postgres-url postgresql://user:pw@host/db
+
+SQLite runs against a fresh database in a temporary directory. With
+--postgres-url the same modes run against that database too; the rows
+written there are deleted again afterwards.
+
+Modes:
+  single       one store_analysis (insert + commit) per row, one thread
+  concurrent   store_analysis from --threads threads, one commit per row
+  buffered     store_analysis from --threads threads through BufferedWriter
+  bulk         store_analyses with --batch-rows rows per call
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+from utils.database import Database
+from utils.write_buffer import BufferedWriter
+
+QUERY_PREFIX = 'bench-write'
+
+
+def sample_record(i):
+    response = {
+        'api_response': {
+            'status': 'success', 'format': 'text',
+            'data': {'content': f"Analysis {i}: phishing with malicious attachments. " * 20}
+        },
+        'scraped_data': {'cve_data': [f"CVE-2024-{i:05d} sample description"] * 5},
+    }
+    tags = {'status': 'success', 'format': 'json', 'data': {
+        'Severity Level': ['Low', 'Medium', 'High', 'Critical'][i % 4],
+        'threat_actor': f"Actor {i % 17}",
+        'target_sector': 'Finance', 'attack_vector': 'Phishing', 'TTP': 'T1566'
+    }}
+    return {'query': f"{QUERY_PREFIX} {i}", 'response': response, 'tags': tags}
+
+
+def run_single(db, records, args):
+    for record in records:
+        db.store_analysis(record['query'], record['response'], record['tags'])
+
+
+def run_concurrent(db, records, args):
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(lambda r: db.store_analysis(r['query'], r['response'], r['tags']), records))
+
+
+def run_buffered(db, records, args):
+    db.write_buffer = BufferedWriter(db, max_rows=args.batch_rows, max_delay_ms=args.batch_ms)
+    try:
+        run_concurrent(db, records, args)
+    finally:
+        db.write_buffer.close()
+        db.write_buffer = None
+
+
+def run_bulk(db, records, args):
+    for start in range(0, len(records), args.batch_rows):
+        db.store_analyses(records[start:start + args.batch_rows])
+
+
+MODES = [('single', run_single), ('concurrent', run_concurrent),
+         ('buffered', run_buffered), ('bulk', run_bulk)]
+
+
+def bench(label, db, args):
+    print(f"\n{label}")
+    print(f"  {'mode':<12}{'rows':>8}{'seconds':>10}{'rows/sec':>11}")
+    offset = 0
+    for mode, run in MODES:
+        rows = args.single_rows if mode == 'single' else args.rows
+        records = [sample_record(offset + i) for i in range(rows)]
+        offset += rows
+        start = time.perf_counter()
+        run(db, records, args)
+        elapsed = time.perf_counter() - start
+        print(f"  {mode:<12}{rows:>8}{elapsed:>10.2f}{rows / elapsed:>11.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--single-rows', type=int, default=500,
+                        help="rows for the single-threaded one-commit-per-row mode")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--batch-rows', type=int, default=50)
+    parser.add_argument('--batch-ms', type=int, default=5)
+    parser.add_argument('--postgres-url', default=None)
+    args = parser.parse_args()
+
+    previous_url = os.environ.pop('DATABASE_URL', None)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # The SQLite database lives at ./threat_database.db
+        os.chdir(directory)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                db = Database()
+            bench('SQLite (WAL, synchronous=NORMAL)', db, args)
+            db.engine.dispose()
+        finally:
+            os.chdir(cwd)
+
+    if args.postgres_url:
+        os.environ['DATABASE_URL'] = args.postgres_url
+        with contextlib.redirect_stdout(io.StringIO()):
+            db = Database()
+        try:
+            bench('Postgres', db, args)
+        finally:
+            with db.engine.begin() as conn:
+                conn.execute(text("DELETE FROM threat_analyses WHERE query LIKE :prefix"),
+                             {'prefix': QUERY_PREFIX + ' %'})
+            db.engine.dispose()
+
+    if previous_url is not None:
+        os.environ['DATABASE_URL'] = previous_url
+    else:
+        os.environ.pop('DATABASE_URL', None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Compare HTML extraction strategies for the scrape sources.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_extraction
+    python -m benchmarks.bench_extraction --pages saved_pages/ --repeat 20
+
+Fixture pages are read from benchmarks/fixtures (or --pages). A file is
+matched to its extractor by name prefix: cve*.html uses the MITRE rules,
+exploitdb*.html the ExploitDB ones. Missing default fixtures are
+synthesized with the shape of the real result pages and saved there.
+
+Each strategy is timed (median of --repeat runs) and measured for peak
+traced memory, and its output is checked against the full-tree baseline.
+"""
+import argparse
+import os
+import statistics
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from utils.extractors import (
+    SOURCE_EXTRACTORS, SOUP_PARSER, extract_items_strainer, extract_items_streaming
+)
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def baseline(html, extractor):
+    # What ThreatAnalyzer did before: build the whole tree, keep five items
+    soup = BeautifulSoup(html, 'html.parser')
+    if extractor.css_class:
+        items = soup.find_all(extractor.tag, class_=extractor.css_class)
+    else:
+        items = soup.find_all(extractor.tag)
+    items = items[extractor.skip:extractor.skip + extractor.limit]
+    return [item.get_text(strip=True) for item in items if item]
+
+
+STRATEGIES = [
+    ('full soup (html.parser)', baseline),
+    (f'strainer ({SOUP_PARSER})', extract_items_strainer),
+    ('streaming (stops early)', extract_items_streaming),
+]
+
+
+def _page(title, body):
+    nav = ''.join(f'<li><a href="/section/{i}">Section {i}</a></li>' for i in range(60))
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f'<title>{title}</title>'
+        '<style>body { font-family: sans-serif; } td { padding: 2px; }</style>'
+        '<script>window.dataLayer = window.dataLayer || [];</script>'
+        f'</head><body><header><ul class="nav">{nav}</ul></header>'
+        f'<main>{body}</main>'
+        '<footer><p>Footer &amp; legal notices</p></footer></body></html>'
+    )
+
+
+def synthesize_cve_page(rows=3000):
+    lines = ['<div id="TableWithRules"><table cellpadding="0" cellspacing="0" border="0">',
+             '<thead><tr><th style="width: 20%">Name</th><th>Description</th></tr></thead>']
+    for i in range(rows):
+        lines.append(
+            f'<tr><td valign="top" nowrap="nowrap"><a href="/cgi-bin/cvename.cgi?name=CVE-2024-{10000 + i}">'
+            f'CVE-2024-{10000 + i}</a></td><td valign="top">A vulnerability in component {i % 97} '
+            f'allows remote attackers to execute arbitrary code via a crafted request &lt;param {i}&gt;.'
+            '</td></tr>'
+        )
+    lines.append('</table></div>')
+    return _page('CVE - Search Results', '\n'.join(lines))
+
+
+def synthesize_exploitdb_page(cards=1500):
+    lines = ['<div class="container">']
+    for i in range(cards):
+        lines.append(
+            f'<div class="card exploit-card" data-id="{50000 + i}"><div class="card-header">'
+            f'<h5 class="card-title"><a href="/exploits/{50000 + i}">Product {i % 53} 2.{i % 10} - '
+            f'Remote Code Execution</a></h5></div><div class="card-body"><p>Author: researcher{i % 31}</p>'
+            f'<p>Type: remote</p><p>Platform: linux</p><img src="/img/{i}.png"></div></div>'
+        )
+    lines.append('</div>')
+    return _page('Exploit Database Search', '\n'.join(lines))
+
+
+DEFAULT_FIXTURES = {
+    'cve_search.html': synthesize_cve_page,
+    'exploitdb_search.html': synthesize_exploitdb_page,
+}
+
+
+def ensure_fixtures(directory):
+    os.makedirs(directory, exist_ok=True)
+    for name, build in DEFAULT_FIXTURES.items():
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(build())
+            print(f"Wrote fixture {path}")
+
+
+def load_pages(directory):
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.html'):
+            continue
+        source = next((key for key in SOURCE_EXTRACTORS if name.startswith(key)), None)
+        if source is None:
+            print(f"Skipping {name}: no extractor matches its name")
+            continue
+        with open(os.path.join(directory, name), encoding='utf-8', errors='replace') as f:
+            pages.append((name, SOURCE_EXTRACTORS[source], f.read()))
+    return pages
+
+
+def measure(strategy, html, extractor, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        strategy(html, extractor)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = strategy(html, extractor)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', default=FIXTURE_DIR,
+                        help='Directory of saved result pages (default: benchmarks/fixtures)')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.pages == FIXTURE_DIR:
+        ensure_fixtures(FIXTURE_DIR)
+    pages = load_pages(args.pages)
+    if not pages:
+        parser.error(f"No fixture pages found in {args.pages}")
+
+    for name, extractor, html in pages:
+        print(f"\n{name} ({len(html) / 1024:.0f} KiB, extractor '{extractor.name}')")
+        print(f"  {'strategy':<28}{'median ms':>12}{'peak KiB':>12}{'speedup':>10}  output")
+        base_seconds = None
+        expected = None
+        for label, strategy in STRATEGIES:
+            seconds, peak, result = measure(strategy, html, extractor, args.repeat)
+            if base_seconds is None:
+                base_seconds, expected = seconds, result
+            matches = 'same' if result == expected else 'DIFFERS'
+            print(f"  {label:<28}{seconds * 1000:>12.2f}{peak / 1024:>12.0f}"
+                  f"{base_seconds / seconds:>9.1f}x  {matches}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Tokens and latency per query: two LLM calls vs one combined call.
+
+    python -m benchmarks.bench_llm_modes --repeat 2
+    python -m benchmarks.bench_llm_modes --prompts-only
+
+Runs each query through both flows with the response cache off:
+
+  two-call   analyze_threat, then tag_threat_data on the analysis text
+             (which sends the whole analysis back as the second prompt)
+  combined   analyze_and_tag: one structured-output request
+
+and prints the mean latency, LLM calls and prompt/completion tokens per
+query. Token counts are the API's usage figures, or ~4 chars/token
+estimates (marked ~) when the model doesn't report them. Needs
+OPENROUTER_API_KEY; --prompts-only just compares the prompt sizes sent
+before any completion text is involved.
+"""
+import argparse
+import contextlib
+import io
+import statistics
+import time
+
+from utils.gpt_helper import GPTHelper, estimate_tokens
+from utils.pipeline import AnalysisPipeline
+
+QUERIES = [
+    "Analyze recent ransomware attacks targeting healthcare providers",
+    "What are the TTPs of APT29 in cloud environments?",
+    "Summarize exploitation of CVE-2023-4966 (Citrix Bleed)",
+]
+
+
+def two_call(gpt_helper, query):
+    response = gpt_helper.analyze_threat(query)
+    tags = gpt_helper.tag_threat_data(response)
+    return response, tags
+
+
+def combined(gpt_helper, query):
+    return gpt_helper.analyze_and_tag(query)
+
+
+def measure(flow, gpt_helper, queries, repeat):
+    latencies = []
+    usages = []
+    errors = 0
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            # GPTHelper prints every prompt and response
+            with contextlib.redirect_stdout(io.StringIO()):
+                response, tags = flow(gpt_helper, query)
+            latencies.append(time.perf_counter() - start)
+            if 'error' in response or 'error' in tags:
+                errors += 1
+            usages.append(AnalysisPipeline.usage_summary(response, tags))
+    return {
+        'latency': statistics.mean(latencies),
+        'calls': statistics.mean(usage['llm_calls'] for usage in usages),
+        'prompt': statistics.mean(usage['prompt_tokens'] for usage in usages),
+        'completion': statistics.mean(usage['completion_tokens'] for usage in usages),
+        'estimated': any(usage['estimated'] for usage in usages),
+        'errors': errors,
+    }
+
+
+def prompt_sizes(gpt_helper, query):
+    analysis_prompt = gpt_helper._build_analysis_prompt(query)
+    combined_prompt = gpt_helper._build_combined_prompt(query)
+    system = estimate_tokens(gpt_helper.SYSTEM_PROMPT)
+    return {
+        'two-call': 2 * system + estimate_tokens(analysis_prompt),
+        'combined': system + estimate_tokens(combined_prompt),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--query', action='append',
+                        help="query to run (repeatable; default: three sample queries)")
+    parser.add_argument('--prompts-only', action='store_true',
+                        help="compare prompt sizes without calling the API")
+    args = parser.parse_args()
+    queries = args.query or QUERIES
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        gpt_helper = GPTHelper(cache=None)
+
+    if args.prompts_only:
+        print("Estimated prompt tokens per query, before any analysis text")
+        print("(two-call's tagging prompt re-sends the whole analysis on top of this)")
+        print(f"  {'query':<60}{'two-call':>10}{'combined':>10}")
+        for query in queries:
+            sizes = prompt_sizes(gpt_helper, query)
+            print(f"  {query[:58]:<60}{sizes['two-call']:>10}{sizes['combined']:>10}")
+        return
+
+    if gpt_helper.openai_api_key == "missing_key":
+        parser.error("OPENROUTER_API_KEY is not set (use --prompts-only to run offline)")
+
+    print(f"{len(queries)} queries x {args.repeat}, models: {', '.join(gpt_helper.models)}")
+    print(f"  {'flow':<10}{'seconds':>10}{'calls':>8}{'prompt':>10}{'completion':>12}{'errors':>8}")
+    for name, flow in [('two-call', two_call), ('combined', combined)]:
+        result = measure(flow, gpt_helper, queries, args.repeat)
+        approx = '~' if result['estimated'] else ''
+        print(f"  {name:<10}{result['latency']:>10.2f}{result['calls']:>8.1f}"
+              f"{approx + format(result['prompt'], '.0f'):>10}"
+              f"{approx + format(result['completion'], '.0f'):>12}{result['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
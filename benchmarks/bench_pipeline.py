@@ -0,0 +1,233 @@
+"""End-to-end pipeline throughput and latency against local stand-ins.
+
+    python -m benchmarks.bench_pipeline --concurrency 1 4 16 --db-rows 0 10000
+    python -m benchmarks.bench_pipeline --output after.json --compare before.json
+
+Starts benchmarks.stub_servers in a subprocess (an OpenAI-compatible LLM
+stub and the saved CVE/ExploitDB pages), points GPTHelper and
+ThreatAnalyzer at it and runs --queries analyses (analyze, tag, scrape,
+store) through AnalysisPipeline at each concurrency, against a fresh SQLite
+database pre-filled with each --db-rows. The response cache is off and
+every query is distinct, so each one makes its LLM calls and page fetches.
+
+Reports latency percentiles, queries/sec, per-stage medians and the peak
+RSS of this process (a high-water mark, so it only grows across runs), and
+saves everything as JSON keyed by the current commit. --compare prints the
+change in p95 latency and throughput against an earlier result file.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from benchmarks.bench_dashboard import fill
+from utils.database import Database
+from utils.gpt_helper import GPTHelper
+from utils.instrumentation import configure_logging
+from utils.pipeline import AnalysisPipeline
+from utils.threat_analyzer import ThreatAnalyzer
+
+QUERY = "bench {rows}/{concurrency}/{index}: ransomware campaigns against hospital networks"
+
+
+def start_stubs(args):
+    command = [sys.executable, '-m', 'benchmarks.stub_servers',
+               '--llm-latency', str(args.llm_latency), '--jitter', str(args.jitter),
+               '--token-rate', str(args.token_rate), '--error-rate', str(args.error_rate),
+               '--page-latency', str(args.page_latency), '--seed', '1']
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    line = process.stdout.readline()
+    if not line:
+        process.kill()
+        raise RuntimeError("stub servers did not start")
+    return process, json.loads(line)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of values (0 < q <= 100)."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_queries(pipeline, queries, concurrency, combined):
+    def one(query):
+        start = time.perf_counter()
+        result = pipeline.run(query, combined=combined)
+        failed = 'error' in result['response'] or 'error' in result['analysis']
+        return time.perf_counter() - start, failed, result['timings']
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench') as executor:
+        outcomes = list(executor.map(one, queries))
+    return time.perf_counter() - start, outcomes
+
+
+def measure(threat_analyzer, gpt_helper, rows, concurrency, args):
+    pipeline = AnalysisPipeline(gpt_helper, threat_analyzer, max_workers=concurrency)
+    try:
+        warmup = [QUERY.format(rows=rows, concurrency=concurrency, index=f"warmup-{i}")
+                  for i in range(args.warmup)]
+        run_queries(pipeline, warmup, concurrency, args.combined)
+        queries = [QUERY.format(rows=rows, concurrency=concurrency, index=i)
+                   for i in range(args.queries)]
+        wall, outcomes = run_queries(pipeline, queries, concurrency, args.combined)
+    finally:
+        pipeline.shutdown()
+
+    latencies = [seconds for seconds, _, _ in outcomes]
+    stages = {}
+    for stage in AnalysisPipeline.STAGES:
+        values = [timings[stage] for _, _, timings in outcomes if stage in timings]
+        if values:
+            stages[stage] = round(statistics.median(values) * 1000, 2)
+    return {
+        'db_rows': rows,
+        'concurrency': concurrency,
+        'mode': 'combined' if args.combined else 'two-call',
+        'queries': len(outcomes),
+        'errors': sum(failed for _, failed, _ in outcomes),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+        'qps': round(len(outcomes) / wall, 3),
+        'stage_p50_ms': stages,
+        'peak_rss_mb': round(peak_rss_mb(), 1) if resource is not None else None,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(run['db_rows'], run['concurrency'], run['mode']): run for run in baseline['runs']}
+    print(f"\nAgainst {baseline_path} (commit {baseline.get('commit')})")
+    print(f"  {'rows':>8}{'conc':>6}  {'p95 ms':>18}  {'qps':>18}")
+    matched = 0
+    for run in results['runs']:
+        before = previous.get((run['db_rows'], run['concurrency'], run['mode']))
+        if before is None:
+            continue
+        matched += 1
+        p95 = (run['p95_ms'] / before['p95_ms'] - 1) * 100 if before['p95_ms'] else 0.0
+        qps = (run['qps'] / before['qps'] - 1) * 100 if before['qps'] else 0.0
+        print(f"  {run['db_rows']:>8}{run['concurrency']:>6}  "
+              f"{before['p95_ms']:>8.0f} {p95:>+8.1f}%  {before['qps']:>8.2f} {qps:>+8.1f}%")
+    if not matched:
+        print("  no runs with the same rows, concurrency and mode")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--db-rows', type=int, nargs='+', default=[0, 10000])
+    parser.add_argument('--queries', type=int, default=48, help="measured queries per run")
+    parser.add_argument('--warmup', type=int, default=2, help="unmeasured queries per run")
+    parser.add_argument('--combined', action='store_true',
+                        help="analyze and tag in one request (LLM_COMBINED_MODE)")
+    parser.add_argument('--llm-latency', type=float, default=0.5)
+    parser.add_argument('--jitter', type=float, default=0.2)
+    parser.add_argument('--token-rate', type=float, default=0.0,
+                        help="stub completion tokens per second; 0 sends them at once")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--page-latency', type=float, default=0.05)
+    parser.add_argument('--output', default='bench_pipeline.json')
+    parser.add_argument('--compare', help="earlier --output file to compare against")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+
+    # Per-query logging (and retry warnings, with --error-rate) would
+    # drown the table; failed queries are counted in it instead
+    configure_logging('ERROR')
+    stubs, stub_env = start_stubs(args)
+    saved_env = {name: os.environ.get(name) for name in
+                 list(stub_env) + ['DATABASE_URL', 'SCRAPE_CACHE_DIR', 'CVE_MIRROR_URL']}
+    os.environ.pop('DATABASE_URL', None)
+    os.environ.update(stub_env)
+    cwd = os.getcwd()
+    results = {
+        'commit': current_commit(),
+        'created': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {key: value for key, value in vars(args).items()
+                     if key not in ('output', 'compare')},
+        'runs': [],
+    }
+
+    print(f"{args.queries} queries per run, LLM stub {args.llm_latency}s "
+          f"+/-{args.jitter:.0%}, {args.error_rate:.0%} errors")
+    print(f"  {'rows':>8}{'conc':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'qps':>9}{'errors':>8}{'rss MB':>9}")
+    try:
+        for rows in args.db_rows:
+            with tempfile.TemporaryDirectory() as directory:
+                os.chdir(directory)
+                os.environ['SCRAPE_CACHE_DIR'] = os.path.join(directory, 'scrape_cache')
+                os.environ['CVE_MIRROR_URL'] = f"sqlite:///{os.path.join(directory, 'cve_mirror.db')}"
+                try:
+                    db = Database()
+                    if rows:
+                        fill(db, rows, days=365)
+                    threat_analyzer = ThreatAnalyzer(db=db)
+                    gpt_helper = GPTHelper(cache=None)
+                    for concurrency in args.concurrency:
+                        run = measure(threat_analyzer, gpt_helper, rows, concurrency, args)
+                        results['runs'].append(run)
+                        print(f"  {rows:>8}{concurrency:>6}{run['p50_ms']:>10.0f}{run['p95_ms']:>10.0f}"
+                              f"{run['p99_ms']:>10.0f}{run['qps']:>9.2f}{run['errors']:>8}"
+                              f"{run['peak_rss_mb'] or 0:>9.0f}")
+                    threat_analyzer.shutdown()
+                    db.engine.dispose()
+                finally:
+                    os.chdir(cwd)
+    finally:
+        stubs.terminate()
+        stubs.wait()
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Measure what each new Streamlit session costs to set up.
+
+Compares building the services per session, as main.py used to
+(ThreatAnalyzer + GPTHelper + ResponseCache + AnalysisPipeline each time),
+with fetching the process-wide instances from utils.registry.
+
+    python -m benchmarks.bench_session_startup --sessions 20
+
+Uses the configured database (DATABASE_URL, else threat_database.db in the
+current directory). No LLM requests are made.
+"""
+import argparse
+import contextlib
+import io
+import statistics
+import time
+import tracemalloc
+
+from utils import registry
+from utils.gpt_helper import GPTHelper
+from utils.pipeline import AnalysisPipeline
+from utils.response_cache import ResponseCache
+from utils.threat_analyzer import ThreatAnalyzer
+
+
+def per_session_services():
+    threat_analyzer = ThreatAnalyzer()
+    gpt_helper = GPTHelper(cache=ResponseCache(db=threat_analyzer.db))
+    pipeline = AnalysisPipeline(gpt_helper, threat_analyzer)
+    return threat_analyzer, gpt_helper, pipeline
+
+
+def shared_services():
+    return registry.get_threat_analyzer(), registry.get_gpt_helper(), registry.get_pipeline()
+
+
+def measure(build, sessions):
+    timings = []
+    engines = set()
+    clients = set()
+    kept = []
+    tracemalloc.start()
+    for _ in range(sessions):
+        start = time.perf_counter()
+        # The constructors print setup diagnostics; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            threat_analyzer, gpt_helper, pipeline = build()
+        timings.append(time.perf_counter() - start)
+        engines.add(id(threat_analyzer.db.engine))
+        clients.add(id(gpt_helper.client))
+        # Sessions stay alive for as long as the browser tab is open
+        kept.append((threat_analyzer, gpt_helper, pipeline))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for threat_analyzer, _, pipeline in kept:
+        pipeline.shutdown()
+        threat_analyzer.shutdown()
+    return {
+        'first_ms': timings[0] * 1000,
+        'median_ms': statistics.median(timings[1:] or timings) * 1000,
+        'engines': len(engines),
+        'http_clients': len(clients),
+        'peak_kib': peak / 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=20)
+    args = parser.parse_args()
+
+    results = [
+        ('per-session construction', measure(per_session_services, args.sessions)),
+        ('shared registry', measure(shared_services, args.sessions)),
+    ]
+    registry.reset()
+
+    print(f"{args.sessions} sessions")
+    print(f"{'setup':<26}{'first ms':>10}{'median ms':>11}{'engines':>9}{'clients':>9}{'peak KiB':>10}")
+    for label, r in results:
+        print(f"{label:<26}{r['first_ms']:>10.1f}{r['median_ms']:>11.2f}{r['engines']:>9}"
+              f"{r['http_clients']:>9}{r['peak_kib']:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
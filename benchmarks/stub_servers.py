@@ -0,0 +1,338 @@
+"""Local stand-ins for OpenRouter and the scrape targets.
+
+    python -m benchmarks.stub_servers --llm-latency 0.8 --token-rate 60 --error-rate 0.02
+
+Starts two HTTP servers and prints one JSON line with their URLs, then the
+environment to point the app (or batch_analyze.py, or the job workers) at
+them:
+
+  LLM stub       OpenAI-compatible POST /v1/chat/completions, streamed or
+                 not. Answers with a canned analysis in the layout the
+                 analysis prompt asks for, tag JSON for tagging prompts and
+                 the combined JSON when a response_format is sent. Each
+                 answer takes --llm-latency seconds (+/- --jitter) plus its
+                 completion tokens at --token-rate tokens/s; --error-rate of
+                 requests fail with a 500 or a 429.
+  fixture pages  GET /cve?keyword=... and /exploitdb?q=... serve the saved
+                 result pages in benchmarks/fixtures after --page-latency
+                 (synthesized as in bench_extraction when missing).
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from benchmarks.bench_extraction import ensure_fixtures
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+FIXTURE_PAGES = {
+    '/cve': 'cve_search.html',
+    '/exploitdb': 'exploitdb_search.html',
+}
+
+SEVERITIES = ['Low', 'Medium', 'High', 'Critical']
+
+
+def _tokens(text):
+    return max(1, math.ceil(len(text) / 4))
+
+
+def canned_answer(messages, structured=False):
+    """The stub's completion for a request, varied per prompt."""
+    prompt = messages[-1]['content'] if messages else ''
+    seed = zlib.crc32(prompt.encode('utf-8'))
+    octets = [(seed >> shift) & 0xff for shift in (0, 8, 16, 24)]
+    ip = '.'.join(str(max(1, octet)) for octet in octets)
+    cve = f"CVE-20{20 + seed % 5}-{1000 + seed % 40000}"
+    actor = f"APT{seed % 50}"
+    tags = {
+        'TTP': 'T1566 Phishing, T1059 Command and Scripting Interpreter',
+        'attack_vector': 'Spear-phishing attachments',
+        'threat_actor': actor,
+        'target_sector': ['Healthcare', 'Finance', 'Energy', 'Government'][seed % 4],
+        'Severity Level': SEVERITIES[seed % 4],
+    }
+    if structured:
+        return json.dumps({
+            'analysis': {
+                'summary': f"{actor} campaign using spear-phishing for initial access.",
+                'attack_vectors': ['Spear-phishing attachments', 'Exploitation of public-facing apps'],
+                'ttps': ['T1566 Phishing', 'T1059 Command and Scripting Interpreter'],
+                'iocs': [ip, f"{seed:08x}" * 8, f"update-{seed % 997}.example.net"],
+                'cves': [f"{cve} remote code execution"],
+                'timeline': ['Reconnaissance of exposed services', 'Initial compromise by phishing',
+                             'Lateral movement over SMB', 'Exfiltration over HTTPS',
+                             'Persistence through scheduled tasks'],
+                'incident_reports': [f"Similar {actor} intrusions reported in 2023"],
+                'threat_intelligence': ['Infrastructure overlaps with earlier campaigns'],
+            },
+            'tags': tags,
+        })
+    if 'Tag the following' in prompt:
+        return json.dumps(tags)
+    return f"""Attack Vectors:
+- Spear-phishing attachments delivering loaders
+- Exploitation of public-facing applications
+
+TTPs:
+Tactics: Initial Access, Execution, Persistence
+Techniques: T1566 Phishing, T1059 Command and Scripting Interpreter
+Procedures: Macro documents drop a loader that beacons over HTTPS
+
+Indicators of Compromise (IoCs):
+- {ip}
+- {f"{seed:08x}" * 8}
+- update-{seed % 997}.example.net
+
+CVEs:
+- {cve}: remote code execution in a VPN appliance
+
+Attack Timeline:
+1. Reconnaissance: Scanning of exposed VPN and mail services
+2. Initial Compromise: Phishing email with a weaponized document
+3. Lateral Movement: SMB and remote services with stolen credentials
+4. Data Exfiltration: Archives uploaded over HTTPS
+5. Persistence: Scheduled tasks and new service accounts
+
+Incident Reports:
+Similar {actor} intrusions were reported against regional providers.
+
+Threat Intelligence:
+Infrastructure overlaps with earlier {actor} campaigns."""
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubLLMServer:
+    """OpenAI-compatible chat completions with configurable speed and errors."""
+
+    def __init__(self, latency=0.5, jitter=0.2, token_rate=0.0, error_rate=0.0,
+                 host='127.0.0.1', port=0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_rate = token_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _draw(self):
+        """(error status or None, seconds to wait) for one request."""
+        with self._lock:
+            self.requests += 1
+            status = None
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                # Half rate limits, half server errors; both are retried
+                status = 429 if self.random.random() < 0.5 else 500
+            spread = self.random.uniform(-self.jitter, self.jitter)
+        return status, max(0.0, self.latency * (1 + spread))
+
+    def _handler(self):
+        stub = self
+
+        class Handler(_QuietHandler):
+
+            def do_POST(self):
+                if not urlsplit(self.path).path.endswith('/chat/completions'):
+                    self._send(404, '{"error": {"message": "not found"}}')
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                status, delay = stub._draw()
+                time.sleep(delay)
+                if status == 429:
+                    self._send(429, '{"error": {"message": "rate limited"}}',
+                               headers={'Retry-After': '0'})
+                    return
+                if status is not None:
+                    self._send(status, '{"error": {"message": "stub failure"}}')
+                    return
+                text = canned_answer(request.get('messages', []),
+                                     structured=request.get('response_format') is not None)
+                if request.get('stream'):
+                    self._stream(request, text)
+                else:
+                    self._complete(request, text)
+
+            def _pace(self, tokens):
+                if stub.token_rate > 0:
+                    time.sleep(tokens / stub.token_rate)
+
+            def _usage(self, request, text):
+                prompt = sum(_tokens(message.get('content') or '') for message in request.get('messages', []))
+                completion = _tokens(text)
+                return {'prompt_tokens': prompt, 'completion_tokens': completion,
+                        'total_tokens': prompt + completion}
+
+            def _complete(self, request, text):
+                usage = self._usage(request, text)
+                self._pace(usage['completion_tokens'])
+                self._send(200, json.dumps({
+                    'id': 'stub-completion',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': request.get('model', 'stub'),
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': text}}],
+                    'usage': usage,
+                }))
+
+            def _stream(self, request, text):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                words = text.split(' ')
+                for index, word in enumerate(words):
+                    delta = word if index == len(words) - 1 else word + ' '
+                    self._pace(_tokens(delta))
+                    event = {
+                        'id': 'stub-completion',
+                        'object': 'chat.completion.chunk',
+                        'created': int(time.time()),
+                        'model': request.get('model', 'stub'),
+                        'choices': [{'index': 0, 'delta': {'content': delta}, 'finish_reason': None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='stub-llm', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FixtureServer:
+    """Serves the saved CVE and ExploitDB result pages for any query."""
+
+    def __init__(self, directory=FIXTURE_DIR, latency=0.0, host='127.0.0.1', port=0):
+        if directory == FIXTURE_DIR:
+            # The pages aren't checked in; synthesize any that are missing.
+            # stdout is reserved for the line main() prints
+            with contextlib.redirect_stdout(sys.stderr):
+                ensure_fixtures(directory)
+        self.pages = {}
+        for path, name in FIXTURE_PAGES.items():
+            with open(os.path.join(directory, name), 'rb') as f:
+                self.pages[path] = f.read()
+        self.latency = latency
+        self.requests = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    def url(self, source):
+        host, port = self.server.server_address[:2]
+        return {'cve': f"http://{host}:{port}/cve?keyword=",
+                'exploitdb': f"http://{host}:{port}/exploitdb?q="}[source]
+
+    def _handler(self):
+        fixtures = self
+
+        class Handler(_QuietHandler):
+
+            def do_GET(self):
+                page = fixtures.pages.get(urlsplit(self.path).path)
+                fixtures.requests += 1
+                time.sleep(fixtures.latency)
+                if page is None:
+                    self._send(404, 'not found', 'text/plain')
+                else:
+                    self._send(200, page, 'text/html; charset=utf-8')
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fixtures', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def environment(llm_url, cve_url, exploitdb_url):
+    """Settings that point GPTHelper and ThreatAnalyzer at the stubs."""
+    return {
+        'OPENROUTER_BASE_URL': llm_url,
+        'OPENROUTER_API_KEY': 'stub-key',
+        'SCRAPE_CVE_URL': cve_url,
+        'SCRAPE_EXPLOITDB_URL': exploitdb_url,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--llm-port', type=int, default=0)
+    parser.add_argument('--pages-port', type=int, default=0)
+    parser.add_argument('--llm-latency', type=float, default=0.5,
+                        help="seconds before each answer (default: 0.5)")
+    parser.add_argument('--jitter', type=float, default=0.2,
+                        help="latency spread as a fraction, uniform (default: 0.2)")
+    parser.add_argument('--token-rate', type=float, default=0.0,
+                        help="completion tokens per second; 0 sends them at once (default: 0)")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="fraction of requests answered with 429/500 (default: 0)")
+    parser.add_argument('--page-latency', type=float, default=0.05,
+                        help="seconds before each fixture page (default: 0.05)")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    llm = StubLLMServer(latency=args.llm_latency, jitter=args.jitter, token_rate=args.token_rate,
+                        error_rate=args.error_rate, host=args.host, port=args.llm_port,
+                        seed=args.seed).start()
+    pages = FixtureServer(latency=args.page_latency, host=args.host, port=args.pages_port).start()
+    env = environment(llm.url, pages.url('cve'), pages.url('exploitdb'))
+    # First line is for scripts (benchmarks.bench_pipeline reads it)
+    print(json.dumps(env), flush=True)
+    for name, value in env.items():
+        print(f"export {name}='{value}'", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        llm.stop()
+        pages.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,16 @@
 import streamlit as st
 import os
+import re
+import time
+from templates.prompts import ANALYSIS_SECTIONS
+from utils.registry import get_threat_analyzer, get_pipeline
+from utils.report_parser import SECTION_TITLES, ReportSections, parse_analysis
+from utils.ioc_extractor import normalize_ioc
+
+SECTION_HEADER_PATTERN = re.compile(
+    r"^\s*(" + "|".join(re.escape(header) for header in ANALYSIS_SECTIONS) + r"):",
+    re.MULTILINE
+)
 
 def render_header():
     st.title("Cyber Threat Analysis Platform")
@@ -16,10 +27,43 @@ def render_sidebar():
     )
     export_format = st.sidebar.selectbox(
         "Export Format",
-        ["csv", "json"]
+        ["csv", "json", "ndjson", "parquet"]
     )
     return analysis_type, export_format
 
+def render_analysis_options():
+    st.sidebar.subheader("Analysis Options")
+    options = {
+        "combined": st.sidebar.checkbox(
+            "Analyze and tag in one request", value=get_pipeline().combined,
+            help="One structured-output call returns the report and the tags; "
+                 "saves a round trip and the tokens of re-sending the analysis"
+        ),
+    }
+    options["stream"] = st.sidebar.checkbox(
+        "Stream responses", value=True, disabled=options["combined"],
+        help="Show each report section as soon as the model finishes it"
+    ) and not options["combined"]
+    options.update({
+        "reuse": st.sidebar.checkbox(
+            "Reuse similar past analyses", value=True,
+            help="Show a stored analysis instead of calling the model when a past query is close enough"
+        ),
+        "background": st.sidebar.checkbox(
+            "Run in background worker", value=False,
+            help="Queue the analysis for a job worker (the app's own JOB_WORKERS threads or `python -m utils.jobs worker`) and poll until it finishes"
+        ),
+        "profile": st.sidebar.checkbox(
+            "Profile this analysis", value=False,
+            help="Record a profile of the analysis run (pyinstrument if installed, else cProfile)"
+        ),
+    })
+    options["similarity_threshold"] = st.sidebar.slider(
+        "Similarity threshold", min_value=0.5, max_value=1.0, value=0.75, step=0.05,
+        disabled=not options["reuse"]
+    )
+    return options
+
 def render_query_section(templates):
     st.subheader("Query Input")
     use_template = st.checkbox("Use Template")
@@ -46,7 +90,9 @@ def render_query_section(templates):
 
     return query
 
-def render_response(response, tags):
+def render_response(response, tags, sections=None):
+    """Render an analysis. `sections` are the ReportSections stored with the
+    row; responses without them are parsed here once."""
     st.subheader("Threat Analysis Report")
 
     with st.container():
@@ -59,110 +105,38 @@ def render_response(response, tags):
             elif "status" in response and response["status"] == "success":
                 st.success("Analysis Complete")
 
+                if sections is None:
+                    sections = parse_analysis(response)
+                elif isinstance(sections, dict):
+                    sections = ReportSections.from_dict(sections)
+
+                if sections is None or sections.is_empty():
+                    # Nothing recognisable; show the model output as is
+                    st.markdown("### Analysis Details")
+                    st.markdown(response["data"].get("content", ""))
+                else:
+                    render_sections(sections)
+
                 if response["format"] == "json":
-                    data = response["data"]
-                    st.markdown("## 📊 Threat Analysis Report")
-                    st.markdown("---")
-
-                    if "attack_vector" in data:
-                        st.markdown("### 🎯 Attack Vector Analysis")
-                        cleaned_text = data["attack_vector"].replace('\\boxed{', '').replace('}', '')
-                        vectors = cleaned_text.split(". ")
-                        for vector in vectors:
-                            if vector.strip():
-                                st.markdown(f"• {vector.strip()}")
-                        st.markdown("")
-
-                    if "timeline" in data:
-                        st.markdown("### ⏱️ Attack Timeline")
-                        timeline_text = data["timeline"].replace('\\boxed{', '').replace('}', '')
-                        steps = [step for step in timeline_text.split(". ") if step.strip()]
-
-                        for i, step in enumerate(steps, 1):
-                            step = step.lstrip("123456789. ")
-                            st.markdown(f"**{i}.** {step}")
-                        st.markdown("")
-
-                    if "impact" in data:
-                        st.markdown("### 💥 Potential Impact")
-                        cleaned_text = data["impact"].replace('\\boxed{', '').replace('}', '')
-                        impacts = [imp.strip() for imp in cleaned_text.split(".") if imp.strip()]
-
-                        for impact in impacts:
-                            st.markdown(f"• {impact}")
-                        st.markdown("")
-
-                    if "mitigation" in data:
-                        st.markdown("### 🛡️ Recommended Mitigations")
-                        cleaned_text = data["mitigation"].replace('\\boxed{', '').replace('}', '')
-                        mitigations = [mit.strip() for mit in cleaned_text.split(". ") if mit.strip()]
-
-                        for i, mitigation in enumerate(mitigations, 1):
-                            if mitigation.lower().startswith("recommended"):
-                                mitigation = mitigation.split(":", 1)[1].strip()
-                            st.markdown(f"**{i}.** {mitigation}")
-
-                elif response["format"] == "text":
-                    try:
-                        # Try to parse the content as JSON after cleaning
-                        content = response["data"]["content"].replace('\\boxed{', '').replace('}', '')
-                        data = eval(content)
-
-                        st.markdown("## 📊 Detailed Analysis Report")
-
-                        if "attack_vector" in data:
-                            st.markdown("### 🎯 Attack Vector Analysis")
-                            st.text(data["attack_vector"])
-                            st.markdown("---")
-
-                        if "timeline" in data:
-                            st.markdown("### ⏱️ Attack Timeline")
-                            timeline_items = data['timeline'].split(".")
-                            for item in timeline_items:
-                                if item.strip():
-                                    st.markdown(f"- {item.strip()}")
-                            st.markdown("---")
-
-                        if "impact" in data:
-                            st.markdown("### 💥 Impact Analysis")
-                            impact_items = data['impact'].replace('-', '•').split("•")
-                            for item in impact_items:
-                                if item.strip():
-                                    st.markdown(f"- {item.strip()}")
-                            st.markdown("---")
-
-                        if "mitigation" in data:
-                            st.markdown("### 🛡️ Mitigation Strategies")
-                            mitigation_items = data['mitigation'].replace('-', '•').split("•")
-                            for item in mitigation_items:
-                                if item.strip():
-                                    st.markdown(f"- {item.strip()}")
-                            st.markdown("---")
-
-                        # Display raw response in expander
-                        with st.expander("View Raw JSON Response"):
-                            st.json(data)
-
-                    except:
-                        # Fallback to plain text display if parsing fails
-                        st.markdown("### Analysis Details")
-                        clean_content = response["data"]["content"].replace('\\boxed{', '').replace('}', '')
-                        st.markdown(clean_content)
+                    with st.expander("View Raw JSON Response"):
+                        st.json(response["data"])
 
             # Generate and display formatted report
             if isinstance(response, dict) and 'api_response' in response:
+                threat_analyzer = get_threat_analyzer()
                 # Display the current analysis report
-                report = st.session_state.threat_analyzer.generate_threat_report(response)
+                report = threat_analyzer.generate_threat_report(response)
                 st.markdown(report)
 
                 # Display historical analysis in an expander
                 with st.expander("📚 View Historical Analysis"):
-                    history_df = st.session_state.threat_analyzer.get_historical_analysis()
-                    if not history_df.empty:
-                        st.dataframe(
-                            history_df[['timestamp', 'query']].sort_values('timestamp', ascending=False),
-                            use_container_width=True
-                        )
+                    page = threat_analyzer.get_analysis_page(
+                        columns=('timestamp', 'query'), limit=100
+                    )
+                    if page['rows']:
+                        st.dataframe(page['rows'], use_container_width=True)
+                        if page['next_cursor'] is not None:
+                            st.caption("Showing the 100 most recent analyses.")
                     else:
                         st.info("No historical analysis available yet.")
 
@@ -180,4 +154,223 @@ def render_response(response, tags):
                 if "target_sector" in tags:
                     st.markdown(f"**Target Sector:** {tags['target_sector']}")
                 if "Severity Level" in tags:
-                    st.markdown(f"**Severity Level:** {tags['Severity Level']}")
\ No newline at end of file
+                    st.markdown(f"**Severity Level:** {tags['Severity Level']}")
+
+def render_sections(sections):
+    st.markdown("## 📊 Threat Analysis Report")
+    st.markdown("---")
+    if sections.summary:
+        st.markdown(sections.summary)
+    for name, title, numbered in SECTION_TITLES:
+        items = getattr(sections, name)
+        if not items:
+            continue
+        st.markdown(f"### {title}")
+        for i, item in enumerate(items, 1):
+            st.markdown(f"**{i}.** {item}" if numbered else f"• {item}")
+        st.markdown("")
+    if sections.cve_ids:
+        st.caption("CVEs mentioned: " + ", ".join(sections.cve_ids))
+
+def render_response_stream(stream, area=None):
+    """Render the analysis section by section while it streams in.
+
+    A section is drawn as soon as the next section header shows up; the
+    section still being generated is shown as raw text underneath.
+    """
+    area = area if area is not None else st.empty()
+    with area.container():
+        st.subheader("Threat Analysis Report")
+        completed_area = st.container()
+        current_area = st.empty()
+
+    text = ""
+    rendered = 0
+    for chunk in stream:
+        text += chunk
+        headers = list(SECTION_HEADER_PATTERN.finditer(text))
+        # Every header except the last one is followed by another, so the
+        # text between them is final
+        while rendered < len(headers) - 1:
+            _render_stream_section(completed_area, text, headers[rendered],
+                                   headers[rendered + 1].start())
+            rendered += 1
+        current_area.text(text[headers[rendered].start():] if headers else text)
+
+    headers = list(SECTION_HEADER_PATTERN.finditer(text))
+    if rendered < len(headers):
+        _render_stream_section(completed_area, text, headers[rendered], len(text))
+    current_area.empty()
+    return area
+
+def _render_stream_section(container, text, header, end):
+    body = text[header.end():end].strip()
+    container.markdown(f"### {header.group(1)}")
+    if body:
+        container.text(body)
+
+def render_reused_analysis(analysis, query):
+    st.info(f"Showing a stored analysis of a similar question "
+            f"(similarity {analysis['similarity']:.0%}): \"{analysis['query'].strip()}\" "
+            f"from {analysis['timestamp'][:16].replace('T', ' ')}")
+
+    def run_fresh():
+        st.session_state['force_fresh_query'] = query
+
+    st.button("Run a fresh analysis instead", on_click=run_fresh)
+
+    response = analysis['response'] or {}
+    api_response = response.get('api_response', response)
+    if isinstance(api_response, dict) and 'status' not in api_response and 'error' not in api_response:
+        # Rows stored before responses were wrapped in the API envelope
+        api_response = {"status": "success", "format": "json", "data": api_response}
+    render_response(api_response, analysis['tags'], sections=response.get("sections"))
+
+def render_scraper_stats(stats):
+    with st.sidebar.expander("Scrape Cache"):
+        st.markdown(f"**Hit rate:** {stats['hit_rate']:.0%}")
+        st.markdown(f"**Hits:** {stats['hits']} · **Revalidated:** {stats['revalidated']} · "
+                    f"**Shared:** {stats['coalesced']}")
+        st.markdown(f"**Fetches:** {stats['fetches']} ({stats['errors']} failed)")
+        if stats['fetches']:
+            st.caption(f"Fetch latency p50 {stats['fetch_p50'] * 1000:.0f} ms, "
+                       f"max {stats['fetch_max'] * 1000:.0f} ms")
+
+def render_search_section(threat_analyzer):
+    st.subheader("Search Past Analyses")
+    search_text = st.text_input("Search queries and reports",
+                                placeholder="e.g. Volt Typhoon, CVE-2023-34362, phishing")
+    if not search_text:
+        return
+
+    ioc_type, _ = normalize_ioc(search_text)
+    if ioc_type is not None:
+        # An indicator: exact lookup in the IoC index
+        start = time.perf_counter()
+        matches = threat_analyzer.find_analyses_by_ioc(search_text, ioc_type=ioc_type, limit=20)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        st.caption(f"{len(matches)} analyses mention this {ioc_type.upper()} ({elapsed_ms:.1f} ms)")
+        for match in matches:
+            st.markdown(f"**{match['query'].strip()}** · {match['timestamp'][:16].replace('T', ' ')}")
+
+    start = time.perf_counter()
+    results = threat_analyzer.search_analyses(search_text, limit=20)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    st.caption(f"{len(results)} result(s) in {elapsed_ms:.1f} ms")
+    for result in results:
+        st.markdown(f"**{result['query'].strip()}** · {result['timestamp'][:16].replace('T', ' ')}")
+        if result['snippet']:
+            st.markdown(f"> {' '.join(result['snippet'].split())}")
+
+def render_dashboard(visualizer):
+    st.subheader("Threat Dashboard")
+    start = time.perf_counter()
+    figures = visualizer.dashboard_figures()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if not figures:
+        st.info("No analyses stored yet.")
+        return
+    st.plotly_chart(figures['timeline'], use_container_width=True)
+    left, right = st.columns(2)
+    with left:
+        st.plotly_chart(figures['severity'], use_container_width=True)
+    with right:
+        st.plotly_chart(figures['actors'], use_container_width=True)
+    indicators = visualizer.db.heavy_hitters('indicators', k=10)
+    if indicators:
+        with st.expander("🔎 Most Mentioned Indicators"):
+            st.dataframe([{"Indicator": key, "Analyses": count} for key, count in indicators],
+                         use_container_width=True)
+    st.caption(f"Figures ready in {elapsed_ms:.1f} ms "
+               f"({visualizer.hits} cached, {visualizer.misses} rebuilt since startup)")
+
+def render_timings(timings, usage=None):
+    with st.expander("⏱️ Timing Breakdown"):
+        stages = [
+            ("Analysis (LLM)" if "tagging" in timings else "Analysis + tagging (LLM, one call)",
+             "analysis"),
+            ("Tagging (LLM)", "tagging"),
+            ("Scraping (CVE + ExploitDB)", "scrape"),
+            ("Storage", "storage"),
+        ]
+        for label, key in stages:
+            if key in timings:
+                st.markdown(f"**{label}:** {timings[key]:.2f}s")
+        if "total" in timings:
+            st.markdown(f"**End-to-end:** {timings['total']:.2f}s")
+        if usage and usage.get("llm_calls"):
+            approx = "~" if usage.get("estimated") else ""
+            st.markdown(f"**Tokens:** {approx}{usage['total_tokens']} "
+                        f"({approx}{usage['prompt_tokens']} prompt) over "
+                        f"{usage['llm_calls']} LLM call(s)")
+        if "serial" in timings and timings.get("total"):
+            saved = timings["serial"] - timings["total"]
+            st.caption(f"Sequential stages would have taken {timings['serial']:.2f}s "
+                       f"({saved:.2f}s saved by running scraping concurrently)")
+
+def render_profile(run):
+    if run is None:
+        return
+    with st.expander("🔬 Profile"):
+        if run.skipped:
+            st.info(f"Not profiled: {run.skipped}")
+            return
+        st.caption(f"Saved to `{run.path}`")
+        st.code(run.report[:20000], language="text")
+
+def render_cache_stats(stats):
+    with st.sidebar.expander("Response Cache"):
+        st.markdown(f"**Hits:** {stats['hits']} "
+                    f"({stats['memory_hits']} memory, {stats['persistent_hits']} database)")
+        st.markdown(f"**Misses:** {stats['misses']}")
+        st.markdown(f"**Hit rate:** {stats['hit_rate']:.0%}")
+        st.caption(f"{stats['memory_entries']} responses held in memory")
+
+def render_llm_stats(stats):
+    with st.sidebar.expander("LLM Calls"):
+        st.markdown(f"**API calls:** {stats['calls']} · **Shared:** {stats['coalesced']}")
+        st.markdown(f"**Retries:** {stats['retries']} · **Hedged:** {stats['hedges']} "
+                    f"({stats['hedge_wins']} won) · **Fallbacks:** {stats['fallbacks']}")
+        for model, model_stats in stats["models"].items():
+            latency = model_stats["latency"]
+            line = f"`{model}` · circuit {model_stats['breaker']}"
+            if latency["count"]:
+                line += (f" · p50 {latency['p50']:.1f}s, p95 {latency['p95']:.1f}s, "
+                         f"p99 {latency['p99']:.1f}s over {latency['count']} calls")
+            st.caption(line)
+
+def render_job_status(job, analysis=None, waited=0.0, claim_timeout=30, run_timeout=600):
+    """Show a background job; returns True while it is still worth polling.
+
+    Polling stops once a job has waited `claim_timeout` seconds without a
+    worker claiming it, or has been in flight for `run_timeout` seconds.
+    """
+    if job is None:
+        st.error("The queued analysis job no longer exists")
+        return False
+    if job["status"] == "queued" and waited > claim_timeout:
+        st.error(f"Job #{job['id']} has not been picked up by a worker after {waited:.0f}s. "
+                 "Check that JOB_WORKERS is not 0, or start workers with "
+                 "`python -m utils.jobs worker`. The job stays queued and will run "
+                 "once a worker is available.")
+        return False
+    if job["status"] in ("queued", "running") and waited > run_timeout:
+        st.warning(f"Job #{job['id']} is still {job['status']} after {waited:.0f}s; "
+                   "stopped waiting for it. Check its status with "
+                   f"`python -m utils.jobs status {job['id']}`.")
+        return False
+    if job["status"] in ("queued", "running"):
+        label = "Waiting for a worker" if job["status"] == "queued" else f"Running on {job['worker']}"
+        st.info(f"⏳ Job #{job['id']}: {label} — \"{job['query'].strip()}\"")
+        return True
+    if job["status"] == "failed":
+        st.error(f"Job #{job['id']} failed: {job['error']}")
+        return False
+
+    st.success(f"✅ Job #{job['id']} finished and was stored as analysis #{job['analysis_id']}")
+    if analysis is not None:
+        response = analysis["response"] or {}
+        render_response(response.get("api_response", response), analysis["tags"],
+                        sections=response.get("sections"))
+    return False
@@ -1,61 +1,172 @@
-import plotly.express as px
+import math
+import threading
+from datetime import timedelta
 import plotly.graph_objects as go
 import pandas as pd
 
+SEVERITY_COLORS = {
+    'Low': 'green',
+    'Medium': 'yellow',
+    'High': 'orange',
+    'Critical': 'red',
+    'Unknown': 'gray'
+}
+
+# Timeline bucket sizes, finest first, with their (approximate) length
+BUCKET_LENGTHS = [
+    ('hour', timedelta(hours=1)),
+    ('day', timedelta(days=1)),
+    ('week', timedelta(weeks=1)),
+    ('month', timedelta(days=31)),
+]
+
+
 class ThreatVisualizer:
+    """Dashboard figures drawn from aggregates computed in the database.
+
+    Nothing here loads individual analyses: whole-history counts per
+    severity, actor and day come from the rollups Database keeps, and
+    filtered or hourly timelines from GROUP BY queries on analysis_tags.
+    Finished figures are kept as plotly specs keyed on the database
+    high-water mark, so reruns and other sessions reuse them until an
+    analysis is stored.
+    """
+
+    def __init__(self, db, max_points=200):
+        self.db = db
+        # Most time buckets a timeline draws; longer histories use
+        # coarser buckets
+        self.max_points = max_points
+        self._lock = threading.Lock()
+        self._figures = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key, build, mark=None):
+        if mark is None:
+            mark = self.db.high_water_mark()
+        with self._lock:
+            entry = self._figures.get(key)
+            if entry is not None and entry[0] == mark:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        spec = build().to_dict()
+        with self._lock:
+            self._figures[key] = (mark, spec)
+        return spec
+
+    def choose_bucket(self, start, end):
+        """The finest bucket that keeps the span within max_points bars."""
+        span = end - start
+        for bucket, length in BUCKET_LENGTHS:
+            if span / length <= self.max_points:
+                return bucket
+        return BUCKET_LENGTHS[-1][0]
+
+    def timeline_counts(self, start=None, end=None, tags=None):
+        """Severity counts per time bucket as a DataFrame, and the bucket used."""
+        oldest, newest = self.db.timestamp_range(tags=tags)
+        if oldest is None:
+            return pd.DataFrame(columns=['bucket', 'severity', 'count']), 'day'
+        bucket = self.choose_bucket(start or oldest, end or newest)
+        if bucket != 'hour' and start is None and end is None and not tags:
+            # The per-day rollups cover the whole history
+            counts = self.rollup_timeline(bucket)
+        else:
+            counts = pd.DataFrame(
+                self.db.count_by_time(bucket, 'Severity Level', start=start, end=end, tags=tags),
+                columns=['bucket', 'severity', 'count']
+            )
+        return self.downsample(counts, self.max_points), bucket
+
+    def rollup_timeline(self, bucket='day'):
+        """Per-day severity rollups regrouped into day, week or month buckets."""
+        rows = self.db.rollup_counts('day_severity')
+        counts = pd.DataFrame([key.split('|', 1) + [count] for key, _, count in rows],
+                              columns=['bucket', 'severity', 'count'])
+        counts['bucket'] = pd.to_datetime(counts['bucket'])
+        if bucket == 'week':
+            counts['bucket'] -= pd.to_timedelta(counts['bucket'].dt.weekday, unit='D')
+        elif bucket == 'month':
+            counts['bucket'] = counts['bucket'].dt.to_period('M').dt.start_time
+        return counts.groupby(['bucket', 'severity'], as_index=False)['count'].sum()
+
     @staticmethod
-    def create_threat_timeline(df):
-        # Create a copy of the dataframe
-        df_plot = df.copy()
-        
-        # Convert timestamp to datetime if it's not already
-        if not pd.api.types.is_datetime64_any_dtype(df_plot['timestamp']):
-            df_plot['timestamp'] = pd.to_datetime(df_plot['timestamp'])
-        
-        # Add end time (timestamp + 1 day) for timeline visualization
-        df_plot['end_time'] = df_plot['timestamp'] + pd.Timedelta(days=1)
-        
-        # Extract severity level from tags dictionary for coloring
-        def extract_severity(tags_col):
-            if isinstance(tags_col, dict) and 'Severity Level' in tags_col:
-                return tags_col['Severity Level']
-            elif isinstance(tags_col, str):
-                try:
-                    tags_dict = eval(tags_col)
-                    if isinstance(tags_dict, dict) and 'Severity Level' in tags_dict:
-                        return tags_dict['Severity Level']
-                except:
-                    pass
-            return 'Unknown'
-        
-        # Add severity column for coloring
-        df_plot['severity'] = df_plot['tags'].apply(extract_severity)
-        
-        fig = px.timeline(
-            df_plot,
-            x_start='timestamp',
-            x_end='end_time',
-            y='query',
-            color='severity',  # Use the new severity column instead of tags
-            title='Threat Analysis Timeline',
-            color_discrete_map={
-                'Low': 'green',
-                'Medium': 'yellow',
-                'High': 'orange',
-                'Critical': 'red',
-                'Unknown': 'gray'
-            }
+    def downsample(counts, max_points):
+        """Merge neighbouring buckets until at most max_points remain."""
+        buckets = counts['bucket'].drop_duplicates().sort_values()
+        if len(buckets) <= max_points:
+            return counts
+        factor = math.ceil(len(buckets) / max_points)
+        # Each bucket is relabelled with the first bucket of its group
+        first = pd.Series(buckets.values[::factor].repeat(factor)[:len(buckets)], index=buckets.values)
+        merged = counts.assign(bucket=counts['bucket'].map(first))
+        return merged.groupby(['bucket', 'severity'], as_index=False)['count'].sum()
+
+    def timeline_figure(self, start=None, end=None, tags=None, mark=None):
+        def build():
+            counts, bucket = self.timeline_counts(start=start, end=end, tags=tags)
+            return self.create_threat_timeline(counts, bucket)
+        key = ('timeline', start, end, tuple(sorted((tags or {}).items())))
+        return self._cached(key, build, mark)
+
+    def severity_figure(self, mark=None):
+        def build():
+            counts = pd.DataFrame([(key, count) for key, _, count in self.db.rollup_counts('severity')],
+                                  columns=['value', 'count'])
+            return self.create_threat_distribution(counts, title='Severity Mix', colors=SEVERITY_COLORS)
+        return self._cached(('severity',), build, mark)
+
+    def actor_figure(self, limit=10, mark=None):
+        def build():
+            counts = pd.DataFrame([(label, count) for _, label, count
+                                   in self.db.rollup_counts('actor', limit=limit)],
+                                  columns=['value', 'count'])
+            return self.create_top_values(counts, title=f'Top {limit} Threat Actors')
+        return self._cached(('actors', limit), build, mark)
+
+    def dashboard_figures(self):
+        """The dashboard's figure specs by name, checked against one high-water mark."""
+        mark = self.db.high_water_mark()
+        if mark[1] == 0:
+            return {}
+        return {
+            'timeline': self.timeline_figure(mark=mark),
+            'severity': self.severity_figure(mark=mark),
+            'actors': self.actor_figure(mark=mark),
+        }
+
+    @staticmethod
+    def create_threat_timeline(counts, bucket='day'):
+        """Stacked bars of analyses per time bucket, coloured by severity."""
+        fig = go.Figure()
+        for severity, color in SEVERITY_COLORS.items():
+            rows = counts[counts['severity'] == severity]
+            if len(rows):
+                fig.add_trace(go.Bar(x=rows['bucket'], y=rows['count'], name=severity,
+                                     marker_color=color))
+        fig.update_layout(
+            title=f'Threat Analysis Timeline (per {bucket})',
+            barmode='stack',
+            bargap=0.1,
+            yaxis_title='Analyses',
+            legend_title='Severity'
         )
         return fig
 
     @staticmethod
-    def create_threat_distribution(df):
-        tag_counts = df['tags'].value_counts()
-        fig = px.pie(
-            values=tag_counts.values,
-            names=tag_counts.index,
-            title='Distribution of Threat Types'
-        )
+    def create_threat_distribution(counts, title='Distribution of Threat Types', colors=None):
+        marker = {'colors': [colors.get(value) for value in counts['value']]} if colors else None
+        fig = go.Figure(go.Pie(values=counts['count'], labels=counts['value'], marker=marker,
+                               sort=False))
+        fig.update_layout(title=title)
+        return fig
+
+    @staticmethod
+    def create_top_values(counts, title):
+        fig = go.Figure(go.Bar(x=counts['count'][::-1], y=counts['value'][::-1], orientation='h'))
+        fig.update_layout(title=title, xaxis_title='Analyses')
         return fig
 
     @staticmethod
@@ -66,7 +177,7 @@ class ThreatVisualizer:
             'High': 75,
             'Critical': 100
         }
-        
+
         fig = go.Figure(go.Indicator(
             mode = "gauge+number",
             value = severity_map.get(severity_level, 0),
@@ -1,59 +1,172 @@
+import os
+import time
+# Start-up timing; on reruns the imports below are already cached
+_script_started = time.perf_counter()
 import streamlit as st
-import pandas as pd
-from utils.gpt_helper import GPTHelper
-from utils.threat_analyzer import ThreatAnalyzer
+from utils.exporter import AnalysisExporter
+from utils.registry import (get_threat_analyzer, get_gpt_helper, get_pipeline, get_job_queue,
+                            get_job_workers, get_visualizer)
+from utils.instrumentation import RENDER_SECONDS, record_startup, start_metrics_server
 from templates.prompts import PROMPT_TEMPLATES, SAMPLE_QUERIES
 from components.ui import (
     render_header,
     render_sidebar,
     render_query_section,
-    render_response
+    render_response,
+    render_response_stream,
+    render_analysis_options,
+    render_timings,
+    render_profile,
+    render_cache_stats,
+    render_search_section,
+    render_reused_analysis,
+    render_scraper_stats,
+    render_job_status,
+    render_dashboard,
+    render_llm_stats
 )
+record_startup('imports', time.perf_counter() - _script_started)
 
-# Initialize session state
-if 'threat_analyzer' not in st.session_state:
-    st.session_state.threat_analyzer = ThreatAnalyzer()
-if 'gpt_helper' not in st.session_state:
-    st.session_state.gpt_helper = GPTHelper()
+# Shared by every session in this process; built on first use
+threat_analyzer = get_threat_analyzer()
+gpt_helper = get_gpt_helper()
+pipeline = get_pipeline()
+job_queue = get_job_queue()
+# In-process workers for background mode (JOB_WORKERS, default 1)
+get_job_workers()
+# /metrics on METRICS_PORT, if set; started once per process
+start_metrics_server()
+record_startup('services', time.perf_counter() - _script_started)
 
 def main():
     render_header()
     analysis_type, export_format = render_sidebar()
+    options = render_analysis_options()
+    render_cache_stats(gpt_helper.cache.stats())
+    render_scraper_stats(threat_analyzer.scraper.stats())
+    render_llm_stats(gpt_helper.llm.stats())
     
     # Main content area
     query = render_query_section(PROMPT_TEMPLATES)
     
-    if st.button("Analyze"):
-        with st.spinner("Analyzing threat data..."):
-            # Get GPT analysis
-            response = st.session_state.gpt_helper.analyze_threat(query)
-            
-            # Tag the response
-            tags = st.session_state.gpt_helper.tag_threat_data(str(response))
-            
-            # Store the analysis
-            analysis = st.session_state.threat_analyzer.store_response(
-                query, response, tags
+    analyze_clicked = st.button("Analyze")
+    # Set by "Run a fresh analysis instead" to skip reuse for this query once
+    force_fresh = bool(query) and st.session_state.get('force_fresh_query') == query
+    if force_fresh:
+        del st.session_state['force_fresh_query']
+
+    if analyze_clicked or force_fresh:
+        similar = None
+        if options["reuse"] and not force_fresh and query.strip():
+            similar = threat_analyzer.find_similar_analysis(
+                query, threshold=options["similarity_threshold"]
             )
+
+        if similar is not None:
+            render_reused_analysis(similar, query)
+        elif options["background"]:
+            # Workers run the pipeline; the page polls the job below
+            st.session_state['active_job'] = job_queue.enqueue(query)
+            st.session_state['active_job_since'] = time.monotonic()
+        else:
+            stream_area = st.empty()
+            render_stream = None
+            if options["stream"]:
+                render_stream = lambda stream: render_response_stream(stream, stream_area)
+
+            with st.spinner("Analyzing threat data..."):
+                # Analyze, tag, scrape and store; scraping overlaps the LLM calls
+                result = pipeline.run(query, render_stream=render_stream,
+                                      combined=options["combined"],
+                                      profile=options["profile"] or None)
+                response = result['response']
+                tags = result['tags']
+                analysis = result['analysis']
             
-            # Indicate successful storage
-            if 'error' not in analysis:
-                st.success("✅ Analysis stored successfully")
+                # Indicate successful storage
+                if 'error' not in analysis:
+                    st.success("✅ Analysis stored successfully")
             
-            # Display response
-            render_response(response, tags)
+                # Display response, replacing the streamed preview
+                stream_area.empty()
+                stored = analysis.get('response')
+                sections = stored.get('sections') if isinstance(stored, dict) else None
+                render_response(response, tags, sections=sections)
+                render_timings(result['timings'], result['usage'])
+                render_profile(result['profile'])
             
+    if 'active_job' in st.session_state:
+        job = job_queue.get(st.session_state['active_job'])
+        analysis = None
+        if job is not None and job['status'] == 'done':
+            analysis = threat_analyzer.db.get_analysis(job['analysis_id'])
+        waited = time.monotonic() - st.session_state.get('active_job_since', time.monotonic())
+        if render_job_status(job, analysis, waited=waited,
+                             claim_timeout=float(os.environ.get('JOB_CLAIM_TIMEOUT', 30)),
+                             run_timeout=float(os.environ.get('JOB_RUN_TIMEOUT', 600))):
+            time.sleep(1)
+            st.rerun()
+        del st.session_state['active_job']
+        st.session_state.pop('active_job_since', None)
+
+    with RENDER_SECONDS.time(section='dashboard'):
+        # Built here, below the query form, so pandas and plotly load
+        # after the top of the page has been sent
+        render_dashboard(get_visualizer())
+
+    with RENDER_SECONDS.time(section='search'):
+        render_search_section(threat_analyzer)
+
     # Export section
     st.subheader("Export Analysis")
+    compress_export = st.checkbox("Compress export (gzip)")
     if st.button("Export Data"):
-        data = st.session_state.threat_analyzer.export_analysis(format=export_format)
-        if data:
-            st.download_button(
-                label=f"Download {export_format.upper()}",
-                data=data,
-                file_name=f"threat_analysis.{export_format}",
-                mime=f"text/{export_format}"
-            )
+        exporter = AnalysisExporter(threat_analyzer.db)
+        # The download button sends the file from memory, so larger exports
+        # are left to the command line; checked before anything is written
+        max_bytes = float(os.environ.get("EXPORT_DOWNLOAD_MAX_MB", 100)) * 1024 * 1024
+        command = (f"python -m utils.exporter {export_format} "
+                   f"{exporter.filename(export_format, compress_export)}"
+                   f"{' --gzip' if compress_export else ''}")
+        estimate = exporter.estimate_size(export_format, compress=compress_export)
+        path = None
+        if estimate > max_bytes:
+            st.warning(f"The export would be about {estimate / 1024 / 1024:.0f} MB, too large "
+                       f"to download here. Write it to disk with `{command}`.")
+        else:
+            # Rows are streamed to a temporary file instead of built up in memory
+            try:
+                path = exporter.export_to_tempfile(export_format, compress=compress_export)
+            except ImportError as e:
+                st.error(str(e))
+        if path is not None:
+            try:
+                size = os.path.getsize(path)
+                if size > max_bytes:
+                    # The estimate came in low
+                    st.warning(f"The export is {size / 1024 / 1024:.0f} MB, too large to "
+                               f"download here. Write it to disk with `{command}`.")
+                else:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    st.download_button(
+                        label=f"Download {export_format.upper()}",
+                        data=data,
+                        file_name=exporter.filename(export_format, compress_export),
+                        mime=exporter.mime_type(export_format, compress_export)
+                    )
+            finally:
+                os.remove(path)
+    # Only built when asked for, not on every rerun of the page
+    if st.button("Prepare Summary (JSON)"):
+        st.session_state["summary_json"] = AnalysisExporter(threat_analyzer.db).summary_json()
+    if "summary_json" in st.session_state:
+        st.download_button(
+            label="Download Summary (JSON)",
+            data=st.session_state["summary_json"],
+            file_name="threat_summary.json",
+            mime="application/json"
+        )
 
     # Sample queries section
     st.subheader("Sample Queries")
@@ -64,5 +177,8 @@ def main():
 
 if __name__ == "__main__":
     st.set_page_config(page_title="Cyber Threat Analysis Platform")
-    main()
+    with RENDER_SECONDS.time(section='page'):
+        main()
+    # Script start to the end of the first page: what a cold start costs
+    record_startup('first_page', time.perf_counter() - _script_started)
     # Note: The actual server parameters are handled by the workflow configuration
\ No newline at end of file
@@ -23,3 +23,14 @@ SAMPLE_QUERIES = [
     "What is the attack vector for Volt Typhoon?",
     "What are the common TTPs used in supply chain attacks?",
 ]
+
+# Section headers the analysis prompt asks the model to produce, in order
+ANALYSIS_SECTIONS = [
+    "Attack Vectors",
+    "TTPs",
+    "Indicators of Compromise (IoCs)",
+    "CVEs",
+    "Attack Timeline",
+    "Incident Reports",
+    "Threat Intelligence",
+]
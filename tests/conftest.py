@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty directory with local-only settings."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    monkeypatch.delenv('DB_WRITE_BATCH_ROWS', raising=False)
+    monkeypatch.setenv('AUTO_MIGRATE', '1')
+    monkeypatch.setenv('SCRAPE_CACHE_DIR', str(tmp_path / 'scrape_cache'))
+    monkeypatch.setenv('CVE_MIRROR_URL', f"sqlite:///{tmp_path / 'cve_mirror.db'}")
+    return tmp_path
+
+
+@pytest.fixture
+def db(workdir):
+    """A fresh SQLite database (threat_database.db in workdir), fully migrated."""
+    from utils.database import Database
+    database = Database()
+    yield database
+    if database.write_buffer is not None:
+        database.write_buffer.close()
+    database.Session.remove()
+    database.engine.dispose()
@@ -0,0 +1,65 @@
+import threading
+
+from utils.database import AnalysisTags, Database
+
+
+def record(i, severity='High'):
+    return {
+        'query': f"query {i}",
+        'response': {'api_response': f"analysis {i}", 'scraped_data': {'cve': [{'id': f"CVE-2024-{1000 + i}"}]}},
+        'tags': {'Severity Level': severity, 'threat_actor': f"APT{i}"},
+    }
+
+
+def test_store_analyses_accepts_a_generator(db):
+    results = db.store_analyses(record(i) for i in range(5))
+    assert [result['query'] for result in results] == [f"query {i}" for i in range(5)]
+    assert all(result['id'] is not None for result in results)
+    assert len(db.get_all_analyses()) == 5
+
+
+def test_store_analyses_round_trips_and_indexes_rows(db):
+    second = record(2, severity='Critical')
+    results = db.store_analyses([record(1), second])
+    stored = db.get_analysis(results[1]['id'])
+    assert stored['query'] == 'query 2'
+    assert stored['response'] == second['response']
+    assert stored['tags'] == second['tags']
+
+    session = db.Session()
+    try:
+        severities = sorted(severity for (severity,) in session.query(AnalysisTags.severity))
+    finally:
+        session.close()
+    assert severities == ['Critical', 'High']
+    assert db.rollup_summary()['total'] == 2
+
+
+def test_store_analyses_with_nothing_to_store(db):
+    assert db.store_analyses(iter(())) == []
+
+
+def test_buffered_writes_share_commits(workdir, monkeypatch):
+    monkeypatch.setenv('DB_WRITE_BATCH_ROWS', '8')
+    monkeypatch.setenv('DB_WRITE_BATCH_MS', '50')
+    db = Database()
+    try:
+        results = []
+        lock = threading.Lock()
+
+        def writer(i):
+            result = db.store_analysis(**record(i))
+            with lock:
+                results.append(result)
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(result['query'] for result in results) == sorted(f"query {i}" for i in range(16))
+        assert db.write_buffer.rows == 16
+        assert db.write_buffer.batches < 16
+    finally:
+        db.write_buffer.close()
+        db.engine.dispose()
@@ -0,0 +1,42 @@
+import gzip
+import json
+
+import pytest
+
+from utils.exporter import AnalysisExporter
+
+
+def fill(db, count):
+    db.store_analyses({
+        'query': f"query {i}",
+        'response': {'api_response': f"analysis {i} " * (i % 7 + 1)},
+        'tags': {'Severity Level': 'High', 'threat_actor': f"APT{i}"},
+    } for i in range(count))
+
+
+def test_export_analysis_streams_to_a_file(db, tmp_path):
+    fill(db, 30)
+    path = tmp_path / 'export.ndjson.gz'
+    written = db.export_analysis(str(path), 'ndjson', compress=True)
+    assert written == path.stat().st_size
+    text = gzip.decompress(path.read_bytes()).decode('utf-8')
+    assert text == ''.join(AnalysisExporter(db).iter_text('ndjson'))
+    assert [json.loads(line)['query'] for line in text.splitlines()] == [f"query {i}" for i in range(30)]
+
+
+def test_export_analysis_rejects_unknown_formats(db, tmp_path):
+    assert db.export_analysis(str(tmp_path / 'export.xml'), 'xml') is None
+    assert not (tmp_path / 'export.xml').exists()
+
+
+@pytest.mark.parametrize('format', ('csv', 'json', 'ndjson'))
+def test_estimate_size_is_close_to_the_export(db, tmp_path, format):
+    fill(db, 300)
+    exporter = AnalysisExporter(db, chunk_size=50)
+    estimate = exporter.estimate_size(format, sample=50)
+    actual = exporter.write(str(tmp_path / f"export.{format}"), format)
+    assert actual * 0.8 < estimate < actual * 1.25
+
+
+def test_estimate_size_of_an_empty_history(db):
+    assert AnalysisExporter(db).estimate_size('csv') == 0
@@ -0,0 +1,124 @@
+import json
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from utils.gpt_helper import COMBINED_SCHEMA, COMBINED_SECTIONS, GPTHelper
+from utils.response_cache import ResponseCache
+
+COMBINED = {
+    "analysis": {"summary": "Ransomware overview", **{name: [f"{name} item"] for name in COMBINED_SECTIONS}},
+    "tags": {"TTP": "T1566", "attack_vector": "Phishing", "threat_actor": "LockBit",
+             "target_sector": "Healthcare", "Severity Level": "High"},
+}
+
+
+class FakeClient:
+    """Stands in for openai.OpenAI; records every request it is sent."""
+
+    def __init__(self, text=None, failing=()):
+        self.requests = []
+        self.text = text
+        # Models whose requests fail, so the next model answers
+        self.failing = set(failing)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, temperature, max_tokens, stream=False, **kwargs):
+        self.requests.append({'model': model, 'max_tokens': max_tokens, **kwargs})
+        if model in self.failing:
+            raise openai.APIError(f"{model} is down", request=None, body=None)
+        text = self.text or (json.dumps(COMBINED) if 'response_format' in kwargs else "Attack Vectors:\n- Phishing")
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=50, total_tokens=150)
+        if stream:
+            events = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + 5]))],
+                                      usage=None)
+                      for i in range(0, len(text), 5)]
+            # Like the API, usage only comes with a stream when asked for
+            if kwargs.get('stream_options', {}).get('include_usage'):
+                events.append(SimpleNamespace(choices=[], usage=usage))
+            return iter(events)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))],
+                               model=model, usage=usage)
+
+
+@pytest.fixture
+def helper(monkeypatch):
+    monkeypatch.setenv('OPENROUTER_API_KEY', 'sk-test')
+    monkeypatch.setenv('OPENROUTER_MODELS', 'primary/model,fallback/model')
+    monkeypatch.setenv('LLM_MAX_ATTEMPTS', '1')
+    gpt_helper = GPTHelper(cache=ResponseCache())
+    gpt_helper.llm.client = FakeClient()
+    return gpt_helper
+
+
+def test_cache_key_covers_every_request_parameter():
+    base = ('model', 'system', 'prompt', 0.7, 1024)
+    key = ResponseCache.make_key(*base)
+    assert key == ResponseCache.make_key(*base)
+    for index, changed in enumerate(('other', 'other system', 'other prompt', 0.2, 1280)):
+        varied = list(base)
+        varied[index] = changed
+        assert ResponseCache.make_key(*varied) != key
+
+
+def test_repeated_analysis_is_served_from_cache(helper):
+    first = helper.analyze_threat("APT29 phishing")
+    second = helper.analyze_threat("APT29 phishing")
+    assert len(helper.llm.client.requests) == 1
+    assert second['data'] == first['data']
+    assert second['usage']['cached'] is True
+    assert 'cached' not in first['usage']
+
+
+def test_combined_request_is_cached_under_its_own_max_tokens(helper):
+    helper.analyze_and_tag("APT29 phishing")
+    request = helper.llm.client.requests[-1]
+    assert request['max_tokens'] == helper.combined_max_tokens
+
+    prompt = helper._build_combined_prompt("APT29 phishing")
+    key = ResponseCache.make_key(helper.openai_model, helper.SYSTEM_PROMPT, prompt,
+                                 helper.temperature, helper.combined_max_tokens)
+    assert helper.cache.get(key) is not None
+    assert helper._cache_lookup(prompt, helper.combined_max_tokens) is not None
+    # The same prompt sent as a plain analysis request is a different entry
+    assert helper._cache_lookup(prompt) is None
+
+
+def test_combined_schema_requires_only_the_prompted_sections(helper):
+    analysis = COMBINED_SCHEMA['schema']['properties']['analysis']
+    assert analysis['required'] == ['summary'] + COMBINED_SECTIONS
+    assert set(analysis['properties']) == set(analysis['required'])
+    assert 'impact' not in analysis['required'] and 'mitigations' not in analysis['required']
+    prompt = helper._build_combined_prompt("query")
+    assert all(name in prompt for name in COMBINED_SECTIONS)
+
+    response, tags = helper.analyze_and_tag("APT29 phishing")
+    assert response['data']['summary'] == "Ransomware overview"
+    assert tags['data']['threat_actor'] == "LockBit"
+
+
+def test_fallback_answers_are_not_cached_as_primary_answers(helper):
+    helper.llm.client = FakeClient(failing={'primary/model'})
+    response = helper.analyze_threat("APT29 phishing")
+    assert response['usage']['model'] == 'fallback/model'
+
+    prompt = helper._build_analysis_prompt("APT29 phishing")
+    assert helper._cache_lookup(prompt) is None
+    assert helper.cache.get(helper._cache_key('fallback/model', prompt)) is not None
+
+    # Once the primary model answers again, its answer is what gets cached
+    helper.llm.client = FakeClient()
+    helper.analyze_threat("APT29 phishing")
+    assert helper._cache_lookup(prompt)['usage']['model'] == 'primary/model'
+
+
+def test_streamed_usage_names_the_model_that_answered(helper):
+    helper.llm.client = FakeClient(failing={'primary/model'})
+    stream = helper.stream_threat_analysis("APT29 phishing")
+    assert "".join(stream) == "Attack Vectors:\n- Phishing"
+    usage = stream.response['usage']
+    assert usage['model'] == 'fallback/model'
+    assert (usage['prompt_tokens'], usage['completion_tokens']) == (100, 50)
+    assert 'estimated' not in usage
+    assert helper._cache_lookup(helper._build_analysis_prompt("APT29 phishing")) is None
@@ -0,0 +1,69 @@
+import pytest
+
+from utils.database import Database
+from utils.ioc_extractor import REFERENCE_DOMAINS, extract_iocs, is_reference, normalize_ioc
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("C2 at 203.0.113.7 and 198.51.100[.]23", [('ipv4', '203.0.113.7'), ('ipv4', '198.51.100.23')]),
+    ("beacon to 2001:db8::1f", [('ipv6', '2001:db8::1f')]),
+    ("payload hxxps://cdn[.]badsite[.]com/a/b.bin.", [('url', 'https://cdn.badsite.com/a/b.bin')]),
+    ("resolves evil-domain[dot]net", [('domain', 'evil-domain.net')]),
+    ("exploits cve-2023-4966 via T1190 and T1059.001",
+     [('cve', 'CVE-2023-4966'), ('technique', 'T1190'), ('technique', 'T1059.001')]),
+    ("md5 D41D8CD98F00B204E9800998ECF8427E", [('md5', 'd41d8cd98f00b204e9800998ecf8427e')]),
+    ("sha256 " + "a1" * 32, [('sha256', 'a1' * 32)]),
+    ("sha1 " + "0c" * 20, [('sha1', '0c' * 20)]),
+])
+def test_extracts_each_indicator_type(text, expected):
+    assert extract_iocs(text) == expected
+
+
+def test_prose_and_file_names_are_not_domains():
+    assert extract_iocs("It ran cmd.exe and setup.py after the attacks.The end, version 2.4") == []
+
+
+def test_each_indicator_is_reported_once_in_order():
+    text = "10.0.0.5 then evil.com then 10.0.0.5 again and EVIL.com"
+    assert extract_iocs(text) == [('ipv4', '10.0.0.5'), ('domain', 'evil.com')]
+
+
+def test_reference_sites_are_excluded_on_request():
+    text = ("CVE-2024-3400, see https://www.cve.org/CVERecord, www.exploit-db.com, "
+            "attack.mitre.org and nvd.nist.gov; C2 at bad-cve.org and mitre.org.evil.net")
+    found = extract_iocs(text, exclude_domains=REFERENCE_DOMAINS)
+    assert ('cve', 'CVE-2024-3400') in found
+    assert ('domain', 'bad-cve.org') in found
+    assert ('domain', 'mitre.org.evil.net') in found
+    assert not any(is_reference(kind, value) for kind, value in found)
+    assert ('domain', 'www.exploit-db.com') in extract_iocs(text)
+
+
+def test_normalize_ioc_matches_stored_form():
+    assert normalize_ioc(' 198.51.100[.]23 ') == ('ipv4', '198.51.100.23')
+    assert normalize_ioc('Evil[.]COM') == ('domain', 'evil.com')
+    assert normalize_ioc('not an indicator') == (None, 'not an indicator')
+
+
+def test_indexed_from_model_output_and_scraped_items_only():
+    response = {
+        'api_response': {'status': 'success', 'data': {'content': 'Beacons to 203.0.113.7'},
+                         'usage': {'model': 'vendor/model-1.5'}},
+        'scraped_data': {
+            'cve_data': ['NOTICE: moving to WWW.CVE.ORG', 'CVE-2024-3400 PAN-OS command injection'],
+            'error': 'timeout fetching https://www.exploit-db.com/search?q=x',
+        },
+        'raw_data': {'query': 'leaked-copy.example.com'},
+    }
+    text = '\n'.join(Database._ioc_sources(response))
+    assert extract_iocs(text, exclude_domains=REFERENCE_DOMAINS) == [
+        ('ipv4', '203.0.113.7'), ('cve', 'CVE-2024-3400')]
+
+
+def test_stored_analyses_are_indexed_and_found(db):
+    stored = db.store_analysis('Citrix Bleed', {
+        'api_response': 'Exploits CVE-2023-4966; C2 on citrix-update[.]net',
+        'scraped_data': {'cve_data': ['CVE-2023-4966 see https://www.cve.org/CVERecord']},
+    }, {'Severity Level': 'High'})
+    assert [row['id'] for row in db.find_analyses_by_ioc('citrix-update.net')] == [stored['id']]
+    assert db.find_analyses_by_ioc('www.cve.org') == []
@@ -0,0 +1,169 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from utils.database import AnalysisJob
+from utils.jobs import JobQueue, WorkerThreads, run_job, work
+
+
+class FakePipeline:
+    def __init__(self, analysis=None, error=None):
+        self.analysis = analysis if analysis is not None else {'id': 7}
+        self.error = error
+        self.queries = []
+
+    def run(self, query):
+        self.queries.append(query)
+        if self.error:
+            raise self.error
+        return {'analysis': self.analysis}
+
+
+def test_claim_takes_oldest_queued_job_once(db):
+    queue = JobQueue(db)
+    first = queue.enqueue('first')
+    second = queue.enqueue('second')
+
+    job = queue.claim('w1')
+    assert job['id'] == first
+    assert job['status'] == 'running'
+    assert job['worker'] == 'w1'
+    assert job['attempts'] == 1
+    assert queue.claim('w2')['id'] == second
+    assert queue.claim('w3') is None
+
+
+def test_concurrent_claims_never_share_a_job(db):
+    queue = JobQueue(db)
+    ids = {queue.enqueue(f"query {i}") for i in range(20)}
+    claimed = []
+    lock = threading.Lock()
+
+    def claimer(name):
+        while True:
+            job = queue.claim(name)
+            if job is None:
+                return
+            with lock:
+                claimed.append(job['id'])
+
+    threads = [threading.Thread(target=claimer, args=(f"w{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(ids)
+
+
+def _age_job(db, job_id, seconds):
+    # As if its worker died right after claiming it
+    then = datetime.utcnow() - timedelta(seconds=seconds)
+    session = db.Session()
+    try:
+        session.query(AnalysisJob).filter(AnalysisJob.id == job_id).update(
+            {'started_at': then, 'heartbeat_at': then})
+        session.commit()
+    finally:
+        session.close()
+
+
+def test_recover_stale_requeues_then_fails(db):
+    queue = JobQueue(db, max_attempts=2, stale_after=60)
+    job_id = queue.enqueue('stuck')
+
+    queue.claim('dead-worker')
+    assert queue.recover_stale() == (0, 0)
+    _age_job(db, job_id, 120)
+    assert queue.recover_stale() == (1, 0)
+    assert queue.get(job_id)['status'] == 'queued'
+    assert queue.get(job_id)['worker'] is None
+
+    queue.claim('dead-again')
+    _age_job(db, job_id, 120)
+    assert queue.recover_stale() == (0, 1)
+    job = queue.get(job_id)
+    assert job['status'] == 'failed'
+    assert job['attempts'] == 2
+
+
+def test_run_job_records_outcome(db):
+    queue = JobQueue(db)
+    done = queue.enqueue('ok')
+    run_job(FakePipeline({'id': 42}), queue, queue.claim('w'))
+    assert queue.get(done)['status'] == 'done'
+    assert queue.get(done)['analysis_id'] == 42
+
+    failed = queue.enqueue('boom')
+    run_job(FakePipeline(error=RuntimeError('boom')), queue, queue.claim('w'))
+    assert queue.get(failed)['status'] == 'failed'
+    assert 'boom' in queue.get(failed)['error']
+
+    unstored = queue.enqueue('not stored')
+    run_job(FakePipeline({'error': 'db down'}), queue, queue.claim('w'))
+    assert queue.get(unstored)['error'] == 'db down'
+
+
+def test_work_stops_after_max_jobs(db):
+    queue = JobQueue(db)
+    for i in range(3):
+        queue.enqueue(f"query {i}")
+    pipeline = FakePipeline()
+    assert work(pipeline, queue, 'w', poll_interval=0.01, max_jobs=2) == 2
+    assert pipeline.queries == ['query 0', 'query 1']
+    assert queue.counts()['queued'] == 1
+
+
+def test_worker_threads_pick_up_queued_jobs(db):
+    queue = JobQueue(db)
+    workers = WorkerThreads(FakePipeline(), queue, count=2, poll_interval=0.01)
+    try:
+        job_id = queue.enqueue('background')
+        deadline = time.monotonic() + 5
+        while queue.get(job_id)['status'] != 'done' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert queue.get(job_id)['status'] == 'done'
+    finally:
+        workers.stop(timeout=5)
+    assert not any(thread.is_alive() for thread in workers.threads)
+
+
+def test_heartbeat_keeps_a_long_job_claimed(db):
+    queue = JobQueue(db, stale_after=60)
+    job_id = queue.enqueue('slow')
+    queue.claim('w1')
+    _age_job(db, job_id, 120)
+    assert queue.heartbeat(job_id, 'w1')
+    assert queue.recover_stale() == (0, 0)
+    assert not queue.heartbeat(job_id, 'someone-else')
+
+
+def test_only_the_claim_holder_finishes_a_job(db):
+    queue = JobQueue(db, stale_after=60)
+    job_id = queue.enqueue('requeued')
+    queue.claim('slow-worker')
+    _age_job(db, job_id, 120)
+    assert queue.recover_stale() == (1, 0)
+    queue.claim('new-worker')
+
+    assert not queue.complete(job_id, 1, worker_id='slow-worker')
+    assert queue.get(job_id)['status'] == 'running'
+    assert queue.complete(job_id, 2, worker_id='new-worker')
+    assert queue.get(job_id)['analysis_id'] == 2
+
+
+def test_run_job_heartbeats_while_the_pipeline_runs(db):
+    queue = JobQueue(db, stale_after=0.2)
+    job_id = queue.enqueue('long run')
+    job = queue.claim('w')
+    recovered = []
+
+    class SlowPipeline(FakePipeline):
+        def run(self, query):
+            for _ in range(6):
+                time.sleep(0.1)
+                recovered.append(queue.recover_stale())
+            return super().run(query)
+
+    run_job(SlowPipeline({'id': 5}), queue, job)
+    assert recovered == [(0, 0)] * 6
+    assert queue.get(job_id)['status'] == 'done'
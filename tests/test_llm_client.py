@@ -0,0 +1,36 @@
+import threading
+from types import SimpleNamespace
+
+from utils.llm_client import LLMClient
+
+
+class BarrierClient:
+    """Answers only once `parties` requests are in flight at the same time."""
+
+    def __init__(self, parties):
+        self.barrier = threading.Barrier(parties, timeout=10)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, temperature, max_tokens, **kwargs):
+        self.barrier.wait()
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))],
+                               usage=None)
+
+
+def test_hedged_calls_have_no_shared_concurrency_cap():
+    parties = 48
+    llm = LLMClient(client=BarrierClient(parties), models=['m'], max_attempts=1, hedge_after=30)
+    results = []
+    lock = threading.Lock()
+
+    def call(i):
+        completion = llm.complete([{'role': 'user', 'content': f"query {i}"}], 0.7, 10)
+        with lock:
+            results.append(completion.text)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(parties)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['ok'] * parties
@@ -0,0 +1,96 @@
+import os
+import shutil
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+
+from utils import migrations
+from utils.database import Database
+
+FIXTURE_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'threat_database.db')
+
+
+def raw_responses(path):
+    with sqlite3.connect(path) as conn:
+        return [row[0] for row in conn.execute('SELECT response FROM threat_analyses ORDER BY id')]
+
+
+def with_raw_copy(path):
+    return sum('raw_api_response' in str(response) for response in raw_responses(path))
+
+
+@pytest.fixture
+def legacy_db(workdir):
+    """A copy of the repository's database, as written before any migration."""
+    shutil.copy(FIXTURE_DB, workdir / 'threat_database.db')
+    return workdir / 'threat_database.db'
+
+
+def test_startup_applies_only_additive_migrations(legacy_db):
+    before = raw_responses(legacy_db)
+    db = Database()
+
+    pending = migrations.pending_migrations(db)
+    assert sorted(pending) == sorted(migrations.MANUAL_MIGRATIONS)
+    # Stored responses are untouched, the raw API copies included
+    assert raw_responses(legacy_db) == before
+    assert with_raw_copy(legacy_db) > 0
+    # The additive backfills covered every row
+    assert len(db.get_all_analyses()) == len(before)
+    db.engine.dispose()
+
+
+def test_list_changes_nothing(legacy_db, capsys):
+    migrations.main(['--list'])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == len(migrations.MIGRATIONS)
+    assert all(line.startswith('[ ]') for line in lines)
+    assert [line for line in lines if 'manual' in line] == \
+        [f"[ ] {version} (manual: rewrites stored data)" for version, _ in migrations.MIGRATIONS
+         if version in migrations.MANUAL_MIGRATIONS]
+    with sqlite3.connect(legacy_db) as conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert tables == {'threat_analyses'}
+
+
+def test_command_backs_up_then_applies_everything(legacy_db):
+    Database().engine.dispose()
+    migrations.main([])
+
+    backups = [name for name in os.listdir(legacy_db.parent) if name.endswith('.bak')]
+    assert len(backups) == 1
+    assert with_raw_copy(legacy_db.parent / backups[0]) > 0
+    assert with_raw_copy(legacy_db) == 0
+
+    db = Database()
+    assert migrations.pending_migrations(db) == []
+    # Compacted rows still read back as the original responses
+    analyses = db.get_all_analyses()
+    assert len(analyses) == len(raw_responses(legacy_db.parent / backups[0]))
+    assert all(analysis['response'] is not None for analysis in analyses)
+    db.engine.dispose()
+
+
+def test_migrations_are_recorded_once(db):
+    assert migrations.run_migrations(db, include_manual=True) == []
+    session = db.Session()
+    try:
+        versions = [row.version for row in session.query(migrations.SchemaMigration.version)]
+    finally:
+        session.close()
+    assert sorted(versions) == sorted(version for version, _ in migrations.MIGRATIONS)
+
+
+def test_backup_only_copies_sqlite_files(workdir):
+    in_memory = SimpleNamespace(engine=create_engine('sqlite://'))
+    assert migrations.backup_database(in_memory) is None
+    missing = SimpleNamespace(engine=create_engine(f"sqlite:///{workdir / 'missing.db'}"))
+    assert migrations.backup_database(missing) is None
+    assert not (workdir / 'missing.db').exists()
+
+
+def test_new_database_has_nothing_pending(db):
+    assert migrations.pending_migrations(db) == []
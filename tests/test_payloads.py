@@ -0,0 +1,33 @@
+import pytest
+
+from utils import payloads
+from utils.payloads import CODEC_KEY, compress_json, decompress_json
+
+VALUE = {'api_response': 'Ransomware group exfiltrates data before encryption. ' * 40,
+         'tags': {'Severity Level': 'High'}}
+
+
+def test_default_codec_is_zlib():
+    assert payloads.DEFAULT_CODEC == 'zlib'
+    assert compress_json(VALUE)[CODEC_KEY] == 'zlib'
+
+
+@pytest.mark.parametrize('codec', payloads.CODECS)
+def test_codecs_round_trip(codec):
+    if codec == 'zstd':
+        pytest.importorskip('zstandard')
+    envelope = compress_json(VALUE, codec=codec, plain_paths=(('tags', 'Severity Level'),))
+    assert envelope[CODEC_KEY] == codec
+    assert envelope['tags'] == {'Severity Level': 'High'}
+    assert decompress_json(envelope) == VALUE
+
+
+def test_zstd_without_zstandard_names_the_package(monkeypatch):
+    monkeypatch.setattr(payloads, 'zstandard', None)
+    with pytest.raises(ImportError, match='zstandard'):
+        compress_json(VALUE, codec='zstd')
+
+
+def test_small_values_stay_plain():
+    assert compress_json({'a': 1}) == {'a': 1}
+    assert decompress_json({'a': 1}) == {'a': 1}
@@ -0,0 +1,54 @@
+from utils.gpt_helper import ResponseStream
+from utils.pipeline import AnalysisPipeline
+
+
+class FakeHelper:
+    def __init__(self):
+        self.tagged = []
+
+    def stream_threat_analysis(self, query):
+        return ResponseStream(iter(["Attack ", "Vectors:", " phishing"]),
+                              parse=lambda text: {"status": "success", "content": text})
+
+    def tag_threat_data(self, response):
+        self.tagged.append(response)
+        return {"Severity Level": "High"}
+
+
+class FakeAnalyzer:
+    def __init__(self):
+        self.stored = []
+
+    def scrape_threat_data(self, query):
+        return {}
+
+    def store_response(self, query, response, tags, scraped_data=None):
+        self.stored.append(response)
+        return {"id": len(self.stored), "response": response}
+
+
+def run(render_stream):
+    helper, analyzer = FakeHelper(), FakeAnalyzer()
+    pipeline = AnalysisPipeline(helper, analyzer, max_workers=1)
+    try:
+        return pipeline.run("APT29", render_stream=render_stream, combined=False, profile=False), helper, analyzer
+    finally:
+        pipeline.shutdown()
+
+
+def test_finished_stream_is_tagged_and_stored():
+    result, helper, analyzer = run(lambda stream: list(stream))
+    assert result["response"]["content"] == "Attack Vectors: phishing"
+    assert analyzer.stored == [result["response"]]
+    assert result["analysis"]["id"] == 1
+
+
+def test_interrupted_stream_is_not_stored():
+    def stop_early(stream):
+        for _ in stream:
+            break
+
+    result, helper, analyzer = run(stop_early)
+    assert "error" in result["response"]
+    assert "error" in result["analysis"]
+    assert helper.tagged == [] and analyzer.stored == []
@@ -0,0 +1,21 @@
+from datetime import datetime, timedelta
+
+from utils.database import CachedResponse
+from utils.response_cache import ResponseCache
+
+
+def test_persistent_hit_keeps_the_stored_age(db):
+    key = ResponseCache.make_key('model', 'system', 'prompt', 0.7, 100)
+    ResponseCache(db=db, ttl=60).set(key, 'model', {'content': 'answer'})
+    session = db.Session()
+    try:
+        session.get(CachedResponse, key).created_at = datetime.utcnow() - timedelta(seconds=50)
+        session.commit()
+    finally:
+        session.close()
+
+    reader = ResponseCache(db=db, ttl=60)
+    assert reader.get(key) == {'content': 'answer'}
+    # Remembered as 50 s old, so it leaves memory when the row expires
+    stored_at, _ = reader._entries[key]
+    assert (datetime.utcnow() - datetime.utcfromtimestamp(stored_at)).total_seconds() >= 49
@@ -0,0 +1,114 @@
+import threading
+
+from utils.database import AnalysisRollup, RollupSketch
+from utils.rollups import ROLLUP_STRIPES, CountMinSketch, HeavyHitters
+
+
+def record(query, severity='High', actor='LockBit', text=''):
+    return {
+        'query': query,
+        'response': {'api_response': f"{query}\n{text}"},
+        'tags': {'Severity Level': severity, 'threat_actor': actor,
+                 'target_sector': 'Healthcare'},
+    }
+
+
+def test_merged_heavy_hitters_match_a_single_sketch():
+    whole = HeavyHitters(k=5)
+    parts = [HeavyHitters(k=5) for _ in range(4)]
+    for i in range(400):
+        key = f"key-{i % 7 if i % 3 else 0}"
+        whole.add(key)
+        parts[i % 4].add(key)
+
+    merged = HeavyHitters.merged(parts, k=5)
+    assert merged.total == whole.total == 400
+    assert list(merged.sketch.counts) == list(whole.sketch.counts)
+    assert merged.top_k(3) == whole.top_k(3)
+
+
+def test_sketch_merge_needs_the_same_shape():
+    try:
+        CountMinSketch(64, 2).merge(CountMinSketch(32, 2))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("merged sketches of different widths")
+
+
+def test_rollups_add_up_across_stripes(db):
+    stored = []
+    for i in range(2 * ROLLUP_STRIPES):
+        stored.append(db.store_analysis(**record(
+            f"query {i}", severity='High' if i % 2 else 'Low',
+            text='C2 at 203.0.113.9 and evil-domain.example')))
+
+    session = db.Session()
+    try:
+        stripes = {stripe for (stripe,) in session.query(AnalysisRollup.stripe).distinct()}
+        sketch_rows = session.query(RollupSketch).count()
+    finally:
+        session.close()
+    assert len(stripes) == ROLLUP_STRIPES
+    assert sketch_rows == ROLLUP_STRIPES
+
+    summary = db.rollup_summary()
+    assert summary['total'] == len(stored)
+    assert summary['severity'] == {'High': ROLLUP_STRIPES, 'Low': ROLLUP_STRIPES}
+    assert summary['top_actors'] == [{'actor': 'LockBit', 'count': len(stored)}]
+    assert {'indicator': 'ipv4:203.0.113.9', 'count': len(stored)} in summary['top_indicators']
+    assert db.high_water_mark() == (stored[-1]['id'], len(stored))
+
+
+def test_rebuild_matches_incremental_rollups(db):
+    for i in range(10):
+        db.store_analysis(**record(f"query {i}", text=f"see 198.51.100.{i % 3}"))
+    before = db.rollup_summary()
+    db.rebuild_rollups()
+    assert db.rollup_summary() == before
+
+
+def test_concurrent_stores_lose_no_counts(db):
+    def writer(n):
+        for i in range(10):
+            db.store_analysis(**record(f"writer {n} query {i}", text='beacon to 192.0.2.44'))
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = db.rollup_summary()
+    assert summary['total'] == 40
+    assert {'indicator': 'ipv4:192.0.2.44', 'count': 40} in summary['top_indicators']
+
+
+def test_writers_creating_the_same_sketch_stripe_serialize(db):
+    # The second writer starts while the first holds a stripe it created
+    first = db.Session()
+    hitters = db._load_sketch_stripe(first, 'indicators', 3)
+    hitters.add('ipv4:192.0.2.1')
+    errors = []
+
+    def second_writer():
+        session = db.Session()
+        try:
+            other = db._load_sketch_stripe(session, 'indicators', 3)
+            other.add('ipv4:192.0.2.1')
+            db._save_sketch(session, 'indicators', other, 3)
+            session.commit()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.Session.remove()
+
+    thread = threading.Thread(target=second_writer)
+    thread.start()
+    thread.join(timeout=0.2)
+    db._save_sketch(first, 'indicators', hitters, 3)
+    first.commit()
+    db.Session.remove()
+    thread.join()
+
+    assert errors == []
+    assert db.heavy_hitters('indicators') == [('ipv4:192.0.2.1', 2)]
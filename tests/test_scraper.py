@@ -0,0 +1,48 @@
+import os
+import time
+
+from utils.scraper import CachedScraper
+
+
+def entry(url, age, etag=None, body='x' * 100):
+    return {'url': url, 'body': body, 'etag': etag, 'last_modified': None,
+            'fetched_at': time.time() - age, 'ttl': 60}
+
+
+def cache_with(scraper, entries):
+    for url, (item, age) in entries.items():
+        scraper._write_entry(url, item)
+        mtime = time.time() - age
+        os.utime(scraper._cache_path(url), (mtime, mtime))
+
+
+def test_prune_drops_expired_entries_without_validators(tmp_path):
+    scraper = CachedScraper(cache_dir=str(tmp_path), ttl=60)
+    cache_with(scraper, {
+        'fresh': (entry('fresh', 10), 10),
+        'expired': (entry('expired', 600), 600),
+        'revalidatable': (entry('revalidatable', 600, etag='"v1"'), 600),
+    })
+    assert scraper.prune() == 1
+    assert scraper._read_entry('expired') is None
+    assert scraper._read_entry('fresh') is not None
+    assert scraper._read_entry('revalidatable') is not None
+
+
+def test_prune_evicts_least_recently_fetched_over_the_caps(tmp_path):
+    scraper = CachedScraper(cache_dir=str(tmp_path), ttl=3600, max_entries=3)
+    cache_with(scraper, {f"url {i}": (entry(f"url {i}", 0, etag='"v"'), 100 - i) for i in range(5)})
+    assert scraper.prune() == 2
+    assert [scraper._read_entry(f"url {i}") is not None for i in range(5)] == [False, False, True, True, True]
+
+    size = os.path.getsize(scraper._cache_path('url 4'))
+    scraper.max_bytes = size
+    assert scraper.prune() == 2
+    assert scraper._read_entry('url 4') is not None
+
+
+def test_writes_prune_periodically(tmp_path):
+    scraper = CachedScraper(cache_dir=str(tmp_path), max_entries=10)
+    for i in range(CachedScraper.PRUNE_EVERY):
+        scraper._write_entry(f"url {i}", entry(f"url {i}", 0))
+    assert len(os.listdir(tmp_path)) == 10
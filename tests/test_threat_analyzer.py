@@ -0,0 +1,82 @@
+import threading
+
+from utils import cve_store
+from utils.cve_store import CVEStore
+from utils.threat_analyzer import ThreatAnalyzer
+
+
+class FakeStore:
+    available = True
+
+    def __init__(self, results):
+        self.results = results
+
+    def search(self, query, limit=5):
+        return self.results[:limit]
+
+
+def analyzer(db, store, monkeypatch):
+    threat_analyzer = ThreatAnalyzer(db=db, cve_store=store)
+    monkeypatch.setattr(threat_analyzer, '_scrape_cve', lambda query: [f"scraped {query}"])
+    return threat_analyzer
+
+
+def test_lookup_cve_uses_mirror_matches(db, monkeypatch):
+    match = {'cve_id': 'CVE-2024-0001', 'description': 'Buffer overflow', 'cvss_score': 9.8,
+             'cvss_severity': 'CRITICAL', 'published': None, 'last_modified': None}
+    results = analyzer(db, FakeStore([match]), monkeypatch)._lookup_cve('overflow')
+    assert results == [CVEStore.format_result(match)]
+
+
+def test_lookup_cve_scrapes_when_mirror_has_no_match(db, monkeypatch):
+    assert analyzer(db, FakeStore([]), monkeypatch)._lookup_cve('zero day') == ['scraped zero day']
+
+
+def test_no_mirror_file_without_configuration(db, workdir, tmp_path_factory, monkeypatch):
+    monkeypatch.delenv('CVE_MIRROR_URL')
+    default = tmp_path_factory.mktemp('app') / 'cve_mirror.db'
+    monkeypatch.setattr(cve_store, 'DEFAULT_MIRROR_PATH', str(default))
+    threat_analyzer = analyzer(db, None, monkeypatch)
+    assert threat_analyzer.cve_store is None
+    assert threat_analyzer._lookup_cve('log4j') == ['scraped log4j']
+    assert not default.exists()
+    assert not (workdir / 'cve_mirror.db').exists()
+
+
+def test_scrapes_share_one_executor(db, monkeypatch):
+    threat_analyzer = analyzer(db, FakeStore([]), monkeypatch)
+    threads = set()
+
+    def scrape(query):
+        threads.add(threading.current_thread().name)
+        return [query]
+
+    monkeypatch.setattr(threat_analyzer, '_lookup_cve', scrape)
+    monkeypatch.setattr(threat_analyzer, '_scrape_exploitdb', scrape)
+    executor = threat_analyzer._scrape_executor
+    for query in ('a', 'b', 'c'):
+        assert threat_analyzer.scrape_threat_data(query) == {'cve_data': [query], 'exploit_data': [query]}
+    assert threat_analyzer._scrape_executor is executor
+    assert threads and all(name.startswith('scrape') for name in threads)
+    threat_analyzer.shutdown()
+
+
+def test_rows_stored_during_the_index_build_are_indexed(db, monkeypatch):
+    threat_analyzer = analyzer(db, FakeStore([]), monkeypatch)
+    first = db.store_analysis('LockBit ransomware in hospitals', {'api_response': 'analysis'}, {})
+    snapshot = db.iter_successful_queries
+    stored = []
+
+    def slow_snapshot():
+        # Another session stores an analysis after the snapshot was read
+        rows = list(snapshot())
+        stored.append(db.store_analysis('Volt Typhoon living off the land',
+                                        {'api_response': 'analysis'}, {}))
+        yield from rows
+
+    monkeypatch.setattr(db, 'iter_successful_queries', slow_snapshot)
+    index = threat_analyzer._get_query_index()
+    assert len(index) == 2
+    match = threat_analyzer.find_similar_analysis('Volt Typhoon living off the land')
+    assert match['id'] == stored[0]['id']
+    assert threat_analyzer.find_similar_analysis('LockBit ransomware in hospitals')['id'] == first['id']
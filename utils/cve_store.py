@@ -0,0 +1,433 @@
+"""Local CVE mirror built from NVD JSON feeds.
+
+Feed files (NVD 1.1 `nvdcve-1.1-*.json[.gz]` or NVD API 2.0 responses with a
+`vulnerabilities` list) are imported into an indexed store with a keyword
+inverted index, a CPE vendor/product index and CVSS columns. Re-importing a
+feed only rewrites CVEs whose lastModified date moved, so the daily
+`modified` feed can be applied as a delta.
+
+    python -m utils.cve_store import nvdcve-1.1-2024.json.gz nvdcve-1.1-modified.json.gz
+    python -m utils.cve_store search "Citrix NetScaler"
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import (create_engine, Column, String, Text, Float, DateTime,
+                        Integer, Index, func, event)
+from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session
+
+from .instrumentation import get_logger
+
+logger = get_logger(__name__)
+
+MirrorBase = declarative_base()
+
+CVE_ID_PATTERN = re.compile(r'\bCVE-\d{4}-\d{4,}\b', re.IGNORECASE)
+TERM_PATTERN = re.compile(r'[a-z0-9][a-z0-9_.+-]*[a-z0-9]')
+STOPWORDS = {
+    'the', 'and', 'for', 'with', 'that', 'this', 'from', 'are', 'was', 'were',
+    'can', 'could', 'via', 'which', 'when', 'what', 'who', 'how', 'does',
+    'allows', 'allow', 'attacker', 'attackers', 'remote', 'user', 'users',
+    'use', 'used', 'using', 'through', 'before', 'after', 'version', 'versions',
+    'vulnerability', 'vulnerabilities', 'issue', 'exists', 'has', 'have',
+    'been', 'not', 'all', 'any', 'other', 'into', 'its', 'may', 'also',
+    'most', 'recent', 'common', 'attack', 'attacks', 'about', 'there', 'their'
+}
+# Terms found in more than this share of CVEs are too common to narrow results
+COMMON_TERM_RATIO = 0.05
+BATCH_SIZE = 1000
+# Used when CVE_MIRROR_URL is not set: next to the app, not the working directory
+DEFAULT_MIRROR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   'cve_mirror.db')
+
+
+def mirror_url():
+    return os.environ.get('CVE_MIRROR_URL', f'sqlite:///{DEFAULT_MIRROR_PATH}')
+
+
+def mirror_configured():
+    """Whether a mirror was set up: CVE_MIRROR_URL is set or the default file exists."""
+    return 'CVE_MIRROR_URL' in os.environ or os.path.exists(DEFAULT_MIRROR_PATH)
+
+
+class CVERecord(MirrorBase):
+    __tablename__ = 'cves'
+
+    cve_id = Column(String(32), primary_key=True)
+    description = Column(Text, nullable=False, default='')
+    published = Column(DateTime)
+    last_modified = Column(DateTime, index=True)
+    cvss_score = Column(Float, index=True)
+    cvss_severity = Column(String(16), index=True)
+    cvss_vector = Column(String(128))
+
+
+class CVETerm(MirrorBase):
+    """Inverted index: one row per distinct keyword of a CVE."""
+    __tablename__ = 'cve_terms'
+
+    term = Column(String(64), primary_key=True)
+    cve_id = Column(String(32), primary_key=True)
+
+    __table_args__ = (Index('ix_cve_terms_cve_id', 'cve_id'),)
+
+
+class CVEProduct(MirrorBase):
+    """Vendor/product pairs taken from the CPE configuration of a CVE."""
+    __tablename__ = 'cve_products'
+
+    vendor = Column(String(128), primary_key=True)
+    product = Column(String(128), primary_key=True)
+    cve_id = Column(String(32), primary_key=True)
+
+    __table_args__ = (
+        Index('ix_cve_products_product', 'product'),
+        Index('ix_cve_products_cve_id', 'cve_id'),
+    )
+
+
+class FeedImport(MirrorBase):
+    __tablename__ = 'cve_feed_imports'
+
+    name = Column(String(255), primary_key=True)
+    sha256 = Column(String(64), nullable=False)
+    records = Column(Integer, nullable=False, default=0)
+    imported_at = Column(DateTime, default=datetime.utcnow)
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    value = value.rstrip('Z')
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _english(descriptions):
+    for item in descriptions or []:
+        if item.get('lang', 'en').startswith('en'):
+            return item.get('value', '')
+    return ''
+
+
+def _cpe_products(nodes):
+    products = set()
+    stack = list(nodes or [])
+    while stack:
+        node = stack.pop()
+        stack.extend(node.get('children', []))
+        for match in node.get('cpe_match', []) + node.get('cpeMatch', []):
+            uri = match.get('cpe23Uri') or match.get('criteria') or ''
+            parts = uri.split(':')
+            # cpe:2.3:<part>:<vendor>:<product>:...
+            if len(parts) > 4 and parts[3] not in ('*', '-') and parts[4] not in ('*', '-'):
+                products.add((parts[3].lower()[:128], parts[4].lower()[:128]))
+    return products
+
+
+def parse_nvd_item(item):
+    """Turn one NVD 1.1 or API 2.0 record into the columns we store."""
+    if 'CVE_Items' in item or 'vulnerabilities' in item:
+        raise ValueError("expected a single CVE record, got a feed")
+
+    if 'cve' in item and 'CVE_data_meta' in item['cve']:
+        # NVD 1.1 feed record
+        cve = item['cve']
+        impact = item.get('impact', {})
+        v3 = impact.get('baseMetricV3', {}).get('cvssV3', {})
+        v2 = impact.get('baseMetricV2', {})
+        score = v3.get('baseScore', v2.get('cvssV2', {}).get('baseScore'))
+        severity = v3.get('baseSeverity', v2.get('severity'))
+        vector = v3.get('vectorString', v2.get('cvssV2', {}).get('vectorString'))
+        return {
+            'cve_id': cve['CVE_data_meta']['ID'].upper(),
+            'description': _english(cve.get('description', {}).get('description_data')),
+            'published': _parse_time(item.get('publishedDate')),
+            'last_modified': _parse_time(item.get('lastModifiedDate')),
+            'cvss_score': score,
+            'cvss_severity': severity.upper() if severity else None,
+            'cvss_vector': vector,
+            'products': _cpe_products(item.get('configurations', {}).get('nodes'))
+        }
+
+    # NVD API 2.0 record
+    cve = item.get('cve', item)
+    metrics = cve.get('metrics', {})
+    score = severity = vector = None
+    for key in ('cvssMetricV31', 'cvssMetricV30', 'cvssMetricV2'):
+        if metrics.get(key):
+            metric = metrics[key][0]
+            data = metric.get('cvssData', {})
+            score = data.get('baseScore')
+            severity = data.get('baseSeverity', metric.get('baseSeverity'))
+            vector = data.get('vectorString')
+            break
+    nodes = []
+    for configuration in cve.get('configurations', []):
+        nodes.extend(configuration.get('nodes', []))
+    return {
+        'cve_id': cve['id'].upper(),
+        'description': _english(cve.get('descriptions')),
+        'published': _parse_time(cve.get('published')),
+        'last_modified': _parse_time(cve.get('lastModified')),
+        'cvss_score': score,
+        'cvss_severity': severity.upper() if severity else None,
+        'cvss_vector': vector,
+        'products': _cpe_products(nodes)
+    }
+
+
+def extract_terms(text):
+    return {
+        term[:64] for term in TERM_PATTERN.findall(text.lower())
+        if len(term) >= 3 and term not in STOPWORDS
+    }
+
+
+class CVEStore:
+    """Indexed local CVE mirror with keyword, product and CVSS lookups."""
+
+    def __init__(self, url=None):
+        self.url = url or mirror_url()
+        self.engine = create_engine(self.url)
+        if self.engine.dialect.name == 'sqlite':
+            @event.listens_for(self.engine, 'connect')
+            def _sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                cursor.execute('PRAGMA journal_mode=WAL')
+                cursor.execute('PRAGMA synchronous=NORMAL')
+                cursor.close()
+        MirrorBase.metadata.create_all(self.engine)
+        self.Session = scoped_session(sessionmaker(bind=self.engine))
+        self._count = None
+        self._counted_at = 0.0
+        self._count_lock = threading.Lock()
+
+    def count(self):
+        # Cached briefly so the per-query availability check stays free, but
+        # imports from another process are still picked up
+        with self._count_lock:
+            if self._count is None or time.monotonic() - self._counted_at > 300:
+                self._counted_at = time.monotonic()
+                session = self.Session()
+                try:
+                    self._count = session.query(func.count(CVERecord.cve_id)).scalar()
+                finally:
+                    session.close()
+            return self._count
+
+    @property
+    def available(self):
+        return self.count() > 0
+
+    # Import
+
+    def import_feed(self, path):
+        """Import one feed file; returns the number of CVEs added or updated."""
+        with open(path, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        name = os.path.basename(path)
+
+        session = self.Session()
+        try:
+            previous = session.get(FeedImport, name)
+            if previous is not None and previous.sha256 == digest:
+                logger.info("%s unchanged since last import, skipping", name)
+                return 0
+        finally:
+            session.close()
+
+        if raw[:2] == b'\x1f\x8b':
+            raw = gzip.decompress(raw)
+        feed = json.loads(raw)
+        items = feed.get('CVE_Items') or feed.get('vulnerabilities') or []
+
+        changed = 0
+        for start in range(0, len(items), BATCH_SIZE):
+            records = {}
+            for item in items[start:start + BATCH_SIZE]:
+                try:
+                    record = parse_nvd_item(item)
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning("Skipping malformed CVE record: %s", e)
+                    continue
+                records[record['cve_id']] = record
+            changed += self._upsert(list(records.values()))
+
+        session = self.Session()
+        try:
+            session.merge(FeedImport(name=name, sha256=digest, records=changed,
+                                     imported_at=datetime.utcnow()))
+            session.commit()
+        finally:
+            session.close()
+
+        with self._count_lock:
+            self._count = None
+        return changed
+
+    def _upsert(self, records):
+        if not records:
+            return 0
+        session = self.Session()
+        try:
+            ids = [r['cve_id'] for r in records]
+            existing = dict(session.query(CVERecord.cve_id, CVERecord.last_modified).filter(
+                CVERecord.cve_id.in_(ids)
+            ))
+            # Delta import: only touch CVEs that are new or modified
+            changed = [
+                r for r in records
+                if r['cve_id'] not in existing
+                or existing[r['cve_id']] is None
+                or (r['last_modified'] and r['last_modified'] > existing[r['cve_id']])
+            ]
+            if not changed:
+                return 0
+
+            changed_ids = [r['cve_id'] for r in changed]
+            stale = [cve_id for cve_id in changed_ids if cve_id in existing]
+            if stale:
+                session.query(CVETerm).filter(CVETerm.cve_id.in_(stale)).delete(synchronize_session=False)
+                session.query(CVEProduct).filter(CVEProduct.cve_id.in_(stale)).delete(synchronize_session=False)
+                session.query(CVERecord).filter(CVERecord.cve_id.in_(stale)).delete(synchronize_session=False)
+
+            cve_rows, term_rows, product_rows = [], [], []
+            for r in changed:
+                products = r.pop('products')
+                cve_rows.append(r)
+                terms = extract_terms(r['description'])
+                for vendor, product in products:
+                    product_rows.append({'vendor': vendor, 'product': product, 'cve_id': r['cve_id']})
+                    terms.update(extract_terms(f"{vendor} {product.replace('_', ' ')}"))
+                    terms.add(product[:64])
+                term_rows.extend({'term': term, 'cve_id': r['cve_id']} for term in terms)
+
+            session.bulk_insert_mappings(CVERecord, cve_rows)
+            session.bulk_insert_mappings(CVETerm, term_rows)
+            session.bulk_insert_mappings(CVEProduct, product_rows)
+            session.commit()
+            return len(changed)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    # Lookup
+
+    def search(self, query, limit=5):
+        """Rank CVEs for a free-text query.
+
+        Explicit CVE IDs are returned directly. Otherwise CVEs are ranked by
+        how many of the query's keywords or product names they match, then
+        by CVSS score and recency.
+        """
+        session = self.Session()
+        try:
+            ids = [cve_id.upper() for cve_id in CVE_ID_PATTERN.findall(query)]
+            if ids:
+                rows = session.query(CVERecord).filter(CVERecord.cve_id.in_(ids)).all()
+                return [self._to_dict(row) for row in rows][:limit]
+
+            terms = extract_terms(query)
+            if not terms:
+                return []
+            total = self.count() or 1
+            frequencies = dict(session.query(CVETerm.term, func.count(CVETerm.cve_id)).filter(
+                CVETerm.term.in_(terms)
+            ).group_by(CVETerm.term))
+            terms = [t for t in terms if frequencies.get(t)]
+            if not terms:
+                return []
+            selective = [t for t in terms if frequencies[t] / total <= COMMON_TERM_RATIO]
+            if selective:
+                terms = selective
+
+            matched = func.count(CVETerm.term).label('matched')
+            ranked = session.query(CVETerm.cve_id, matched).filter(
+                CVETerm.term.in_(terms)
+            ).group_by(CVETerm.cve_id).subquery()
+            rows = session.query(CVERecord, ranked.c.matched).join(
+                ranked, ranked.c.cve_id == CVERecord.cve_id
+            ).order_by(
+                ranked.c.matched.desc(),
+                CVERecord.cvss_score.desc().nulls_last(),
+                CVERecord.published.desc()
+            ).limit(limit).all()
+            return [self._to_dict(row) for row, _ in rows]
+        finally:
+            session.close()
+
+    def search_products(self, product, vendor=None, limit=20):
+        session = self.Session()
+        try:
+            q = session.query(CVERecord).join(CVEProduct, CVEProduct.cve_id == CVERecord.cve_id).filter(
+                CVEProduct.product == product.lower()
+            )
+            if vendor:
+                q = q.filter(CVEProduct.vendor == vendor.lower())
+            rows = q.order_by(CVERecord.cvss_score.desc().nulls_last()).limit(limit).all()
+            return [self._to_dict(row) for row in rows]
+        finally:
+            session.close()
+
+    def _to_dict(self, row):
+        return {
+            'cve_id': row.cve_id,
+            'description': row.description,
+            'published': row.published.isoformat() if row.published else None,
+            'cvss_score': row.cvss_score,
+            'cvss_severity': row.cvss_severity
+        }
+
+    @staticmethod
+    def format_result(result, max_description=200):
+        score = ''
+        if result['cvss_score'] is not None:
+            label = f"{result['cvss_score']:.1f} {result['cvss_severity'] or ''}".strip()
+            score = f" (CVSS {label})"
+        description = result['description']
+        if len(description) > max_description:
+            description = description[:max_description].rsplit(' ', 1)[0] + '…'
+        return f"{result['cve_id']}{score}: {description}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the local CVE mirror")
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_cmd = commands.add_parser('import', help="import NVD JSON feed files")
+    import_cmd.add_argument('paths', nargs='+')
+    search_cmd = commands.add_parser('search', help="look up CVEs for a query")
+    search_cmd.add_argument('query')
+    search_cmd.add_argument('--limit', type=int, default=5)
+    commands.add_parser('stats', help="show mirror size")
+    args = parser.parse_args(argv)
+
+    store = CVEStore()
+    if args.command == 'import':
+        for path in args.paths:
+            changed = store.import_feed(path)
+            print(f"{os.path.basename(path)}: {changed} CVEs added or updated")
+        print(f"Mirror holds {store.count()} CVEs")
+    elif args.command == 'search':
+        for result in store.search(args.query, limit=args.limit):
+            print(CVEStore.format_result(result))
+    else:
+        print(f"Mirror holds {store.count()} CVEs")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,52 +1,198 @@
 
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
 import json
 import os
-import pandas as pd
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, JSON, inspect
+import threading
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, JSON, LargeBinary, ForeignKey, Index, inspect, func, or_, event, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.pool import QueuePool
+from .tags import TAG_FIELDS, normalize_tags, normalize_severity, actor_key
+from .search import SearchIndex, document_text
+from .write_buffer import BufferedWriter
+from .payloads import CompressedJSON, pack_scraped, blob_refs, unpack_scraped
+from .ioc_extractor import REFERENCE_DOMAINS, extract_iocs, normalize_ioc
+from .rollups import ROLLUP_STRIPES, CountMinSketch, HeavyHitters, rollup_increments
+from .instrumentation import DB_ROWS_WRITTEN, DB_WRITE_SECONDS, get_logger
+
+logger = get_logger(__name__)
 
 Base = declarative_base()
 
+# Databases whose schema this process has already set up
+_prepared_schemas = set()
+_schema_lock = threading.Lock()
+
 class ThreatAnalysis(Base):
     __tablename__ = 'threat_analyses'
 
     id = Column(Integer, primary_key=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     query = Column(String, nullable=False)
-    response = Column(JSON, nullable=False)
+    # Error markers stay uncompressed for iter_successful_queries' filters
+    response = Column(CompressedJSON(plain_paths=[('error',), ('api_response', 'error')]), nullable=False)
     tags = Column(JSON, nullable=False)
 
+class AnalysisTags(Base):
+    """Tag fields of an analysis pulled out of the JSON so they can be indexed."""
+    __tablename__ = 'analysis_tags'
+
+    analysis_id = Column(Integer, ForeignKey('threat_analyses.id', ondelete='CASCADE'), primary_key=True)
+    # Copied from threat_analyses so time-bounded tag filters stay on one index
+    timestamp = Column(DateTime, nullable=False)
+    severity = Column(String(16), nullable=False, default='Unknown')
+    threat_actor = Column(String)
+    threat_actor_key = Column(String)
+    target_sector = Column(String)
+    attack_vector = Column(String)
+    ttp = Column(String)
+
+    __table_args__ = (
+        Index('ix_analysis_tags_severity_timestamp', 'severity', 'timestamp'),
+        Index('ix_analysis_tags_actor_timestamp', 'threat_actor_key', 'timestamp'),
+        Index('ix_analysis_tags_sector_timestamp', 'target_sector', 'timestamp'),
+    )
+
+class AnalysisIoc(Base):
+    """An indicator of compromise mentioned by an analysis."""
+    __tablename__ = 'analysis_iocs'
+
+    analysis_id = Column(Integer, ForeignKey('threat_analyses.id', ondelete='CASCADE'), primary_key=True)
+    ioc_type = Column(String(16), primary_key=True)
+    value = Column(String, primary_key=True)
+
+    __table_args__ = (
+        Index('ix_analysis_iocs_value', 'value', 'ioc_type'),
+    )
+
+class AnalysisRollup(Base):
+    """One stripe of a running count over stored analyses (see utils/rollups.py)."""
+    __tablename__ = 'rollup_counters'
+
+    dimension = Column(String(32), primary_key=True)
+    key = Column(String, primary_key=True)
+    # Concurrent writers update different stripes; reads add them up
+    stripe = Column(Integer, primary_key=True, default=0)
+    # Display form of the key, as first written
+    label = Column(String)
+    count = Column(Integer, nullable=False, default=0)
+
+class RollupSketch(Base):
+    """One stripe of a count-min sketch and its top-k candidates (see utils/rollups.py)."""
+    __tablename__ = 'rollup_sketch_stripes'
+
+    name = Column(String(32), primary_key=True)
+    stripe = Column(Integer, primary_key=True, default=0)
+    width = Column(Integer, nullable=False)
+    depth = Column(Integer, nullable=False)
+    counts = Column(LargeBinary, nullable=False)
+    top = Column(JSON, nullable=False)
+    total = Column(Integer, nullable=False, default=0)
+
+class ScrapedBlob(Base):
+    """A scraped result block, stored once and referenced by content hash."""
+    __tablename__ = 'scraped_blobs'
+
+    hash = Column(String(64), primary_key=True)
+    data = Column(CompressedJSON(), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+
+    version = Column(String(64), primary_key=True)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+class CachedResponse(Base):
+    __tablename__ = 'llm_response_cache'
+
+    key = Column(String(64), primary_key=True)
+    model = Column(String, nullable=False)
+    response = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class AnalysisJob(Base):
+    """An analysis queued for the background workers (see utils/jobs.py)."""
+    __tablename__ = 'analysis_jobs'
+
+    id = Column(Integer, primary_key=True)
+    query = Column(String, nullable=False)
+    # queued -> running -> done | failed
+    status = Column(String(16), nullable=False, default='queued')
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    worker = Column(String)
+    # Touched by the worker while it runs the job; stale once that stops
+    heartbeat_at = Column(DateTime)
+    attempts = Column(Integer, nullable=False, default=0)
+    analysis_id = Column(Integer, ForeignKey('threat_analyses.id', ondelete='SET NULL'))
+    error = Column(String)
+
+    __table_args__ = (
+        Index('ix_analysis_jobs_status_id', 'status', 'id'),
+    )
+
 class Database:
-    def __init__(self):
+    # Columns that query_analyses may project
+    ANALYSIS_COLUMNS = ('id', 'timestamp', 'query', 'response', 'tags')
+    # Time buckets count_by_time can group on, finest first
+    TIME_BUCKETS = ('hour', 'day', 'week', 'month')
+
+    def __init__(self, migrate=None):
+        # Callables notified with the stored rows after each committed write
+        self._store_listeners = []
+        # Whether the first Database of the process sets the schema up
+        # (AUTO_MIGRATE, default 1); later ones reuse that work
+        self.migrate = migrate if migrate is not None else \
+            os.environ.get('AUTO_MIGRATE', '1') == '1'
         self.initialize_connection()
 
+        # Buffered writer mode: store_analysis calls are grouped into bulk
+        # inserts, committed every DB_WRITE_BATCH_ROWS rows or
+        # DB_WRITE_BATCH_MS milliseconds
+        batch_rows = int(os.environ.get('DB_WRITE_BATCH_ROWS', 0))
+        self.write_buffer = None
+        if batch_rows > 1:
+            self.write_buffer = BufferedWriter(
+                self, max_rows=batch_rows,
+                max_delay_ms=int(os.environ.get('DB_WRITE_BATCH_MS', 5))
+            )
+
+    def add_store_listener(self, listener):
+        self._store_listeners.append(listener)
+
+    def _notify_stored(self, results):
+        for listener in self._store_listeners:
+            try:
+                listener(results)
+            except Exception as e:
+                logger.error("Store listener failed: %s", e)
+
     def initialize_connection(self):
         if 'DATABASE_URL' not in os.environ:
-            print("WARNING: DATABASE_URL not found. Using SQLite file database for testing.")
+            logger.warning("DATABASE_URL not set; using the SQLite file threat_database.db")
             # Use a file-based SQLite database instead of in-memory
             self.engine = create_engine('sqlite:///threat_database.db')
-            
-            # Make sure the ThreatAnalysis table is created
-            Base.metadata.create_all(self.engine)
-            session_factory = sessionmaker(bind=self.engine)
+
+            # WAL lets readers run during writes, and synchronous=NORMAL
+            # only fsyncs at checkpoints instead of on every commit
+            @event.listens_for(self.engine, 'connect')
+            def _sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                cursor.execute('PRAGMA journal_mode=WAL')
+                cursor.execute('PRAGMA synchronous=NORMAL')
+                cursor.execute('PRAGMA busy_timeout=5000')
+                cursor.execute('PRAGMA temp_store=MEMORY')
+                cursor.close()
+
+            # Rows are turned into dicts right after commit; without
+            # expire_on_commit that needs no reload query per row
+            session_factory = sessionmaker(bind=self.engine, expire_on_commit=False)
             self.Session = scoped_session(session_factory)
-            
-            # Verify tables are created
-            from sqlalchemy import inspect
-            inspector = inspect(self.engine)
-            tables = inspector.get_table_names()
-            print(f"Created tables: {tables}")
-            
-            if 'threat_analyses' not in tables:
-                print("Forcing table creation for ThreatAnalysis")
-                ThreatAnalysis.__table__.create(self.engine, checkfirst=True)
-                
-                # Verify tables again after forcing creation
-                tables = inspector.get_table_names()
-                print(f"Tables after forced creation: {tables}")
+            self._ensure_schema()
             return
             
         retries = 3
@@ -62,62 +208,763 @@ class Database:
                     connect_args={'sslmode': 'require'}
                 )
                 
-                # Test connection and create tables
-                Base.metadata.create_all(self.engine)
-                session_factory = sessionmaker(bind=self.engine)
+                # Test the connection
+                with self.engine.connect() as connection:
+                    connection.execute(text('SELECT 1'))
+                session_factory = sessionmaker(bind=self.engine, expire_on_commit=False)
                 self.Session = scoped_session(session_factory)
+                self._ensure_schema()
                 return
             except Exception as e:
                 retries -= 1
                 if retries == 0:
-                    print(f"Database connection failed after 3 attempts: {str(e)}")
+                    logger.error("Database connection failed after 3 attempts: %s", e)
                     raise
-                print(f"Connection attempt failed, retrying... ({retries} attempts remaining)")
+                logger.warning("Connection attempt failed, retrying (%d attempts remaining)", retries)
                 import time
                 time.sleep(2)
 
+    def _ensure_schema(self):
+        """Set the schema up once per process and database.
+
+        With AUTO_MIGRATE=0 nothing is created or migrated here; that is
+        left to `python -m utils.migrations` (e.g. a deploy step), and
+        startup only warns if migrations are pending.
+        """
+        self.search_index = SearchIndex(self.engine)
+        url = self.engine.url
+        if url.get_backend_name() == 'sqlite':
+            if url.database in (None, '', ':memory:'):
+                # Every in-memory engine is a new, empty database
+                key = None
+            else:
+                # Relative paths name a different file in each directory
+                key = 'sqlite:///' + os.path.abspath(url.database)
+        else:
+            key = str(url)
+        if key is not None and key in _prepared_schemas:
+            return
+        with _schema_lock:
+            if key is not None and key in _prepared_schemas:
+                return
+            if not self.migrate:
+                self._warn_if_pending()
+                return
+            self.prepare_schema()
+            if key is not None:
+                _prepared_schemas.add(key)
+
+    def prepare_schema(self, include_manual=False):
+        """Create missing tables and indexes and apply pending migrations.
+
+        Migrations that rewrite stored data only run with include_manual.
+        """
+        Base.metadata.create_all(self.engine)
+        self.search_index.create()
+
+        # create_all skips tables that already exist, so indexes added to
+        # existing tables have to be created explicitly
+        for index in ThreatAnalysis.__table__.indexes:
+            index.create(self.engine, checkfirst=True)
+
+        from .migrations import run_migrations
+        run_migrations(self, include_manual=include_manual)
+
+    def _warn_if_pending(self):
+        from .migrations import pending_migrations
+        pending = pending_migrations(self)
+        if pending:
+            logger.warning("Schema is not up to date (%s pending); run python -m utils.migrations",
+                           ', '.join(pending))
+
+    def _index_analyses(self, session, analyses, responses):
+        """Write the derived rows for freshly flushed analyses.
+
+        Runs inside the caller's transaction so the side tables never
+        disagree with threat_analyses. `responses` are the unpacked
+        responses, so scraped text is indexed rather than blob references.
+        """
+        tag_rows = []
+        ioc_rows = []
+        for analysis, response in zip(analyses, responses):
+            tag_rows.append(self._tag_row(analysis.id, analysis.timestamp, analysis.tags))
+            self.search_index.index(session, analysis.id, analysis.query, response)
+            ioc_rows.extend(self._ioc_rows(analysis.id, analysis.query, response))
+        session.add_all(tag_rows)
+        session.add_all(ioc_rows)
+        if analyses:
+            # Spread concurrent writers over the stripes by analysis id
+            self._update_rollups(session, tag_rows, ioc_rows, analyses[0].id % ROLLUP_STRIPES)
+
+    def _ioc_rows(self, analysis_id, query, response):
+        text = '\n'.join([query] + self._ioc_sources(response))
+        return [AnalysisIoc(analysis_id=analysis_id, ioc_type=ioc_type, value=value)
+                for ioc_type, value in extract_iocs(text, exclude_domains=REFERENCE_DOMAINS)]
+
+    @staticmethod
+    def _ioc_sources(response):
+        """The texts indicators are taken from: the model's answer and each
+        scraped item on its own, not request metadata or scrape errors."""
+        if not isinstance(response, dict) or 'api_response' not in response:
+            # Very old rows are the bare API response
+            return [document_text(response)]
+        texts = [document_text(response['api_response'])]
+        scraped = response.get('scraped_data')
+        if isinstance(scraped, dict):
+            for source, items in scraped.items():
+                if source != 'error' and isinstance(items, list):
+                    texts.extend(document_text(item) for item in items)
+        return texts
+
+    def _update_rollups(self, session, tag_rows, ioc_rows, stripe=0):
+        counts = Counter()
+        labels = {}
+        for row in tag_rows:
+            for dimension, key, label in rollup_increments(
+                    row.timestamp, row.severity, row.threat_actor, row.threat_actor_key,
+                    row.target_sector):
+                counts[(dimension, key)] += 1
+                labels.setdefault((dimension, key), label)
+        self._add_to_rollups(session, counts, labels, stripe)
+        if ioc_rows:
+            hitters = self._load_sketch_stripe(session, 'indicators', stripe)
+            for row in ioc_rows:
+                hitters.add(f"{row.ioc_type}:{row.value}")
+            self._save_sketch(session, 'indicators', hitters, stripe)
+
+    def _add_to_rollups(self, session, counts, labels, stripe=0):
+        # Sorted so concurrent writers take row locks in the same order
+        rows = [{'dimension': dimension, 'key': key, 'stripe': stripe,
+                 'label': labels.get((dimension, key)), 'count': count}
+                for (dimension, key), count in sorted(counts.items())]
+        if not rows:
+            return
+        dialect = self.engine.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(AnalysisRollup)
+            session.execute(stmt.on_conflict_do_update(
+                index_elements=['dimension', 'key', 'stripe'],
+                set_={'count': AnalysisRollup.count + stmt.excluded['count']}
+            ), rows)
+            return
+        for row in rows:
+            existing = session.get(AnalysisRollup, (row['dimension'], row['key'], row['stripe']))
+            if existing is None:
+                session.add(AnalysisRollup(**row))
+            else:
+                existing.count += row['count']
+
+    def _hitters(self, stored):
+        sketch = CountMinSketch.from_bytes(stored.counts, stored.width, stored.depth)
+        return HeavyHitters(sketch=sketch, top=stored.top, total=stored.total)
+
+    def _ensure_sketch_stripe(self, session, name, stripe):
+        # FOR UPDATE can't lock a row that doesn't exist yet, so writers that
+        # both see a new stripe would each insert it; create it empty first
+        empty = HeavyHitters()
+        row = {'name': name, 'stripe': stripe, 'width': empty.sketch.width,
+               'depth': empty.sketch.depth, 'counts': empty.sketch.to_bytes(),
+               'top': {}, 'total': 0}
+        dialect = self.engine.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            session.execute(insert(RollupSketch).values(row).on_conflict_do_nothing(
+                index_elements=['name', 'stripe']))
+            return
+        if session.get(RollupSketch, (name, stripe)) is None:
+            try:
+                with session.begin_nested():
+                    session.add(RollupSketch(**row))
+            except IntegrityError:
+                # Another writer created it first
+                pass
+
+    def _load_sketch_stripe(self, session, name, stripe):
+        # Locks only this stripe; on SQLite the analysis insert already
+        # holds the write lock
+        self._ensure_sketch_stripe(session, name, stripe)
+        stored = session.query(RollupSketch).filter(
+            RollupSketch.name == name, RollupSketch.stripe == stripe
+        ).with_for_update().one()
+        return self._hitters(stored)
+
+    def _load_sketch(self, session, name):
+        """Every stripe of a sketch merged into one."""
+        stripes = session.query(RollupSketch).filter(RollupSketch.name == name).all()
+        return HeavyHitters.merged([self._hitters(stored) for stored in stripes])
+
+    def _save_sketch(self, session, name, hitters, stripe=0):
+        session.merge(RollupSketch(
+            name=name,
+            stripe=stripe,
+            width=hitters.sketch.width,
+            depth=hitters.sketch.depth,
+            counts=hitters.sketch.to_bytes(),
+            top=hitters.top,
+            total=hitters.total
+        ))
+
+    def _pack_response(self, session, response):
+        """Move scraped blocks into scraped_blobs and return the packed response."""
+        packed, blobs = pack_scraped(response)
+        if blobs:
+            self._insert_blobs(session, blobs)
+        return packed
+
+    def _insert_blobs(self, session, blobs):
+        rows = [{'hash': digest, 'data': block, 'created_at': datetime.utcnow()}
+                for digest, block in blobs.items()]
+        dialect = self.engine.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            # Blocks already stored by any earlier row are skipped
+            session.execute(insert(ScrapedBlob).values(rows).on_conflict_do_nothing(
+                index_elements=['hash']))
+            return
+        existing = {digest for (digest,) in session.query(ScrapedBlob.hash).filter(
+            ScrapedBlob.hash.in_(list(blobs)))}
+        session.add_all(ScrapedBlob(**row) for row in rows if row['hash'] not in existing)
+
+    def _hydrate_responses(self, session, responses):
+        """Return responses with their blob references filled back in."""
+        refs = set()
+        for response in responses:
+            refs |= blob_refs(response)
+        if not refs:
+            return responses
+        blobs = {}
+        refs = list(refs)
+        for start in range(0, len(refs), 500):
+            blobs.update(session.query(ScrapedBlob.hash, ScrapedBlob.data).filter(
+                ScrapedBlob.hash.in_(refs[start:start + 500])))
+        return [unpack_scraped(response, blobs) for response in responses]
+
+    def _tag_row(self, analysis_id, timestamp, tags):
+        return AnalysisTags(
+            analysis_id=analysis_id,
+            timestamp=timestamp,
+            **normalize_tags(tags)
+        )
+
     def store_analysis(self, query, response, tags):
+        if self.write_buffer is not None:
+            return self.write_buffer.store(query, response, tags)
+        with DB_WRITE_SECONDS.time(operation='store_analysis'):
+            session = self.Session()
+            try:
+                analysis = ThreatAnalysis(
+                    timestamp=datetime.utcnow(),
+                    query=query,
+                    response=self._pack_response(session, response),
+                    tags=tags
+                )
+                session.add(analysis)
+                session.flush()
+                self._index_analyses(session, [analysis], [response])
+                session.commit()
+                result = self._to_dict(analysis, response)
+            except Exception as e:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+        DB_ROWS_WRITTEN.inc(operation='store_analysis')
+        self._notify_stored([result])
+        return result
+
+    def store_analyses(self, records):
+        """Insert many analyses in one transaction.
+
+        `records` is an iterable of dicts with query/response/tags keys. The
+        rows go out as a single multi-row INSERT and one commit.
+        """
+        # Read twice below, for the rows and for the responses
+        records = list(records)
+        with DB_WRITE_SECONDS.time(operation='store_analyses'):
+            session = self.Session()
+            try:
+                analyses = [
+                    ThreatAnalysis(
+                        timestamp=datetime.utcnow(),
+                        query=record['query'],
+                        response=self._pack_response(session, record['response']),
+                        tags=record['tags']
+                    )
+                    for record in records
+                ]
+                responses = [record['response'] for record in records]
+                session.add_all(analyses)
+                session.flush()
+                self._index_analyses(session, analyses, responses)
+                session.commit()
+                results = [self._to_dict(analysis, response)
+                           for analysis, response in zip(analyses, responses)]
+            except Exception as e:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+        DB_ROWS_WRITTEN.inc(len(results), operation='store_analyses')
+        self._notify_stored(results)
+        return results
+
+    def get_all_analyses(self):
         session = self.Session()
         try:
-            analysis = ThreatAnalysis(
-                query=query,
-                response=response,
-                tags=tags
+            analyses = session.query(ThreatAnalysis).all()
+            responses = self._hydrate_responses(session, [a.response for a in analyses])
+            return [self._to_dict(analysis, response)
+                    for analysis, response in zip(analyses, responses)]
+        finally:
+            session.close()
+
+    def get_analysis(self, analysis_id):
+        session = self.Session()
+        try:
+            analysis = session.get(ThreatAnalysis, analysis_id)
+            if analysis is None:
+                return None
+            return self._to_dict(analysis, self._hydrate_responses(session, [analysis.response])[0])
+        finally:
+            session.close()
+
+    def iter_successful_queries(self, chunk_size=1000):
+        """Yield (id, query) for analyses whose LLM call did not fail."""
+        session = self.Session()
+        try:
+            q = session.query(ThreatAnalysis.id, ThreatAnalysis.query).filter(
+                ThreatAnalysis.response['error'].as_string().is_(None),
+                ThreatAnalysis.response[('api_response', 'error')].as_string().is_(None)
+            ).order_by(ThreatAnalysis.id).execution_options(yield_per=chunk_size)
+            for analysis_id, query in q:
+                yield analysis_id, query
+        finally:
+            session.close()
+
+    def query_analyses(self, columns=('id', 'timestamp', 'query'), limit=50,
+                       cursor=None, start=None, end=None, tags=None,
+                       newest_first=True):
+        """Fetch one page of analyses with filters evaluated in SQL.
+
+        Only the requested `columns` are loaded, so history views don't pull
+        the large response blobs. Pages are keyset-paginated on `id`: pass the
+        returned `next_cursor` back in as `cursor` to get the following page.
+        `start`/`end` bound the timestamp and `tags` maps tag names (e.g.
+        'Severity Level', 'threat_actor') to the value they must equal,
+        case-insensitively.
+        """
+        unknown = set(columns) - set(self.ANALYSIS_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+
+        # id is always fetched because it is the pagination key
+        selected = ['id'] + [c for c in columns if c != 'id']
+        session = self.Session()
+        try:
+            q = session.query(*[getattr(ThreatAnalysis, c) for c in selected])
+            q = self._filter_analyses(q, start=start, end=end, tags=tags)
+            if cursor is not None:
+                q = q.filter(ThreatAnalysis.id < cursor if newest_first else ThreatAnalysis.id > cursor)
+            q = q.order_by(ThreatAnalysis.id.desc() if newest_first else ThreatAnalysis.id.asc())
+            rows = q.limit(limit + 1).all()
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            items = [dict(zip(selected, row)) for row in rows]
+            if 'response' in columns:
+                responses = self._hydrate_responses(session, [item['response'] for item in items])
+                for item, response in zip(items, responses):
+                    item['response'] = response
+        finally:
+            session.close()
+
+        results = []
+        for item in items:
+            if item.get('timestamp') is not None:
+                item['timestamp'] = item['timestamp'].isoformat()
+            if 'id' not in columns:
+                item.pop('id')
+            results.append(item)
+        return {
+            'rows': results,
+            'next_cursor': rows[-1][0] if has_more else None
+        }
+
+    def iter_analyses(self, columns=ANALYSIS_COLUMNS, chunk_size=500):
+        """Yield every analysis as a dict, oldest first, without loading the table.
+
+        Rows are pulled through a server-side cursor (where the driver
+        supports one) `chunk_size` at a time.
+        """
+        unknown = set(columns) - set(self.ANALYSIS_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+
+        session = self.Session()
+        try:
+            q = session.query(*[getattr(ThreatAnalysis, c) for c in columns]).order_by(
+                ThreatAnalysis.id
+            ).execution_options(yield_per=chunk_size)
+            chunk = []
+            for row in q:
+                chunk.append(dict(zip(columns, row)))
+                if len(chunk) >= chunk_size:
+                    yield from self._finish_chunk(session, chunk)
+                    chunk = []
+            yield from self._finish_chunk(session, chunk)
+        finally:
+            session.close()
+
+    def _finish_chunk(self, session, items):
+        if items and 'response' in items[0]:
+            responses = self._hydrate_responses(session, [item['response'] for item in items])
+            for item, response in zip(items, responses):
+                item['response'] = response
+        for item in items:
+            if item.get('timestamp') is not None:
+                item['timestamp'] = item['timestamp'].isoformat()
+        return items
+
+    def search_analyses(self, search_text, limit=20):
+        """Full-text search over stored queries and responses, best match first."""
+        session = self.Session()
+        try:
+            return self.search_index.search(session, search_text, limit=limit)
+        finally:
+            session.close()
+
+    def find_analyses_by_ioc(self, value, ioc_type=None, limit=50):
+        """Analyses mentioning an indicator (IP, hash, domain, CVE, ...), newest first.
+
+        The value is normalized like stored indicators, so defanged input
+        such as 1.2.3[.]4 finds the same rows.
+        """
+        detected_type, normalized = normalize_ioc(value)
+        ioc_type = ioc_type or detected_type
+        session = self.Session()
+        try:
+            q = session.query(ThreatAnalysis.id, ThreatAnalysis.timestamp, ThreatAnalysis.query,
+                              AnalysisIoc.ioc_type).join(
+                AnalysisIoc, AnalysisIoc.analysis_id == ThreatAnalysis.id
+            ).filter(AnalysisIoc.value == normalized)
+            if ioc_type is not None:
+                q = q.filter(AnalysisIoc.ioc_type == ioc_type)
+            rows = q.order_by(ThreatAnalysis.id.desc()).limit(limit).all()
+            return [{
+                'id': analysis_id,
+                'timestamp': timestamp.isoformat(),
+                'query': query,
+                'ioc_type': found_type,
+            } for analysis_id, timestamp, query, found_type in rows]
+        finally:
+            session.close()
+
+    def count_analyses(self, start=None, end=None, tags=None):
+        session = self.Session()
+        try:
+            q = session.query(func.count(ThreatAnalysis.id))
+            return self._filter_analyses(q, start=start, end=end, tags=tags).scalar()
+        finally:
+            session.close()
+
+    def _filter_analyses(self, q, start=None, end=None, tags=None):
+        tags = dict(tags or {})
+        indexed = {name: tags.pop(name) for name in list(tags) if name in TAG_FIELDS}
+
+        if indexed:
+            # Filter on the indexed side table; time bounds go on its copy of
+            # the timestamp so the composite indexes can be used
+            q = q.join(AnalysisTags, AnalysisTags.analysis_id == ThreatAnalysis.id)
+            timestamp = AnalysisTags.timestamp
+            for name, value in indexed.items():
+                q = q.filter(self._tag_condition(name, value))
+        else:
+            timestamp = ThreatAnalysis.timestamp
+
+        if start is not None:
+            q = q.filter(timestamp >= start)
+        if end is not None:
+            q = q.filter(timestamp < end)
+        for name, value in tags.items():
+            # Other tag names are matched inside the JSON. Older rows hold the
+            # tag fields directly, newer ones keep the API envelope with the
+            # fields under "data"
+            value = str(value).lower()
+            q = q.filter(or_(
+                func.lower(ThreatAnalysis.tags[name].as_string()) == value,
+                func.lower(ThreatAnalysis.tags[('data', name)].as_string()) == value
+            ))
+        return q
+
+    def _tag_condition(self, name, value):
+        column = TAG_FIELDS[name]
+        if column == 'severity':
+            return AnalysisTags.severity == normalize_severity(value)
+        if column == 'threat_actor':
+            return AnalysisTags.threat_actor_key == actor_key(value)
+        return func.lower(getattr(AnalysisTags, column)) == str(value).lower()
+
+    def count_by_tag(self, name, start=None, end=None, tags=None, limit=None):
+        """Count analyses per value of an indexed tag, most common first."""
+        column = getattr(AnalysisTags, TAG_FIELDS[name])
+        session = self.Session()
+        try:
+            q = session.query(column, func.count(AnalysisTags.analysis_id))
+            q = q.select_from(AnalysisTags)
+            for tag_name, value in (tags or {}).items():
+                q = q.filter(self._tag_condition(tag_name, value))
+            if start is not None:
+                q = q.filter(AnalysisTags.timestamp >= start)
+            if end is not None:
+                q = q.filter(AnalysisTags.timestamp < end)
+            q = q.group_by(column).order_by(func.count(AnalysisTags.analysis_id).desc())
+            if limit is not None:
+                q = q.limit(limit)
+            return [(value, count) for value, count in q.all()]
+        finally:
+            session.close()
+
+    def high_water_mark(self):
+        """(highest id, analysis count) of threat_analyses.
+
+        Changes whenever an analysis is stored (or the rollups are rebuilt
+        after a delete), so it can key caches of anything computed over the
+        whole history. Both halves are index lookups.
+        """
+        session = self.Session()
+        try:
+            max_id = session.query(func.max(ThreatAnalysis.id)).scalar()
+            total = session.query(func.sum(AnalysisRollup.count)).filter(
+                AnalysisRollup.dimension == 'total', AnalysisRollup.key == ''
+            ).scalar()
+            return (max_id or 0, total or 0)
+        finally:
+            session.close()
+
+    def timestamp_range(self, tags=None):
+        """(oldest, newest) timestamp of the matching analyses, or (None, None)."""
+        session = self.Session()
+        try:
+            if not tags:
+                # Answered from the timestamp index
+                return tuple(session.query(func.min(ThreatAnalysis.timestamp),
+                                           func.max(ThreatAnalysis.timestamp)).one())
+            q = session.query(func.min(AnalysisTags.timestamp), func.max(AnalysisTags.timestamp))
+            for tag_name, value in tags.items():
+                q = q.filter(self._tag_condition(tag_name, value))
+            return tuple(q.one())
+        finally:
+            session.close()
+
+    def _time_bucket(self, bucket):
+        column = AnalysisTags.timestamp
+        if self.engine.dialect.name != 'sqlite':
+            return func.date_trunc(bucket, column)
+        if bucket == 'week':
+            # Monday of the week, like date_trunc('week', ...)
+            return func.date(column, 'weekday 0', '-6 days')
+        formats = {'hour': '%Y-%m-%d %H:00:00', 'day': '%Y-%m-%d', 'month': '%Y-%m-01'}
+        return func.strftime(formats[bucket], column)
+
+    def count_by_time(self, bucket='day', name='Severity Level', start=None, end=None, tags=None):
+        """Count analyses per time bucket and value of an indexed tag.
+
+        `bucket` is one of TIME_BUCKETS. Returns (bucket start, value, count)
+        tuples, oldest bucket first; grouping happens in SQL, so only one
+        row per bucket and value is loaded.
+        """
+        if bucket not in self.TIME_BUCKETS:
+            raise ValueError(f"Unknown time bucket: {bucket}")
+        period = self._time_bucket(bucket).label('bucket')
+        column = getattr(AnalysisTags, TAG_FIELDS[name])
+        session = self.Session()
+        try:
+            q = session.query(period, column, func.count(AnalysisTags.analysis_id))
+            q = q.select_from(AnalysisTags)
+            for tag_name, value in (tags or {}).items():
+                q = q.filter(self._tag_condition(tag_name, value))
+            if start is not None:
+                q = q.filter(AnalysisTags.timestamp >= start)
+            if end is not None:
+                q = q.filter(AnalysisTags.timestamp < end)
+            rows = q.group_by(period, column).order_by(period).all()
+        finally:
+            session.close()
+        # SQLite hands the bucket back as text
+        return [(period if isinstance(period, datetime) else datetime.fromisoformat(period), value, count)
+                for period, value, count in rows]
+
+    def rollup_counts(self, dimension, limit=None, start=None, end=None):
+        """(key, label, count) rows of one rollup dimension, largest first.
+
+        `start`/`end` bound the key, e.g. days as 'YYYY-MM-DD'.
+        """
+        session = self.Session()
+        try:
+            # Stripes of one key are adjacent in the primary key index
+            count = func.sum(AnalysisRollup.count)
+            q = session.query(AnalysisRollup.key, func.max(AnalysisRollup.label), count).filter(
+                AnalysisRollup.dimension == dimension
             )
-            session.add(analysis)
-            session.commit()
-            result = self._to_dict(analysis)
-            return result
-        except Exception as e:
-            session.rollback()
-            raise
+            if start is not None:
+                q = q.filter(AnalysisRollup.key >= start)
+            if end is not None:
+                q = q.filter(AnalysisRollup.key < end)
+            q = q.group_by(AnalysisRollup.key).order_by(count.desc(), AnalysisRollup.key)
+            if limit is not None:
+                q = q.limit(limit)
+            return [(key, label or key, count) for key, label, count in q.all()]
         finally:
             session.close()
 
-    def get_all_analyses(self):
+    def heavy_hitters(self, name='indicators', k=10):
+        """The k most frequent keys of a sketch as (key, estimated count)."""
         session = self.Session()
         try:
-            analyses = session.query(ThreatAnalysis).all()
-            return [self._to_dict(analysis) for analysis in analyses]
+            return self._load_sketch(session, name).top_k(k)
+        finally:
+            session.close()
+
+    def rollup_summary(self, top=10):
+        """Totals, severity mix, per-day counts and top actors, sectors and
+        indicators, all read from the rollups."""
+        return {
+            'total': self.high_water_mark()[1],
+            'severity': {key: count for key, _, count in self.rollup_counts('severity')},
+            'per_day': dict(sorted((key, count) for key, _, count in self.rollup_counts('day'))),
+            'top_actors': [{'actor': label, 'count': count}
+                           for _, label, count in self.rollup_counts('actor', limit=top)],
+            'top_sectors': [{'sector': label, 'count': count}
+                            for _, label, count in self.rollup_counts('sector', limit=top)],
+            'top_indicators': [{'indicator': key, 'count': count}
+                               for key, count in self.heavy_hitters('indicators', k=top)],
+        }
+
+    def rebuild_rollups(self):
+        """Recompute every rollup from analysis_tags and analysis_iocs."""
+        session = self.Session()
+        try:
+            if self.engine.dialect.name == 'postgresql':
+                # Hold off new analyses so the counts match one snapshot
+                session.execute(text('LOCK TABLE threat_analyses IN SHARE MODE'))
+            session.query(AnalysisRollup).delete(synchronize_session=False)
+            session.query(RollupSketch).delete(synchronize_session=False)
+
+            counts = Counter()
+            labels = {}
+            q = session.query(AnalysisTags.timestamp, AnalysisTags.severity, AnalysisTags.threat_actor,
+                              AnalysisTags.threat_actor_key, AnalysisTags.target_sector)
+            for row in q.execution_options(yield_per=5000):
+                for dimension, key, label in rollup_increments(*row):
+                    counts[(dimension, key)] += 1
+                    labels.setdefault((dimension, key), label)
+            self._add_to_rollups(session, counts, labels)
+
+            hitters = HeavyHitters()
+            q = session.query(AnalysisIoc.ioc_type, AnalysisIoc.value, func.count()).group_by(
+                AnalysisIoc.ioc_type, AnalysisIoc.value)
+            for ioc_type, value, count in q.execution_options(yield_per=5000):
+                hitters.add(f"{ioc_type}:{value}", count)
+            self._save_sketch(session, 'indicators', hitters)
+            session.commit()
+            return f"{len(counts)} counters over {counts[('total', '')]} analyses, " \
+                   f"{hitters.total} indicator mentions"
+        except Exception:
+            session.rollback()
+            raise
         finally:
             session.close()
 
     def to_dataframe(self):
+        import pandas as pd
         analyses = self.get_all_analyses()
         return pd.DataFrame(analyses)
 
-    def export_analysis(self, format='csv'):
-        df = self.to_dataframe()
-        if format == 'csv':
-            return df.to_csv(index=False)
-        elif format == 'json':
-            return df.to_json(orient='records')
-        return None
+    def export_analysis(self, path, format='csv', compress=False):
+        """Stream every analysis to `path`; returns the bytes written."""
+        from .exporter import AnalysisExporter
+        if format not in AnalysisExporter.FORMATS:
+            return None
+        return AnalysisExporter(self).write(path, format, compress=compress)
+
+    def get_cached_response(self, key, max_age=None):
+        """Return (response, created_at) for a cache entry, or None."""
+        session = self.Session()
+        try:
+            entry = session.get(CachedResponse, key)
+            if entry is None:
+                return None
+            if max_age is not None and entry.created_at < datetime.utcnow() - timedelta(seconds=max_age):
+                return None
+            return entry.response, entry.created_at
+        finally:
+            session.close()
+
+    def put_cached_response(self, key, model, response):
+        session = self.Session()
+        try:
+            session.merge(CachedResponse(
+                key=key,
+                model=model,
+                response=response,
+                created_at=datetime.utcnow()
+            ))
+            session.commit()
+        except IntegrityError:
+            # Another session stored the same key concurrently
+            session.rollback()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def prune_cached_responses(self, max_age=None, max_entries=None):
+        session = self.Session()
+        try:
+            if max_age is not None:
+                cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+                session.query(CachedResponse).filter(
+                    CachedResponse.created_at < cutoff
+                ).delete(synchronize_session=False)
+            if max_entries is not None:
+                # Keep only the newest max_entries rows
+                newest = session.query(CachedResponse.created_at).order_by(
+                    CachedResponse.created_at.desc()
+                ).offset(max_entries).limit(1).scalar()
+                if newest is not None:
+                    session.query(CachedResponse).filter(
+                        CachedResponse.created_at <= newest
+                    ).delete(synchronize_session=False)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def clear_cached_responses(self):
+        session = self.Session()
+        try:
+            session.query(CachedResponse).delete(synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
 
-    def _to_dict(self, analysis):
+    def _to_dict(self, analysis, response=None):
         return {
+            'id': analysis.id,
             'timestamp': analysis.timestamp.isoformat(),
             'query': analysis.query,
-            'response': analysis.response,
+            'response': analysis.response if response is None else response,
             'tags': analysis.tags
         }
@@ -0,0 +1,206 @@
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import tempfile
+import zlib
+
+
+class AnalysisExporter:
+    """Streams stored analyses out as CSV, JSON, NDJSON or Parquet.
+
+    Rows are read from the database in chunks and written as they arrive, so
+    memory use stays flat no matter how large the history is. Text formats
+    can be gzip-compressed on the fly.
+
+    The app's download button holds the whole file in memory, so it only
+    offers exports up to EXPORT_DOWNLOAD_MAX_MB (checked against
+    estimate_size before anything is written); larger ones are written
+    straight to disk from the command line:
+        python -m utils.exporter csv threat_analysis.csv.gz --gzip
+    """
+
+    COLUMNS = ('id', 'timestamp', 'query', 'response', 'tags')
+    FORMATS = ('csv', 'json', 'ndjson', 'parquet')
+    MIME_TYPES = {
+        'csv': 'text/csv',
+        'json': 'application/json',
+        'ndjson': 'application/x-ndjson',
+        'parquet': 'application/vnd.apache.parquet'
+    }
+
+    def __init__(self, db, chunk_size=500):
+        self.db = db
+        self.chunk_size = chunk_size
+
+    def _rows(self):
+        return self.db.iter_analyses(columns=self.COLUMNS, chunk_size=self.chunk_size)
+
+    def _serialize(self, row):
+        # JSON columns are written as JSON text so they round-trip
+        return {
+            key: json.dumps(value) if key in ('response', 'tags') else value
+            for key, value in row.items()
+        }
+
+    def iter_text(self, format, rows=None):
+        """Yield the export (or just `rows`) as text chunks of roughly chunk_size rows."""
+        rows = self._rows() if rows is None else rows
+        if format == 'csv':
+            yield from self._iter_csv(rows)
+        elif format == 'ndjson':
+            yield from self._iter_ndjson(rows)
+        elif format == 'json':
+            yield from self._iter_json(rows)
+        else:
+            raise ValueError(f"Unsupported text export format: {format}")
+
+    def _iter_csv(self, rows):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=self.COLUMNS)
+        writer.writeheader()
+        for i, row in enumerate(rows, 1):
+            writer.writerow(self._serialize(row))
+            if i % self.chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def _iter_ndjson(self, rows):
+        lines = []
+        for row in rows:
+            lines.append(json.dumps(row))
+            if len(lines) >= self.chunk_size:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    def _iter_json(self, rows):
+        # A JSON array written element by element
+        yield '['
+        first = True
+        lines = []
+        for row in rows:
+            lines.append(('' if first else ',') + json.dumps(row))
+            first = False
+            if len(lines) >= self.chunk_size:
+                yield ''.join(lines)
+                lines = []
+        yield ''.join(lines) + ']'
+
+    def iter_bytes(self, format, compress=False, rows=None):
+        """Yield the export as UTF-8 bytes, gzip-compressed if requested."""
+        compressor = zlib.compressobj(wbits=31) if compress else None  # 31 = gzip container
+        for chunk in self.iter_text(format, rows):
+            data = chunk.encode('utf-8')
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                yield data
+        if compressor is not None:
+            yield compressor.flush()
+
+    def write(self, path, format, compress=False):
+        """Write the export to `path` and return the number of bytes written."""
+        if format == 'parquet':
+            return self._write_parquet(path, compression='gzip' if compress else 'snappy')
+
+        written = 0
+        with open(path, 'wb') as f:
+            for data in self.iter_bytes(format, compress=compress):
+                f.write(data)
+                written += len(data)
+        return written
+
+    def _write_parquet(self, path, compression='snappy'):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet export requires pyarrow: pip install pyarrow")
+
+        schema = pa.schema([
+            ('id', pa.int64()),
+            ('timestamp', pa.string()),
+            ('query', pa.string()),
+            ('response', pa.string()),
+            ('tags', pa.string())
+        ])
+
+        batch = []
+        with pq.ParquetWriter(path, schema, compression=compression) as writer:
+            for row in self._rows():
+                batch.append(self._serialize(row))
+                if len(batch) >= self.chunk_size:
+                    writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                    batch = []
+            if batch:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+        return os.path.getsize(path)
+
+    def estimate_size(self, format, compress=False, sample=200):
+        """Rough size in bytes of the export, without writing it.
+
+        The first `sample` rows are exported in memory and scaled up to the
+        row count. Parquet is estimated as gzipped NDJSON.
+        """
+        total = self.db.count_analyses()
+        if not total:
+            return 0
+        rows = self._rows()
+        try:
+            sampled = list(itertools.islice(rows, sample))
+        finally:
+            rows.close()
+        if format == 'parquet':
+            format, compress = 'ndjson', True
+        size = sum(len(data) for data in self.iter_bytes(format, compress, rows=sampled))
+        return int(size * total / len(sampled))
+
+    def summary_json(self, top=10):
+        """Aggregate summary (totals, severity mix, per-day counts, top
+        actors and indicators) read from the rollups, not the rows."""
+        return json.dumps(self.db.rollup_summary(top=top), indent=2)
+
+    def filename(self, format, compress=False):
+        name = f"threat_analysis.{format}"
+        if compress and format != 'parquet':
+            name += '.gz'
+        return name
+
+    def mime_type(self, format, compress=False):
+        if compress and format != 'parquet':
+            return 'application/gzip'
+        return self.MIME_TYPES[format]
+
+    def export_to_tempfile(self, format, compress=False):
+        """Write the export to a temporary file and return its path."""
+        fd, path = tempfile.mkstemp(suffix='_' + self.filename(format, compress))
+        os.close(fd)
+        try:
+            self.write(path, format, compress=compress)
+        except Exception:
+            os.remove(path)
+            raise
+        return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the stored analyses to a file")
+    parser.add_argument('format', choices=AnalysisExporter.FORMATS)
+    parser.add_argument('path')
+    parser.add_argument('--gzip', action='store_true',
+                        help="gzip text formats; Parquet uses gzip column compression")
+    args = parser.parse_args(argv)
+
+    from .database import Database
+    written = AnalysisExporter(Database()).write(args.path, args.format, compress=args.gzip)
+    print(f"Wrote {written} bytes to {args.path}")
+
+
+if __name__ == '__main__':
+    main()
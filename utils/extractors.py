@@ -0,0 +1,165 @@
+from html.parser import HTMLParser
+
+try:
+    import lxml  # noqa: F401
+    SOUP_PARSER = 'lxml'
+except ImportError:
+    SOUP_PARSER = 'html.parser'
+
+
+class ItemExtractor:
+    """Which elements of a scraped page hold the results we keep.
+
+    Matches `tag` elements (optionally with `css_class`), skips the first
+    `skip` of them and keeps the next `limit`, each reduced to its text the
+    way BeautifulSoup's get_text(strip=True) would.
+    """
+
+    def __init__(self, name, tag, css_class=None, skip=0, limit=5):
+        self.name = name
+        self.tag = tag
+        self.css_class = css_class
+        self.skip = skip
+        self.limit = limit
+
+    def matches(self, tag, attrs):
+        if tag != self.tag:
+            return False
+        if self.css_class is None:
+            return True
+        classes = (dict(attrs).get('class') or '').split()
+        return self.css_class in classes
+
+
+# Per-source extraction rules for ThreatAnalyzer.scrape_sources
+SOURCE_EXTRACTORS = {
+    # MITRE keyword search: results table, first row is the header
+    'cve': ItemExtractor('cve', 'tr', skip=1, limit=5),
+    # ExploitDB search: one card per exploit
+    'exploitdb': ItemExtractor('exploitdb', 'div', css_class='card', limit=5),
+}
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class _StreamingItemParser(HTMLParser):
+    # Text inside these never counts towards get_text()
+    SKIPPED_TAGS = {'script', 'style', 'template'}
+
+    def __init__(self, extractor):
+        super().__init__(convert_charrefs=True)
+        self.extractor = extractor
+        self.wanted = extractor.skip + extractor.limit
+        self.items = []
+        self.done = []
+        # Open elements named like the target tag: (item index or None, table depth)
+        self.open = []
+        self.capturing = []
+        self.table_depth = 0
+        self.skipped_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self.skipped_depth += 1
+            return
+        if tag == 'table':
+            self.table_depth += 1
+        if tag != self.extractor.tag:
+            return
+        if tag == 'tr':
+            # A new row implicitly closes an unterminated row of the same table
+            while self.open and self.open[-1][1] == self.table_depth:
+                self._close()
+        if self.extractor.matches(tag, attrs) and len(self.items) < self.wanted:
+            self.items.append([])
+            self.done.append(False)
+            self.capturing.append(len(self.items) - 1)
+            self.open.append((len(self.items) - 1, self.table_depth))
+        else:
+            self.open.append((None, self.table_depth))
+
+    def handle_startendtag(self, tag, attrs):
+        # Void elements carry no text
+        pass
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self.skipped_depth = max(0, self.skipped_depth - 1)
+            return
+        if tag == 'table':
+            # Rows left open inside a finished table end with it
+            while self.open and self.open[-1][1] == self.table_depth:
+                self._close()
+            self.table_depth = max(0, self.table_depth - 1)
+        if tag == self.extractor.tag and self.open:
+            self._close()
+
+    def _close(self):
+        index, _ = self.open.pop()
+        if index is None:
+            return
+        self.done[index] = True
+        self.capturing.remove(index)
+        if len(self.items) >= self.wanted and all(self.done[:self.wanted]):
+            raise _StopParsing()
+
+    def handle_data(self, data):
+        if self.skipped_depth or not self.capturing:
+            return
+        text = data.strip()
+        if text:
+            for index in self.capturing:
+                self.items[index].append(text)
+
+
+def extract_items_streaming(html, extractor, chunk_size=65536):
+    """Pull the wanted items out of a page, stopping as soon as they are complete.
+
+    The page is fed to the stdlib HTML tokenizer in chunks and no tree is
+    built, so a long results page is only read as far as its first
+    skip + limit matches.
+    """
+    parser = _StreamingItemParser(extractor)
+    try:
+        for start in range(0, len(html), chunk_size):
+            parser.feed(html[start:start + chunk_size])
+        parser.close()
+    except _StopParsing:
+        pass
+    texts = [''.join(parts) for parts in parser.items]
+    return texts[extractor.skip:extractor.skip + extractor.limit]
+
+
+def _has_class(value, css_class):
+    if not value:
+        return False
+    if isinstance(value, str):
+        value = value.split()
+    return css_class in value
+
+
+def extract_items_strainer(html, extractor):
+    """BeautifulSoup parse restricted by a SoupStrainer, using lxml when installed."""
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    if extractor.css_class:
+        # While the strainer runs the class attribute is still the raw
+        # string, so match on its words rather than the whole value
+        strainer = SoupStrainer(extractor.tag, class_=lambda value: _has_class(value, extractor.css_class))
+    else:
+        strainer = SoupStrainer(extractor.tag)
+    soup = BeautifulSoup(html, SOUP_PARSER, parse_only=strainer)
+    if extractor.css_class:
+        elements = soup.find_all(extractor.tag, class_=extractor.css_class)
+    else:
+        elements = soup.find_all(extractor.tag)
+    elements = elements[extractor.skip:extractor.skip + extractor.limit]
+    return [element.get_text(strip=True) for element in elements if element]
+
+
+def extract_items(html, extractor, method='stream'):
+    if method == 'strainer':
+        return extract_items_strainer(html, extractor)
+    return extract_items_streaming(html, extractor)
@@ -1,11 +1,72 @@
 import os
 import json
-from openai import OpenAI
+import math
+import re
+from .instrumentation import CACHE_LOOKUPS, get_logger, log_payload, truncate
+from .llm_client import LLMClient, configured_models
+from .report_parser import SECTION_TITLES
+from .tags import SEVERITY_LEVELS, TAG_FIELDS
+
+# Report sections the combined request asks for: the ones the plain
+# analysis prompt covers (it has no impact or mitigations section)
+COMBINED_SECTIONS = [name for name, _, _ in SECTION_TITLES
+                     if name not in ("impact", "mitigations")]
+
+# Structured output for the combined analyze+tag request: those sections
+# plus the tag fields tag_threat_data asks for. Strict mode makes every
+# property required, so the schema lists only what the prompt asks for
+COMBINED_SCHEMA = {
+    "name": "threat_analysis",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "analysis": {
+                "type": "object",
+                "properties": {
+                    "summary": {"type": "string"},
+                    **{name: {"type": "array", "items": {"type": "string"}}
+                       for name in COMBINED_SECTIONS},
+                },
+                "required": ["summary"] + COMBINED_SECTIONS,
+                "additionalProperties": False,
+            },
+            "tags": {
+                "type": "object",
+                "properties": {
+                    **{name: {"type": "string"} for name in TAG_FIELDS},
+                    "Severity Level": {"type": "string", "enum": list(reversed(SEVERITY_LEVELS))},
+                },
+                "required": list(TAG_FIELDS),
+                "additionalProperties": False,
+            },
+        },
+        "required": ["analysis", "tags"],
+        "additionalProperties": False,
+    },
+}
+
+CODE_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+logger = get_logger(__name__)
+
+
+def estimate_tokens(text):
+    # Rough count for when the API doesn't report usage (~4 chars/token)
+    return math.ceil(len(text) / 4)
 
 
 class GPTHelper:
 
-    def __init__(self):
+    SYSTEM_PROMPT = "You are a cybersecurity expert analyzing threat data."
+
+    def __init__(self, cache=None, rate_limiter=None):
+        # Optional ResponseCache; repeated prompts are answered from it
+        self.cache = cache
+        # Optional TokenBucket; every request that reaches the API is counted,
+        # retries and hedges included
+        self.rate_limiter = rate_limiter
+
         # Get API key from environment variable or prompt user if not found
         self.openai_api_key = os.environ.get("OPENROUTER_API_KEY")
 
@@ -13,100 +74,221 @@ class GPTHelper:
         if self.openai_api_key:
             masked_key = self.openai_api_key[:4] + "..." + self.openai_api_key[
                 -4:] if len(self.openai_api_key) > 8 else "***"
-            print(f"Found OpenRouter API key: {masked_key}")
+            logger.info("Found OpenRouter API key: %s", masked_key)
         else:
-            print("WARNING: No OpenRouter API key found. API calls will fail.")
-            print(
-                "Please set your OPENROUTER_API_KEY as an environment variable."
-            )
+            logger.warning("No OpenRouter API key found; API calls will fail. "
+                           "Set OPENROUTER_API_KEY as an environment variable.")
             # Default key for initialization, but it won't work for actual API calls
             self.openai_api_key = "missing_key"
 
-        print("Using OpenRouter API")
-        # OpenRouter requires API key in Authorization header format
-        self.client = OpenAI(base_url="https://openrouter.ai/api/v1",
-                             api_key=self.openai_api_key,
-                             default_headers={
-                                 "HTTP-Referer": "https://replit.com/",
-                                 "X-Title": "Cyber Threat Analysis Platform"
-                             })
-        # Set Gemma model for OpenRouter
-        self.openai_model = "google/gemma-3-12b-it:free"
+        # OPENROUTER_BASE_URL points the client at any OpenAI-compatible
+        # endpoint, e.g. the stub server in benchmarks/stub_servers.py
+        self.base_url = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+        self.timeout = float(os.environ.get("LLM_TIMEOUT", 120))
+        # Models in fallback order (OPENROUTER_MODELS); the first one names
+        # cache entries
+        self.models = configured_models()
+        self.openai_model = self.models[0]
+        self.temperature = 0.3
+        self.max_tokens = 1024
+        # The combined request returns the tags on top of the analysis
+        self.combined_max_tokens = self.max_tokens + 256
+        # The client (and the openai SDK) is only loaded for the first request
+        self.llm = LLMClient(models=self.models, rate_limiter=rate_limiter,
+                             client_factory=self._build_client)
+
+    def _build_client(self):
+        from openai import OpenAI
+        # OpenRouter requires API key in Authorization header format.
+        # Retries are done by LLMClient, so the SDK's own are turned off
+        return OpenAI(base_url=self.base_url,
+                      api_key=self.openai_api_key,
+                      max_retries=0,
+                      timeout=self.timeout,
+                      default_headers={
+                          "HTTP-Referer": "https://replit.com/",
+                          "X-Title": "Cyber Threat Analysis Platform"
+                      })
+
+    @property
+    def client(self):
+        return self.llm.client
+
+    def _missing_key_response(self):
+        return {
+            "error":
+            "OpenRouter API key not set. Please set the OPENROUTER_API_KEY environment variable.",
+            "raw_response":
+            "",
+            "setup_instructions":
+            "Go to Secrets Tool in Replit and add your OPENROUTER_API_KEY"
+        }
+
+    def _messages(self, prompt):
+        return [{
+            "role": "system",
+            "content": self.SYSTEM_PROMPT
+        }, {
+            "role": "user",
+            "content": prompt
+        }]
+
+    def _cache_key(self, model, prompt, max_tokens=None):
+        # Keyed on the max_tokens the request is actually sent with
+        return self.cache.make_key(model, self.SYSTEM_PROMPT, prompt, self.temperature,
+                                   max_tokens or self.max_tokens)
+
+    def _cache_lookup(self, prompt, max_tokens=None):
+        """A cached answer from the primary model, or None."""
+        if self.cache is None:
+            return None
+        cached = self.cache.get(self._cache_key(self.openai_model, prompt, max_tokens))
+        CACHE_LOOKUPS.inc(cache="llm_response", result="miss" if cached is None else "hit")
+        if cached is not None:
+            logger.debug("Serving cached response for %s", self.openai_model)
+            if "usage" in cached:
+                # The tokens were spent by the call that filled the cache
+                cached = {**cached, "usage": {**cached["usage"], "cached": True}}
+        return cached
+
+    def _cache_store(self, prompt, response, max_tokens=None):
+        """Cache a successful response under the model that answered it.
+
+        A fallback model's answer is keyed on that model, so lookups (made
+        for the primary model) never serve it as a primary-model answer.
+        """
+        if self.cache is None or response.get("status") != "success":
+            return
+        model = response.get("usage", {}).get("model") or self.openai_model
+        self.cache.set(self._cache_key(model, prompt, max_tokens), model, response)
 
     def _send_request(self, prompt):
         if not self.openai_api_key or self.openai_api_key == "missing_key":
-            return {
-                "error":
-                "OpenRouter API key not set. Please set the OPENROUTER_API_KEY environment variable.",
-                "raw_response":
-                "",
-                "setup_instructions":
-                "Go to Secrets Tool in Replit and add your OPENROUTER_API_KEY"
-            }
+            return self._missing_key_response()
+
+        cached = self._cache_lookup(prompt)
+        if cached is not None:
+            return cached
+
+        response = self._request_completion(prompt)
+        self._cache_store(prompt, response)
+        return response
 
+    def _request_completion(self, prompt):
         try:
-            print(f"Sending request to OpenRouter ({self.openai_model})...")
-            # The OpenAI client already has the API key set, no need for extra headers
-            completion = self.client.chat.completions.create(
-                model=self.openai_model,
-                messages=[{
-                    "role":
-                    "system",
-                    "content":
-                    "You are a cybersecurity expert analyzing threat data."
-                }, {
-                    "role": "user",
-                    "content": prompt
-                }],
-                temperature=0.3,
-                max_tokens=1024)
-
-            response_text = completion.choices[0].message.content.strip()
-            print(f"Raw response from OpenRouter: {response_text}")
-            print(f"Response length: {len(response_text)}")
-            print(f"Response type: {type(response_text)}")
-
-            # Try to parse as JSON
-            try:
-                json_response = json.loads(response_text)
-                return {
-                    "status": "success",
-                    "format": "json",
-                    "data": json_response
-                }
-            except json.JSONDecodeError:
-                print(
-                    f"Failed to parse OpenRouter response as JSON, formatting as text"
-                )
-                # Structure the text response
-                return {
-                    "status": "success",
-                    "format": "text",
-                    "data": {
-                        "content":
-                        response_text,
-                        "sections": [
-                            s.strip() for s in response_text.split('\n\n')
-                            if s.strip()
-                        ]
-                    }
-                }
+            logger.debug("Sending request to OpenRouter (%s)", ", ".join(self.models))
+            # Identical concurrent prompts share one call; failures are
+            # retried and fall back through self.models
+            completion = self.llm.complete(
+                self._messages(prompt),
+                temperature=self.temperature,
+                max_tokens=self.max_tokens)
+
+            response_text = completion.text.strip()
+            log_payload(logger, f"Raw response from {completion.model} ({len(response_text)} chars)",
+                        response_text)
+
+            response = self._parse_response_text(response_text)
+            response["usage"] = self._usage(prompt, response_text, completion.model, completion.usage)
+            return response
         except Exception as e:
-            print(f"Error in OpenRouter request: {str(e)}")
+            logger.error("OpenRouter request failed: %s", e)
+            return self._request_failed_response(e)
+
+    def _usage(self, prompt, response_text, model, reported=None):
+        """Prompt and completion size of one call, for cost accounting.
+
+        Token counts are the API's when it reports them, else estimated.
+        """
+        prompt_chars = len(self.SYSTEM_PROMPT) + len(prompt)
+        usage = {
+            "model": model,
+            "prompt_chars": prompt_chars,
+            "completion_chars": len(response_text),
+        }
+        if reported and reported.get("prompt_tokens") is not None:
+            usage["prompt_tokens"] = reported["prompt_tokens"]
+            usage["completion_tokens"] = reported.get("completion_tokens") or 0
+        else:
+            usage["prompt_tokens"] = estimate_tokens(self.SYSTEM_PROMPT + prompt)
+            usage["completion_tokens"] = estimate_tokens(response_text)
+            usage["estimated"] = True
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return usage
+
+    def _request_failed_response(self, error, raw_response=""):
+        return {
+            "error":
+            f"Request failed: {str(error)}",
+            "raw_response":
+            raw_response,
+            "setup_instructions":
+            "Verify your OpenRouter API key is valid and properly configured."
+        }
+
+    def _parse_response_text(self, response_text):
+        # Try to parse as JSON
+        try:
+            json_response = json.loads(response_text)
+            return {
+                "status": "success",
+                "format": "json",
+                "data": json_response
+            }
+        except json.JSONDecodeError:
+            logger.debug("OpenRouter response is not JSON, formatting as text")
+            # Structure the text response
             return {
-                "error":
-                f"Request failed: {str(e)}",
-                "raw_response":
-                "",
-                "setup_instructions":
-                "Verify your OpenRouter API key is valid and properly configured."
+                "status": "success",
+                "format": "text",
+                "data": {
+                    "content":
+                    response_text,
+                    "sections": [
+                        s.strip() for s in response_text.split('\n\n')
+                        if s.strip()
+                    ]
+                }
             }
 
+    def _stream_request(self, prompt, finalize=None):
+        if not self.openai_api_key or self.openai_api_key == "missing_key":
+            return ResponseStream(iter(()), self._missing_key_response())
+
+        cached = self._cache_lookup(prompt)
+        if cached is not None:
+            content = cached.get("data", {}).get("content")
+            if content is None:
+                content = json.dumps(cached.get("data", {}))
+            return ResponseStream(iter([content]), cached)
+
+        stream = None
+
+        def chunks():
+            nonlocal stream
+            logger.debug("Streaming request to OpenRouter (%s)", ", ".join(self.models))
+            stream = self.llm.stream(
+                self._messages(prompt),
+                temperature=self.temperature,
+                max_tokens=self.max_tokens)
+            yield from stream
+
+        def parse(response_text):
+            response = self._parse_response_text(response_text.strip())
+            # The model that answered, which may be a fallback
+            response["usage"] = self._usage(prompt, response_text, stream.model, stream.usage)
+            if finalize is not None:
+                response = finalize(response)
+            self._cache_store(prompt, response)
+            return response
+
+        return ResponseStream(chunks(), parse=parse,
+                              on_error=self._request_failed_response)
+
     # need to work on this function for prompt in order to get the right response.
 
-    def analyze_threat(self, query, context=""):
-        print(f"\nAnalyzing threat query: {query}")
-        prompt = f"""You are a cybersecurity expert analyzing cyber threat data.
+    def _build_analysis_prompt(self, query, context=""):
+        return f"""You are a cybersecurity expert analyzing cyber threat data.
         
         Analyze this query and provide a detailed response with the following structure:
 
@@ -147,8 +329,7 @@ class GPTHelper:
         4. Use plain text only - no JSON, markdown, or code blocks
         """
 
-        response = self._send_request(prompt)
-
+    def _fill_empty_analysis(self, response):
         # Handle empty responses
         if isinstance(response, dict) and response.get('status') == 'success':
             if not response.get('data', {}).get('content'):
@@ -161,8 +342,28 @@ class GPTHelper:
 
         return response
 
+    def analyze_threat(self, query, context=""):
+        logger.info("Analyzing threat query", extra={"fields": {"query": truncate(query, 200)}})
+        prompt = self._build_analysis_prompt(query, context)
+        response = self._send_request(prompt)
+        return self._fill_empty_analysis(response)
+
+    def stream_threat_analysis(self, query, context=""):
+        """Stream the analysis text as it is generated.
+
+        Iterating the returned ResponseStream yields text chunks; once it is
+        exhausted, `stream.response` holds the same structure that
+        analyze_threat would have returned.
+        """
+        logger.info("Streaming threat analysis", extra={"fields": {"query": truncate(query, 200)}})
+        prompt = self._build_analysis_prompt(query, context)
+        return self._stream_request(prompt, finalize=self._fill_empty_analysis)
+
     def tag_threat_data(self, data):
-        print(f"\nTagging threat data: {data}")
+        if isinstance(data, dict):
+            # An analysis response; its usage accounting isn't threat data
+            data = str({key: value for key, value in data.items() if key != "usage"})
+        log_payload(logger, "Tagging threat data", data)
         prompt = f"""Tag the following cyber threat data with relevant categories.
         
         IMPORTANT: Your response MUST be in valid JSON format with these fields: 
@@ -180,3 +381,130 @@ class GPTHelper:
         """
 
         return self._send_request(prompt)
+
+
+    def _build_combined_prompt(self, query, context=""):
+        sections = ", ".join(COMBINED_SECTIONS)
+        return f"""Analyze this cyber threat query and classify it, in one JSON object.
+
+        "analysis": "summary" (a short overview) and lists of strings for: {sections}.
+        Timeline entries follow the attack stages (reconnaissance, initial compromise,
+        lateral movement, exfiltration, persistence). IoCs are concrete IPs, hashes and
+        domains; CVEs are CVE IDs with a short description.
+        "tags": "TTP", "attack_vector", "threat_actor", "target_sector" (strings) and
+        "Severity Level" (one of Low/Medium/High/Critical).
+
+        Context: {context}
+        Query: {query}
+
+        Respond with the JSON object only: no markdown, backticks or other text.
+        """
+
+    def _request_structured(self, prompt):
+        from openai import BadRequestError
+        messages = self._messages(prompt)
+        try:
+            logger.debug("Sending combined analysis request to OpenRouter (%s)", ", ".join(self.models))
+            try:
+                completion = self.llm.complete(
+                    messages,
+                    temperature=self.temperature,
+                    max_tokens=self.combined_max_tokens,
+                    response_format={"type": "json_schema", "json_schema": COMBINED_SCHEMA})
+            except BadRequestError as e:
+                # Models without structured output support reject the
+                # schema; the prompt asks for the same JSON
+                logger.warning("Structured output rejected (%s); retrying without a schema", e)
+                completion = self.llm.complete(
+                    messages,
+                    temperature=self.temperature,
+                    max_tokens=self.combined_max_tokens)
+            response_text = CODE_FENCE_PATTERN.sub("", completion.text.strip())
+            log_payload(logger, f"Raw combined response from {completion.model} ({len(response_text)} chars)",
+                        response_text)
+            response = self._parse_response_text(response_text)
+            response["usage"] = self._usage(prompt, response_text, completion.model, completion.usage)
+            return response
+        except Exception as e:
+            logger.error("OpenRouter request failed: %s", e)
+            return self._request_failed_response(e)
+
+    def analyze_and_tag(self, query, context=""):
+        """Analyze and tag a query with a single structured-output request.
+
+        Returns (response, tags) shaped like analyze_threat's and
+        tag_threat_data's results. If the model doesn't return the expected
+        JSON, its text is kept as the analysis and tagged with a second call.
+        """
+        logger.info("Analyzing and tagging threat query", extra={"fields": {"query": truncate(query, 200)}})
+        if not self.openai_api_key or self.openai_api_key == "missing_key":
+            response = self._missing_key_response()
+            return response, response
+
+        prompt = self._build_combined_prompt(query, context)
+        combined = self._cache_lookup(prompt, self.combined_max_tokens)
+        if combined is None:
+            combined = self._request_structured(prompt)
+            if self._combined_parts(combined) is not None:
+                self._cache_store(prompt, combined, self.combined_max_tokens)
+
+        if "error" in combined:
+            return combined, combined
+        parts = self._combined_parts(combined)
+        if parts is None:
+            logger.warning("Combined response did not match the schema; tagging separately")
+            response = self._fill_empty_analysis(combined)
+            return response, self.tag_threat_data(response)
+
+        analysis, tags = parts
+        response = {"status": "success", "format": "json", "data": analysis}
+        if "usage" in combined:
+            response["usage"] = combined["usage"]
+        return response, {"status": "success", "format": "json", "data": tags}
+
+    def _combined_parts(self, combined):
+        data = combined.get("data") if combined.get("format") == "json" else None
+        if not isinstance(data, dict):
+            return None
+        analysis, tags = data.get("analysis"), data.get("tags")
+        if not isinstance(analysis, dict) or not isinstance(tags, dict):
+            return None
+        return analysis, tags
+
+
+class ResponseStream:
+    """Iterable of text chunks from a streamed completion.
+
+    The full text is parsed once, after the last chunk arrives, and the
+    result is exposed as `response`. Streams that never reached the API
+    (missing key, cache hit) are created with their final response up front.
+    `finished` stays False if the consumer stops iterating early, in which
+    case there is no response.
+    """
+
+    def __init__(self, chunks, response=None, parse=None, on_error=None):
+        self._chunks = chunks
+        self._parse = parse
+        self._on_error = on_error
+        self.text = ""
+        self.response = response
+        self.finished = response is not None
+
+    def __iter__(self):
+        parts = []
+        try:
+            for chunk in self._chunks:
+                parts.append(chunk)
+                yield chunk
+        except Exception as e:
+            logger.error("OpenRouter stream failed: %s", e)
+            self.text = "".join(parts)
+            if self._on_error is not None:
+                self.response = self._on_error(e, self.text)
+            self.finished = True
+            return
+
+        self.text = "".join(parts)
+        if self._parse is not None:
+            self.response = self._parse(self.text)
+        self.finished = True
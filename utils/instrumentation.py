@@ -0,0 +1,398 @@
+"""Logging, metrics and profiling for the hot paths.
+
+Logging: modules log through get_logger(__name__). LOG_LEVEL (default
+INFO) sets the level and LOG_FORMAT=json switches to one JSON object per
+line; fields passed as extra={'fields': {...}} are appended as key=value.
+Large payloads (model responses, tagged data) only go out at DEBUG, cut to
+LOG_PAYLOAD_CHARS and sampled at LOG_PAYLOAD_SAMPLE.
+
+Metrics: counters and histograms are kept in process and rendered in the
+Prometheus text format. With METRICS_PORT set, start_metrics_server()
+serves them on http://0.0.0.0:<port>/metrics.
+
+Profiling: `with profile('analysis', enabled=True) as run:` profiles the
+calling thread (pyinstrument when installed, else cProfile), saves the
+result under PROFILE_DIR (default .profiles, git-ignored) and leaves a
+text summary in run.report.
+PROFILE=1 turns it on for every run that doesn't say otherwise.
+"""
+import bisect
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+LOGGER_ROOT = 'cyberthreat'
+PAYLOAD_CHARS = int(os.environ.get('LOG_PAYLOAD_CHARS', 500))
+PAYLOAD_SAMPLE = float(os.environ.get('LOG_PAYLOAD_SAMPLE', 1.0))
+
+_configure_lock = threading.Lock()
+_configured = False
+
+
+class StructuredFormatter(logging.Formatter):
+    """`time level logger message key=value ...`, or JSON with LOG_FORMAT=json."""
+
+    def __init__(self, as_json=False):
+        super().__init__()
+        self.as_json = as_json
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        timestamp = datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z'
+        if self.as_json:
+            entry = {'time': timestamp, 'level': record.levelname,
+                     'logger': record.name, 'message': record.getMessage(), **fields}
+            if record.exc_info:
+                entry['exception'] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+        line = f"{timestamp} {record.levelname:<7} {record.name} {record.getMessage()}"
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def configure_logging(level=None, as_json=None):
+    """Attach the structured handler to the package logger, once per process."""
+    global _configured
+    with _configure_lock:
+        logger = logging.getLogger(LOGGER_ROOT)
+        if _configured and level is None and as_json is None:
+            return logger
+        level = level or os.environ.get('LOG_LEVEL', 'INFO')
+        if as_json is None:
+            as_json = os.environ.get('LOG_FORMAT', 'text') == 'json'
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        handler = logging.StreamHandler()
+        handler.setFormatter(StructuredFormatter(as_json))
+        logger.addHandler(handler)
+        logger.setLevel(level.upper() if isinstance(level, str) else level)
+        logger.propagate = False
+        _configured = True
+        return logger
+
+
+def get_logger(name):
+    """Logger for a module; `utils.gpt_helper` logs as `cyberthreat.utils.gpt_helper`."""
+    if not _configured:
+        configure_logging()
+    return logging.getLogger(f"{LOGGER_ROOT}.{name}")
+
+
+def truncate(text, limit=None):
+    limit = PAYLOAD_CHARS if limit is None else limit
+    text = str(text)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... ({len(text)} chars)"
+
+
+def log_payload(logger, message, payload):
+    """Log a large value at DEBUG, truncated and sampled.
+
+    Nothing is formatted unless DEBUG is on and the sample picks this call,
+    so payload logging costs nothing on the normal path.
+    """
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < PAYLOAD_SAMPLE:
+        logger.debug('%s: %s', message, truncate(payload))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{self._label_text(key)} {value:g}"]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), sum
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the block takes, whether or not it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            series = self._values.get(self._key(labels))
+            return sum(series[0]) if series else 0
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else f"{bound:g}"
+            lines.append(f"{self.name}_bucket{self._label_text(key, [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {total:g}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics of this process, rendered together for a scrape."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labels, **kwargs)
+            elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+                raise ValueError(f"Metric {name} is already registered differently")
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._get(Counter, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+# The hot paths; each is recorded where the work happens
+LLM_REQUEST_SECONDS = metrics.histogram(
+    'cta_llm_request_seconds', 'LLM API calls by model and outcome', ('model', 'outcome'))
+LLM_TOKENS = metrics.counter(
+    'cta_llm_tokens_total', 'Tokens reported by the LLM API', ('model', 'kind'))
+SCRAPE_SECONDS = metrics.histogram(
+    'cta_scrape_seconds', 'Scrape source lookups by source and outcome', ('source', 'outcome'))
+DB_WRITE_SECONDS = metrics.histogram(
+    'cta_db_write_seconds', 'Database write transactions', ('operation',))
+DB_ROWS_WRITTEN = metrics.counter(
+    'cta_db_rows_written_total', 'Analyses stored', ('operation',))
+PIPELINE_STAGE_SECONDS = metrics.histogram(
+    'cta_pipeline_stage_seconds', 'Analysis pipeline stages', ('stage',))
+RENDER_SECONDS = metrics.histogram(
+    'cta_render_seconds', 'Streamlit page sections', ('section',))
+CACHE_LOOKUPS = metrics.counter(
+    'cta_cache_lookups_total', 'Cache lookups by cache and result', ('cache', 'result'))
+STARTUP_SECONDS = metrics.histogram(
+    'cta_startup_seconds', 'Process start-up phases, recorded once each', ('phase',))
+
+_startup_lock = threading.Lock()
+_startup = {}
+
+
+def record_startup(phase, seconds):
+    """Record how long a start-up phase took, the first time it completes.
+
+    Streamlit re-executes the page script on every rerun, so later calls
+    for the same phase are ignored.
+    """
+    with _startup_lock:
+        if phase in _startup:
+            return
+        _startup[phase] = seconds
+    STARTUP_SECONDS.observe(seconds, phase=phase)
+    get_logger(__name__).info('Startup phase done', extra={'fields': {
+        'phase': phase, 'seconds': f"{seconds:.3f}"}})
+
+
+def startup_timings():
+    with _startup_lock:
+        return dict(_startup)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown the application log
+        pass
+
+
+_server_lock = threading.Lock()
+_server = None
+
+
+def start_metrics_server(port=None, host='0.0.0.0'):
+    """Serve /metrics from a daemon thread; once per process.
+
+    Without a port argument METRICS_PORT is used, and nothing is started
+    when that isn't set. Returns the server, or None.
+    """
+    global _server
+    if port is None:
+        port = os.environ.get('METRICS_PORT')
+        if not port:
+            return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+            except OSError as e:
+                get_logger(__name__).warning('Metrics server not started on port %s: %s', port, e)
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name='metrics', daemon=True).start()
+            get_logger(__name__).info('Serving metrics', extra={'fields': {
+                'url': f"http://{host}:{_server.server_address[1]}/metrics"}})
+        return _server
+
+
+class ProfileRun:
+    """Result of a profile() block: where it was saved and a text summary."""
+
+    def __init__(self, name):
+        self.name = name
+        self.path = None
+        self.report = ''
+        self.skipped = None
+
+
+# cProfile and pyinstrument both hook the interpreter globally; two
+# profiled requests at once would fight over it
+_profile_lock = threading.Lock()
+
+
+@contextmanager
+def profile(name, enabled=None, profile_dir=None, top=25):
+    """Profile the calling thread for the duration of the block.
+
+    Work handed to other threads (the pipeline's scrapes, the LLM client's
+    hedged requests) shows up as waiting, not as its own frames. Yields a
+    ProfileRun that is filled in once the block exits; if another profile
+    is running the block runs unprofiled and run.skipped says why.
+    """
+    if enabled is None:
+        enabled = os.environ.get('PROFILE', '0') == '1'
+    run = ProfileRun(name)
+    if not enabled:
+        yield run
+        return
+    if not _profile_lock.acquire(blocking=False):
+        run.skipped = 'another profile is running'
+        yield run
+        return
+    try:
+        profile_dir = profile_dir or os.environ.get('PROFILE_DIR', '.profiles')
+        os.makedirs(profile_dir, exist_ok=True)
+        stem = os.path.join(profile_dir, f"{name}-{datetime.utcnow():%Y%m%dT%H%M%S%f}")
+        if pyinstrument is not None:
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+            try:
+                yield run
+            finally:
+                profiler.stop()
+                run.path = stem + '.html'
+                with open(run.path, 'w', encoding='utf-8') as f:
+                    f.write(profiler.output_html())
+                run.report = profiler.output_text()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield run
+            finally:
+                profiler.disable()
+                run.path = stem + '.prof'
+                profiler.dump_stats(run.path)
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(top)
+                run.report = out.getvalue()
+        get_logger(__name__).info('Saved profile', extra={'fields': {'name': name, 'path': run.path}})
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,152 @@
+"""Indicator-of-compromise extraction.
+
+One compiled regular expression finds every supported indicator type in a
+single scan of the text: URLs, CVE IDs, MITRE ATT&CK technique IDs,
+SHA256/SHA1/MD5 hashes, IPv4 and IPv6 addresses and domains. Defanged
+forms (hxxp://, 1.2.3[.]4, example[dot]com, ...) are matched as well and
+stored refanged, so lookups work whichever form was written.
+
+Hostnames of the sites analyses are scraped from or cite as references
+(REFERENCE_DOMAINS) appear in nearly every stored analysis and are left
+out, as are URLs on them.
+"""
+import ipaddress
+import re
+
+IOC_TYPES = ('url', 'cve', 'technique', 'sha256', 'sha1', 'md5', 'ipv4', 'ipv6', 'domain')
+
+# A dot, plain or defanged
+_DOT = r'(?:\.|\[\.\]|\(\.\)|\{\.\}|\[dot\]|\(dot\))'
+_OCTET = r'(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)'
+_LABEL = r'[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?'
+
+# One sub-pattern per indicator type. Order matters where types overlap:
+# URLs before the domains inside them, longer hashes before shorter ones.
+IOC_PATTERNS = {
+    'url': r'\b(?:hxxps?|https?|ftp|fxp)(?:://|\[://\]|\[:\]//)[^\s<>"\'`]+',
+    'cve': r'\bcve-\d{4}-\d{4,7}\b',
+    'technique': r'\bT\d{4}(?:\.\d{3})?\b',
+    'sha256': r'(?<![0-9a-f])[0-9a-f]{64}(?![0-9a-f])',
+    'sha1': r'(?<![0-9a-f])[0-9a-f]{40}(?![0-9a-f])',
+    'md5': r'(?<![0-9a-f])[0-9a-f]{32}(?![0-9a-f])',
+    'ipv4': rf'(?<![\d.]){_OCTET}(?:{_DOT}{_OCTET}){{3}}(?!\d|\.\d)',
+    # Candidates only; validated with the ipaddress module
+    'ipv6': r'(?<![0-9a-f:])(?=[0-9a-f]{0,4}:[0-9a-f]{0,4}:)[0-9a-f:]{2,39}(?![0-9a-f:])',
+    'domain': rf'(?<![\w.-]){_LABEL}(?:{_DOT}{_LABEL})*{_DOT}(?:[a-z]{{2,24}}|xn--[a-z0-9-]{{2,59}})\b(?![.-]\w)',
+}
+
+# Every type in one alternation, so the text is scanned once
+IOC_PATTERN = re.compile(
+    '|'.join(f'(?P<{kind}>{pattern})' for kind, pattern in IOC_PATTERNS.items()),
+    re.IGNORECASE
+)
+
+# Whitespace-delimited tokens that could hold an indicator: every type
+# contains a digit, dot, colon or defanging bracket. Finding these is much
+# cheaper than trying the full alternation at every position, so
+# IOC_PATTERN only runs inside candidate tokens.
+CANDIDATE_PATTERN = re.compile(r'(?<![^\s<>"\'`])[^\s<>"\'`\d.:\[(]*+[\d.:\[(][^\s<>"\'`]*+')
+
+_REFANG_PATTERN = re.compile(r'\[\.\]|\(\.\)|\{\.\}|\[dot\]|\(dot\)|\[://\]|\[:\]', re.IGNORECASE)
+_REFANG = {'[://]': '://', '[:]': ':'}
+
+# Generic TLDs accepted for domains; two-letter country codes are accepted
+# unless they are a common file extension. Anything else (cmd.exe,
+# attacks.The) is prose or a file name, not a domain.
+GENERIC_TLDS = {
+    'com', 'net', 'org', 'info', 'biz', 'gov', 'edu', 'mil', 'int', 'arpa', 'xyz', 'top',
+    'online', 'site', 'club', 'shop', 'store', 'app', 'dev', 'cloud', 'live', 'tech',
+    'space', 'website', 'pro', 'name', 'mobi', 'asia', 'tel', 'onion', 'icu', 'vip',
+    'work', 'link', 'click', 'buzz', 'fun', 'host', 'press', 'best', 'support',
+    'services', 'email', 'download', 'win', 'bid', 'loan', 'date', 'party', 'review',
+    'stream', 'trade', 'science', 'cam', 'monster', 'rest', 'bar', 'today', 'world',
+}
+NOT_DOMAIN_TLDS = {'py', 'sh', 'js', 'db', 'gz', 'eg', 'ie', 'vs', 'md', 'ps', 'so', 'pl'}
+
+# The CVE and ExploitDB scrape sources, the NVD and MITRE ATT&CK; a domain
+# or URL on any of these (or a subdomain) is a reference, not an indicator
+REFERENCE_DOMAINS = ('cve.org', 'mitre.org', 'exploit-db.com', 'nist.gov')
+
+# Trailing characters that end the sentence rather than the URL
+_URL_TRAILING = '.,;:!?)]}\'"'
+
+
+def refang(value):
+    value = _REFANG_PATTERN.sub(lambda m: _REFANG.get(m.group(0), '.'), value)
+    if value[:4].lower() in ('hxxp', 'fxp:'):
+        value = {'hxxp': 'http', 'fxp:': 'ftp:'}[value[:4].lower()] + value[4:]
+    return value
+
+
+def _normalize(kind, value):
+    if kind == 'url':
+        value = refang(value.rstrip(_URL_TRAILING))
+        scheme, sep, rest = value.partition('://')
+        host, slash, path = rest.partition('/')
+        return f"{scheme.lower()}{sep}{host.lower()}{slash}{path}" if host else None
+    if kind in ('cve', 'technique'):
+        return value.upper()
+    if kind in ('sha256', 'sha1', 'md5'):
+        return value.lower()
+    if kind == 'ipv4':
+        return refang(value)
+    if kind == 'ipv6':
+        try:
+            return ipaddress.IPv6Address(value).compressed
+        except ValueError:
+            return None
+    # domain
+    value = refang(value).lower()
+    tld = value.rsplit('.', 1)[-1]
+    if len(tld) == 2:
+        return value if tld not in NOT_DOMAIN_TLDS else None
+    return value if tld in GENERIC_TLDS or tld.startswith('xn--') else None
+
+
+def iter_iocs(text):
+    """Yield (type, value) for each indicator in text, in order of appearance."""
+    finditer = IOC_PATTERN.finditer
+    for candidate in CANDIDATE_PATTERN.finditer(text):
+        for match in finditer(text, candidate.start(), candidate.end()):
+            kind = match.lastgroup
+            value = _normalize(kind, match.group(kind))
+            if value:
+                yield kind, value
+
+
+def is_reference(kind, value, domains=REFERENCE_DOMAINS):
+    """Whether a normalized domain or URL points at one of `domains`."""
+    if kind == 'url':
+        host = value.partition('://')[2].partition('/')[0]
+        host = host.rpartition('@')[2].partition(':')[0]
+    elif kind == 'domain':
+        host = value
+    else:
+        return False
+    return any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+
+def extract_iocs(text, exclude_domains=()):
+    """Return the distinct (type, value) indicators in text, first mention first.
+
+    Domains and URLs on `exclude_domains` (e.g. REFERENCE_DOMAINS) are
+    skipped.
+    """
+    iocs = dict.fromkeys(iter_iocs(text))
+    if exclude_domains:
+        return [ioc for ioc in iocs if not is_reference(*ioc, domains=exclude_domains)]
+    return list(iocs)
+
+
+def normalize_ioc(value):
+    """Normalize a lookup value the same way stored indicators are.
+
+    Returns (type, value), or (None, stripped value) if it isn't recognised.
+    """
+    value = value.strip()
+    match = IOC_PATTERN.fullmatch(value)
+    if match is not None:
+        normalized = _normalize(match.lastgroup, value)
+        if normalized:
+            return match.lastgroup, normalized
+    return None, value
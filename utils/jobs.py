@@ -0,0 +1,376 @@
+"""Background analysis jobs.
+
+The UI enqueues a query and gets a job ID back straight away; worker
+processes claim queued jobs from the `analysis_jobs` table, run the
+analyze -> tag -> store pipeline and record the stored analysis ID. The
+queue lives in the application database, so a local SQLite file is
+enough to run it.
+
+The Streamlit app starts JOB_WORKERS (default 1) worker threads of its
+own, so background mode works out of the box. For more throughput, set
+JOB_WORKERS=0 and run separate worker processes instead:
+    python -m utils.jobs worker --processes 4
+
+Other commands:
+    python -m utils.jobs enqueue "APT29 phishing campaigns"
+    python -m utils.jobs status <job id>
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_
+
+from .database import AnalysisJob
+from .instrumentation import get_logger, start_metrics_server
+
+logger = get_logger(__name__)
+
+STATUSES = ('queued', 'running', 'done', 'failed')
+
+
+class JobQueue:
+    """Analysis job queue stored in the analysis_jobs table.
+
+    Claiming is a conditional UPDATE (status still 'queued'), so any number
+    of workers can poll the same table and each job is run by one of them.
+    The worker running a job touches its heartbeat every heartbeat_interval
+    seconds, so only jobs of workers that stopped go stale, however long a
+    run takes; a job can only be finished by the worker holding its claim.
+    """
+
+    def __init__(self, db, max_attempts=3, stale_after=120):
+        self.db = db
+        self.max_attempts = max_attempts
+        # Running jobs without a heartbeat for this long belong to a dead worker
+        self.stale_after = stale_after
+        self.heartbeat_interval = stale_after / 4
+
+    def enqueue(self, query):
+        session = self.db.Session()
+        try:
+            job = AnalysisJob(query=query, status='queued', created_at=datetime.utcnow())
+            session.add(job)
+            session.commit()
+            return job.id
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get(self, job_id):
+        session = self.db.Session()
+        try:
+            job = session.get(AnalysisJob, job_id)
+            return self._to_dict(job) if job is not None else None
+        finally:
+            session.close()
+
+    def claim(self, worker_id):
+        """Mark the oldest queued job as running for worker_id and return it."""
+        session = self.db.Session()
+        try:
+            while True:
+                job_id = session.query(AnalysisJob.id).filter(
+                    AnalysisJob.status == 'queued'
+                ).order_by(AnalysisJob.id).limit(1).scalar()
+                if job_id is None:
+                    session.rollback()
+                    return None
+                claimed = session.query(AnalysisJob).filter(
+                    AnalysisJob.id == job_id,
+                    AnalysisJob.status == 'queued'
+                ).update({
+                    'status': 'running',
+                    'worker': worker_id,
+                    'started_at': datetime.utcnow(),
+                    'heartbeat_at': datetime.utcnow(),
+                    'attempts': AnalysisJob.attempts + 1
+                }, synchronize_session=False)
+                session.commit()
+                if claimed:
+                    return self._to_dict(session.get(AnalysisJob, job_id))
+                # Another worker got there first; try the next one
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _claimed(self, session, job_id, worker_id):
+        # The job as long as worker_id still holds its claim
+        q = session.query(AnalysisJob).filter(AnalysisJob.id == job_id,
+                                              AnalysisJob.status == 'running')
+        if worker_id is not None:
+            q = q.filter(AnalysisJob.worker == worker_id)
+        return q
+
+    def heartbeat(self, job_id, worker_id):
+        """Mark a running job as alive; False once worker_id lost the claim."""
+        session = self.db.Session()
+        try:
+            touched = self._claimed(session, job_id, worker_id).update(
+                {'heartbeat_at': datetime.utcnow()}, synchronize_session=False)
+            session.commit()
+            return bool(touched)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def complete(self, job_id, analysis_id, worker_id=None):
+        return self._finish(job_id, worker_id, status='done', analysis_id=analysis_id, error=None)
+
+    def fail(self, job_id, error, worker_id=None):
+        return self._finish(job_id, worker_id, status='failed', error=str(error)[:2000])
+
+    def _finish(self, job_id, worker_id, **values):
+        """Record the outcome; False if worker_id no longer holds the claim."""
+        session = self.db.Session()
+        try:
+            values['finished_at'] = datetime.utcnow()
+            finished = self._claimed(session, job_id, worker_id).update(
+                values, synchronize_session=False)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        if not finished:
+            logger.warning("Job %s is no longer claimed by %s; not recording its outcome",
+                           job_id, worker_id)
+        return bool(finished)
+
+    def recover_stale(self):
+        """Requeue jobs stuck in 'running', or fail them once out of attempts."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        session = self.db.Session()
+        try:
+            stale = session.query(AnalysisJob).filter(
+                AnalysisJob.status == 'running',
+                or_(AnalysisJob.heartbeat_at < cutoff,
+                    AnalysisJob.heartbeat_at.is_(None) & (AnalysisJob.started_at < cutoff))
+            )
+            requeued = stale.filter(AnalysisJob.attempts < self.max_attempts).update(
+                {'status': 'queued', 'worker': None}, synchronize_session=False)
+            failed = stale.filter(AnalysisJob.attempts >= self.max_attempts).update(
+                {'status': 'failed', 'finished_at': datetime.utcnow(),
+                 'error': 'Worker stopped before finishing the job'},
+                synchronize_session=False)
+            session.commit()
+            return requeued, failed
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def counts(self):
+        session = self.db.Session()
+        try:
+            rows = session.query(AnalysisJob.status, func.count()).group_by(AnalysisJob.status).all()
+            counts = dict.fromkeys(STATUSES, 0)
+            counts.update(dict(rows))
+            return counts
+        finally:
+            session.close()
+
+    def _to_dict(self, job):
+        def iso(value):
+            return value.isoformat() if value is not None else None
+
+        return {
+            'id': job.id,
+            'query': job.query,
+            'status': job.status,
+            'created_at': iso(job.created_at),
+            'started_at': iso(job.started_at),
+            'finished_at': iso(job.finished_at),
+            'worker': job.worker,
+            'heartbeat_at': iso(job.heartbeat_at),
+            'attempts': job.attempts,
+            'analysis_id': job.analysis_id,
+            'error': job.error
+        }
+
+
+def _keep_alive(queue, job, done):
+    while not done.wait(queue.heartbeat_interval):
+        try:
+            if not queue.heartbeat(job['id'], job['worker']):
+                return
+        except Exception as e:
+            logger.warning("Heartbeat for job %s failed: %s", job['id'], e)
+
+
+def run_job(pipeline, queue, job):
+    """Run one claimed job through the pipeline and record its outcome."""
+    done = threading.Event()
+    heartbeat = threading.Thread(target=_keep_alive, args=(queue, job, done),
+                                 name=f"job-{job['id']}-heartbeat", daemon=True)
+    heartbeat.start()
+    try:
+        result = pipeline.run(job['query'])
+    except Exception as e:
+        logger.error("Job %s failed: %s", job['id'], e)
+        queue.fail(job['id'], e, worker_id=job['worker'])
+        return
+    finally:
+        done.set()
+        heartbeat.join()
+    analysis = result['analysis']
+    if 'error' in analysis or analysis.get('id') is None:
+        queue.fail(job['id'], analysis.get('error', 'Analysis was not stored'),
+                   worker_id=job['worker'])
+    else:
+        queue.complete(job['id'], analysis['id'], worker_id=job['worker'])
+
+
+def work(pipeline, queue, worker_id, poll_interval=1.0, max_jobs=None, stop=None):
+    """Claim and run jobs until stop is set (or max_jobs have been run).
+
+    Returns the number of jobs run.
+    """
+    completed = 0
+    last_recovery = 0.0
+    while (max_jobs is None or completed < max_jobs) and not (stop and stop.is_set()):
+        try:
+            if time.monotonic() - last_recovery > 60:
+                queue.recover_stale()
+                last_recovery = time.monotonic()
+            job = queue.claim(worker_id)
+        except Exception as e:
+            # A locked or unreachable database shouldn't end the worker
+            logger.error("Worker %s could not claim a job: %s", worker_id, e)
+            job = None
+        if job is None:
+            if stop is not None:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+        logger.info("Worker %s running job %s", worker_id, job['id'])
+        run_job(pipeline, queue, job)
+        completed += 1
+    return completed
+
+
+def run_worker(worker_id=None, poll_interval=1.0, max_jobs=None, metrics_port=None):
+    """Claim and run jobs until interrupted (or max_jobs have been run).
+
+    Metrics are served on metrics_port, else METRICS_PORT when set.
+    """
+    # Each worker process builds its own engine and clients on first use
+    from .registry import get_pipeline, get_job_queue
+
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    pipeline = get_pipeline()
+    queue = get_job_queue()
+    start_metrics_server(metrics_port)
+
+    logger.info("Worker %s started", worker_id)
+    completed = 0
+    try:
+        completed = work(pipeline, queue, worker_id, poll_interval, max_jobs)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.shutdown()
+        logger.info("Worker %s stopped after %d job(s)", worker_id, completed)
+
+
+class WorkerThreads:
+    """Worker threads inside the app process, sharing its pipeline.
+
+    Used by the Streamlit app so queued jobs run even when no separate
+    `python -m utils.jobs worker` is deployed.
+    """
+
+    def __init__(self, pipeline, queue, count=1, poll_interval=1.0):
+        self.stop_event = threading.Event()
+        prefix = f"{socket.gethostname()}:{os.getpid()}:thread"
+        self.threads = [
+            threading.Thread(target=work, name=f"job-worker-{i}", daemon=True,
+                             args=(pipeline, queue, f"{prefix}-{i}", poll_interval),
+                             kwargs={'stop': self.stop_event})
+            for i in range(count)
+        ]
+        for thread in self.threads:
+            thread.start()
+        if self.threads:
+            logger.info("Started %d in-process job worker(s)", count)
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+
+def _worker_process(index, poll_interval):
+    # Each worker process serves its own metrics on the next port up
+    base_port = os.environ.get('METRICS_PORT')
+    metrics_port = int(base_port) + index if base_port else None
+    run_worker(f"{socket.gethostname()}:{os.getpid()}:{index}", poll_interval,
+               metrics_port=metrics_port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Background analysis job queue")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    worker = subparsers.add_parser('worker', help="Run worker processes")
+    worker.add_argument('--processes', type=int, default=2)
+    worker.add_argument('--poll-interval', type=float, default=1.0)
+
+    enqueue = subparsers.add_parser('enqueue', help="Queue an analysis")
+    enqueue.add_argument('query')
+
+    status = subparsers.add_parser('status', help="Show a job, or queue totals")
+    status.add_argument('job_id', type=int, nargs='?')
+
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        if args.processes <= 1:
+            run_worker(poll_interval=args.poll_interval)
+            return
+        # spawn so no process inherits another's database connections
+        context = multiprocessing.get_context('spawn')
+        processes = [
+            context.Process(target=_worker_process, args=(i, args.poll_interval))
+            for i in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.join()
+        return
+
+    from .database import Database
+    queue = JobQueue(Database())
+    if args.command == 'enqueue':
+        print(f"Queued job {queue.enqueue(args.query)}")
+    elif args.job_id is not None:
+        job = queue.get(args.job_id)
+        if job is None:
+            parser.error(f"No job {args.job_id}")
+        for key, value in job.items():
+            print(f"{key}: {value}")
+    else:
+        for key, value in queue.counts().items():
+            print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,489 @@
+"""Resilient chat-completion calls for GPTHelper.
+
+LLMClient wraps an OpenAI-compatible client (OpenRouter) with:
+
+- single-flight: concurrent identical requests share one API call
+- retries of 429/5xx/timeouts with jittered exponential backoff, waiting
+  at least as long as the server's Retry-After
+- hedging: a duplicate request goes out if the first is still running
+  after `hedge_after` seconds; whichever answers first wins
+- model fallback: models are tried in order (OPENROUTER_MODELS)
+- a circuit breaker per model that skips it after repeated failures
+- per-model latency histograms
+"""
+import hashlib
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from email.utils import parsedate_to_datetime
+from typing import NamedTuple, Optional
+
+from .instrumentation import LLM_REQUEST_SECONDS, LLM_TOKENS, get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_MODELS = "google/gemma-3-12b-it:free"
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120, float('inf'))
+
+
+def configured_models():
+    """Models to try in order, from OPENROUTER_MODELS (comma-separated)."""
+    models = [m.strip() for m in os.environ.get('OPENROUTER_MODELS', DEFAULT_MODELS).split(',')]
+    return [m for m in models if m] or [DEFAULT_MODELS]
+
+
+class Completion(NamedTuple):
+    text: str
+    # Model that answered, which may be a fallback
+    model: str
+    # prompt_tokens / completion_tokens / total_tokens as reported by the
+    # API, or None if it didn't report them
+    usage: Optional[dict] = None
+
+
+class CompletionStream:
+    """Text deltas of a streamed completion.
+
+    `model` is the model that answered, which may be a fallback; `usage`
+    is filled in if the API reports it with the last event.
+    """
+
+    def __init__(self, deltas, model):
+        self._deltas = deltas
+        self.model = model
+        self.usage = None
+
+    def __iter__(self):
+        return self._deltas
+
+
+class CircuitOpenError(Exception):
+    """Every model's circuit breaker is open; nothing was sent."""
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram; cheap to update, bounded in size."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (the max for the last one)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+            'buckets': {('+Inf' if bound == float('inf') else bound): count
+                        for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+class CircuitBreaker:
+    """Stops calls to an endpoint after `failure_threshold` failures in a row.
+
+    Once open, calls are refused for `reset_after` seconds; then one trial
+    call is let through (half-open) and its outcome closes or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_after=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+# The openai SDK takes about half a second to import, so it is only loaded
+# once a request has actually failed (or the client is built)
+
+def is_retryable(error):
+    import openai
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def can_fall_back(error):
+    # Another model may succeed unless the key itself was rejected
+    import openai
+    return isinstance(error, (openai.APIError, CircuitOpenError)) and not isinstance(
+        error, (openai.AuthenticationError, openai.PermissionDeniedError))
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait, from Retry-After(-Ms), or None."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMClient:
+    """Chat completions with coalescing, retries, hedging, fallback and a
+    circuit breaker; every knob defaults from an LLM_* environment variable."""
+
+    def __init__(self, client=None, models=None, rate_limiter=None, max_attempts=None,
+                 backoff_base=None, backoff_max=None, hedge_after=None,
+                 failure_threshold=None, reset_after=None, client_factory=None):
+        # Either a client, or a factory called for one on the first request
+        self._client = client
+        self._client_factory = client_factory
+        self.models = list(models or configured_models())
+        # Optional TokenBucket; every attempt and hedge takes a token
+        self.rate_limiter = rate_limiter
+        self.max_attempts = max_attempts if max_attempts is not None else int(
+            os.environ.get('LLM_MAX_ATTEMPTS', 4))
+        self.backoff_base = backoff_base if backoff_base is not None else float(
+            os.environ.get('LLM_BACKOFF_BASE', 0.5))
+        self.backoff_max = backoff_max if backoff_max is not None else float(
+            os.environ.get('LLM_BACKOFF_MAX', 30))
+        # 0 disables hedging
+        self.hedge_after = hedge_after if hedge_after is not None else float(
+            os.environ.get('LLM_HEDGE_AFTER', 20))
+        failure_threshold = failure_threshold if failure_threshold is not None else int(
+            os.environ.get('LLM_BREAKER_FAILURES', 5))
+        reset_after = reset_after if reset_after is not None else float(
+            os.environ.get('LLM_BREAKER_RESET', 30))
+
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._breakers = {model: CircuitBreaker(failure_threshold, reset_after) for model in self.models}
+        self._latency = {model: LatencyHistogram() for model in self.models}
+        # Tokens reported by the API per model
+        self._tokens = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+        self.failures = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._client_factory()
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def complete(self, messages, temperature, max_tokens, response_format=None):
+        """Return the Completion of a chat request, trying every model in turn.
+
+        `response_format` is passed through (e.g. a JSON schema for
+        structured output). Raises the last error if no model answered.
+        """
+        request = {'messages': messages, 'temperature': temperature, 'max_tokens': max_tokens}
+        if response_format is not None:
+            request['response_format'] = response_format
+        key = hashlib.sha256(json.dumps([self.models, request],
+                                        sort_keys=True).encode('utf-8')).hexdigest()
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._with_fallback(self._complete_with_retries, request)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def stream(self, messages, temperature, max_tokens):
+        """Return a CompletionStream of the text deltas of a streamed completion.
+
+        Retries and fallback apply until the first chunk arrives; an error
+        after that is raised to the caller, since text was already shown.
+        """
+        # include_usage adds a final event with the token counts
+        request = {'messages': messages, 'temperature': temperature, 'max_tokens': max_tokens,
+                   'stream': True, 'stream_options': {'include_usage': True}}
+        return self._with_fallback(self._open_stream, request)
+
+    def _with_fallback(self, attempt, request):
+        last_error = None
+        for i, model in enumerate(self.models):
+            breaker = self._breakers[model]
+            if not breaker.allow():
+                continue
+            if i > 0 and last_error is not None:
+                with self._lock:
+                    self.fallbacks += 1
+                logger.warning("Falling back to %s after: %s", model, last_error)
+            try:
+                return attempt(model, request)
+            except Exception as e:
+                last_error = e
+                if not can_fall_back(e):
+                    raise
+        if last_error is None:
+            raise CircuitOpenError("All models are temporarily disabled after repeated failures: "
+                                   + ", ".join(self.models))
+        raise last_error
+
+    def _retrying(self, model, call):
+        breaker = self._breakers[model]
+        for attempt in range(self.max_attempts):
+            try:
+                result = call()
+            except Exception as e:
+                if not is_retryable(e):
+                    # The endpoint answered; the request itself was bad
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                with self._lock:
+                    self.failures += 1
+                wait_for = retry_after(e)
+                if attempt == self.max_attempts - 1 or breaker.state == 'open' \
+                        or (wait_for is not None and wait_for > self.backoff_max):
+                    # Out of attempts, or asked to wait too long: next model
+                    raise
+                # Full jitter, but never sooner than the server asked
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                delay = max(delay, wait_for or 0.0)
+                with self._lock:
+                    self.retries += 1
+                logger.warning("Request to %s failed (%s); retrying in %.1fs", model, e, delay)
+                time.sleep(delay)
+                continue
+            breaker.record_success()
+            return result
+
+    def _complete_with_retries(self, model, request):
+        text, usage = self._retrying(model, lambda: self._hedged(model, request))
+        return Completion(text, model, usage)
+
+    def _hedged(self, model, request):
+        if not self.hedge_after:
+            return self._call(model, request)
+        primary = self._start(self._call, model, request)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        with self._lock:
+            self.hedges += 1
+        logger.info("No answer from %s after %gs; sending a hedged request", model, self.hedge_after)
+        hedge = self._start(self._call, model, request)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    @staticmethod
+    def _start(func, *args):
+        """Run func on a thread of its own and return its Future.
+
+        Each hedged attempt gets its own thread, not a slot in a shared
+        pool, so the pipeline and job workers set the concurrency, not a
+        pool size here. The losing attempt's thread finishes on its own.
+        """
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name='llm-attempt', daemon=True).start()
+        return future
+
+    def _call(self, model, request):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        with self._lock:
+            self.calls += 1
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            completion = self.client.chat.completions.create(model=model, **request)
+            outcome = 'ok'
+        finally:
+            self._observe(model, time.perf_counter() - start, outcome)
+        usage = self._record_usage(model, getattr(completion, 'usage', None))
+        return completion.choices[0].message.content or "", usage
+
+    def _record_usage(self, model, usage):
+        """Count reported token usage against model; returns it as a dict."""
+        if usage is None:
+            return None
+        usage = {name: getattr(usage, name, None)
+                 for name in ('prompt_tokens', 'completion_tokens', 'total_tokens')}
+        with self._lock:
+            tokens = self._tokens.setdefault(model, {'prompt': 0, 'completion': 0})
+            tokens['prompt'] += usage['prompt_tokens'] or 0
+            tokens['completion'] += usage['completion_tokens'] or 0
+        LLM_TOKENS.inc(usage['prompt_tokens'] or 0, model=model, kind='prompt')
+        LLM_TOKENS.inc(usage['completion_tokens'] or 0, model=model, kind='completion')
+        return usage
+
+    def _open_stream(self, model, request):
+        def first_chunk():
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            with self._lock:
+                self.calls += 1
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                stream = iter(self.client.chat.completions.create(model=model, **request))
+                # Latency to the first event: what the user waits for
+                first = next(stream, None)
+                outcome = 'first_chunk'
+            finally:
+                self._observe(model, time.perf_counter() - start, outcome)
+            return first, stream
+
+        first, stream = self._retrying(model, first_chunk)
+
+        def deltas():
+            events = stream if first is None else itertools.chain([first], stream)
+            for event in events:
+                usage = getattr(event, 'usage', None)
+                if usage is not None:
+                    result.usage = self._record_usage(model, usage)
+                if not event.choices:
+                    continue
+                delta = event.choices[0].delta.content
+                if delta:
+                    yield delta
+
+        result = CompletionStream(deltas(), model)
+        return result
+
+    def _observe(self, model, seconds, outcome):
+        LLM_REQUEST_SECONDS.observe(seconds, model=model, outcome=outcome)
+        with self._lock:
+            self._latency.setdefault(model, LatencyHistogram()).observe(seconds)
+
+    def latency(self, model):
+        with self._lock:
+            return self._latency[model].snapshot()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'retries': self.retries,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'fallbacks': self.fallbacks,
+                'failures': self.failures,
+                'models': {
+                    model: {'breaker': self._breakers[model].state,
+                            'latency': self._latency[model].snapshot(),
+                            'tokens': dict(self._tokens.get(model, {'prompt': 0, 'completion': 0}))}
+                    for model in self.models
+                },
+            }
@@ -0,0 +1,334 @@
+"""Data migrations for the threat analysis database.
+
+Tables and indexes are created by SQLAlchemy's create_all; the migrations
+here fill in derived data for rows written before a feature existed. Each
+one runs once per database and is recorded in `schema_migrations`.
+
+The first Database opened in a process creates the tables and runs
+pending migrations unless AUTO_MIGRATE=0; then they are left to an
+explicit step (e.g. at deploy time). Migrations that rewrite stored rows
+(MANUAL_MIGRATIONS) never run on startup, only through the command,
+which first copies a SQLite database file to <file>.<timestamp>.bak:
+    python -m utils.migrations          # create tables, apply migrations
+    python -m utils.migrations --list   # show status, change nothing
+"""
+import argparse
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+from sqlalchemy import Text, cast, func, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import flag_modified
+
+from .database import Database, ThreatAnalysis, AnalysisTags, AnalysisIoc, SchemaMigration, ScrapedBlob
+from .payloads import decompress_json, strip_duplicates
+from .report_parser import parse_analysis
+from .instrumentation import get_logger
+
+logger = get_logger(__name__)
+
+BATCH_SIZE = 500
+
+
+def _unindexed_analyses(session, model, key_column, columns, after_id):
+    # Rows of threat_analyses that have no row in the given side table yet
+    return session.query(*columns).outerjoin(
+        model, key_column == ThreatAnalysis.id
+    ).filter(
+        key_column.is_(None), ThreatAnalysis.id > after_id
+    ).order_by(ThreatAnalysis.id).limit(BATCH_SIZE).all()
+
+
+def backfill_analysis_tags(db):
+    """Populate analysis_tags for analyses stored before it existed."""
+    session = db.Session()
+    filled = 0
+    last_id = 0
+    try:
+        while True:
+            rows = _unindexed_analyses(
+                session, AnalysisTags, AnalysisTags.analysis_id,
+                (ThreatAnalysis.id, ThreatAnalysis.timestamp, ThreatAnalysis.tags),
+                last_id
+            )
+            if not rows:
+                break
+            for analysis_id, timestamp, tags in rows:
+                session.add(db._tag_row(analysis_id, timestamp or datetime(1970, 1, 1), tags))
+            session.commit()
+            filled += len(rows)
+            last_id = rows[-1].id
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    return f"indexed tags for {filled} analyses"
+
+
+def backfill_search_index(db):
+    """Add analyses stored before full-text search existed to the index."""
+    if not db.search_index.available:
+        return "full-text search not supported on this database"
+    session = db.Session()
+    filled = 0
+    last_id = 0
+    try:
+        while True:
+            rows = session.execute(text(db.search_index.unindexed_ids_sql()),
+                                   {'after_id': last_id, 'limit': BATCH_SIZE}).all()
+            if not rows:
+                break
+            responses = db._hydrate_responses(session, [decompress_json(row[2]) for row in rows])
+            for (analysis_id, query, _), response in zip(rows, responses):
+                db.search_index.index(session, analysis_id, query, response)
+            session.commit()
+            filled += len(rows)
+            last_id = rows[-1][0]
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    return f"indexed text of {filled} analyses"
+
+
+def _stored_size(session):
+    # Size of the stored JSON text, as the database holds it
+    responses = session.query(func.sum(func.length(
+        cast(ThreatAnalysis.__table__.c.response, Text)))).scalar() or 0
+    blobs = session.query(func.sum(func.length(
+        cast(ScrapedBlob.__table__.c.data, Text)))).scalar() or 0
+    return responses + blobs
+
+
+def compact_responses(db):
+    """Rewrite stored responses in the compact format.
+
+    Drops the second copy of the API response under raw_data, moves scraped
+    blocks into scraped_blobs and lets the response column compress the
+    rest.
+    """
+    session = db.Session()
+    rewritten = 0
+    last_id = 0
+    try:
+        before = _stored_size(session)
+        while True:
+            analyses = session.query(ThreatAnalysis).filter(
+                ThreatAnalysis.id > last_id
+            ).order_by(ThreatAnalysis.id).limit(BATCH_SIZE).all()
+            if not analyses:
+                break
+            for analysis in analyses:
+                analysis.response = db._pack_response(session, strip_duplicates(analysis.response))
+                # Equal JSON doesn't count as a change, but it still needs re-encoding
+                flag_modified(analysis, 'response')
+            session.commit()
+            rewritten += len(analyses)
+            last_id = analyses[-1].id
+            session.expunge_all()
+        after = _stored_size(session)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+    saved = 1 - after / before if before else 0.0
+    result = (f"compacted {rewritten} responses: {before / 1024:.0f} KiB -> "
+              f"{after / 1024:.0f} KiB of stored JSON ({saved:.0%} smaller)")
+    if db.engine.dialect.name == 'sqlite':
+        result += "; run VACUUM to shrink the database file"
+    return result
+
+
+def backfill_report_sections(db):
+    """Parse and store report sections for analyses stored before parsing at ingest."""
+    session = db.Session()
+    parsed = 0
+    last_id = 0
+    try:
+        while True:
+            analyses = session.query(ThreatAnalysis).filter(
+                ThreatAnalysis.id > last_id
+            ).order_by(ThreatAnalysis.id).limit(BATCH_SIZE).all()
+            if not analyses:
+                break
+            for analysis in analyses:
+                response = analysis.response
+                # Very old rows are the bare API response; those are parsed on read
+                if not isinstance(response, dict) or 'api_response' not in response \
+                        or 'sections' in response:
+                    continue
+                sections = parse_analysis(response['api_response'])
+                analysis.response = dict(response, sections=sections.to_dict() if sections else None)
+                parsed += 1
+            session.commit()
+            last_id = analyses[-1].id
+            session.expunge_all()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    return f"parsed report sections for {parsed} analyses"
+
+
+def backfill_iocs(db):
+    """Extract indicators of compromise from analyses stored before IoC indexing."""
+    session = db.Session()
+    scanned = 0
+    found = 0
+    last_id = 0
+    try:
+        while True:
+            rows = session.query(ThreatAnalysis.id, ThreatAnalysis.query, ThreatAnalysis.response).filter(
+                ThreatAnalysis.id > last_id
+            ).order_by(ThreatAnalysis.id).limit(BATCH_SIZE).all()
+            if not rows:
+                break
+            ids = [row.id for row in rows]
+            # Rows stored after the table existed already have theirs
+            indexed = {analysis_id for (analysis_id,) in session.query(AnalysisIoc.analysis_id).filter(
+                AnalysisIoc.analysis_id.in_(ids)).distinct()}
+            pending = [row for row in rows if row.id not in indexed]
+            responses = db._hydrate_responses(session, [row.response for row in pending])
+            for row, response in zip(pending, responses):
+                iocs = db._ioc_rows(row.id, row.query, response)
+                session.add_all(iocs)
+                found += len(iocs)
+            session.commit()
+            scanned += len(pending)
+            last_id = rows[-1].id
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    return f"indexed {found} indicators from {scanned} analyses"
+
+
+def build_rollups(db):
+    """Fill the rollup counters and sketches from the existing history."""
+    return db.rebuild_rollups()
+
+
+# Applied in order; never reorder or rename an entry once released
+MIGRATIONS = [
+    ('0001_backfill_analysis_tags', backfill_analysis_tags),
+    ('0002_backfill_search_index', backfill_search_index),
+    ('0003_compact_responses', compact_responses),
+    ('0004_backfill_report_sections', backfill_report_sections),
+    ('0005_backfill_iocs', backfill_iocs),
+    ('0006_build_rollups', build_rollups),
+]
+
+
+# Rewrite every stored response; compact_responses also drops the copy of
+# the API response kept under raw_data. Left to `python -m utils.migrations`
+MANUAL_MIGRATIONS = {'0003_compact_responses', '0004_backfill_report_sections'}
+
+
+def applied_migrations(db):
+    session = db.Session()
+    try:
+        return {row.version for row in session.query(SchemaMigration.version)}
+    finally:
+        session.close()
+
+
+def pending_migrations(db):
+    """Versions not yet applied; all of them if the schema was never set up."""
+    if not inspect(db.engine).has_table(SchemaMigration.__tablename__):
+        return [version for version, _ in MIGRATIONS]
+    applied = applied_migrations(db)
+    return [version for version, _ in MIGRATIONS if version not in applied]
+
+
+def run_migrations(db, include_manual=False):
+    """Apply pending migrations in order; returns the manual ones skipped."""
+    applied = applied_migrations(db)
+    if not include_manual:
+        # With no stored analyses there is nothing for them to rewrite
+        session = db.Session()
+        try:
+            include_manual = session.query(ThreatAnalysis.id).first() is None
+        finally:
+            session.close()
+    skipped = []
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        if version in MANUAL_MIGRATIONS and not include_manual:
+            skipped.append(version)
+            continue
+        logger.info("Applying migration %s", version)
+        result = migration(db)
+        session = db.Session()
+        try:
+            session.add(SchemaMigration(version=version))
+            session.commit()
+        except IntegrityError:
+            # Another process finished the same migration first
+            session.rollback()
+        finally:
+            session.close()
+        logger.info("Applied migration %s: %s", version, result)
+    if skipped:
+        logger.warning("Not applying %s on startup as they rewrite stored data; "
+                       "run python -m utils.migrations to back up and apply them",
+                       ', '.join(skipped))
+    return skipped
+
+
+def backup_database(db):
+    """Copy a SQLite database file to <file>.<timestamp>.bak.
+
+    Returns the copy's path, or None for other databases (back those up
+    with their own tools) and for files that don't exist yet.
+    """
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    source = os.path.abspath(url.database)
+    if not os.path.exists(source):
+        return None
+    target = f"{source}.{datetime.utcnow():%Y%m%d%H%M%S}.bak"
+    # The backup API copies a consistent snapshot, WAL contents included
+    with closing(sqlite3.connect(source)) as src, closing(sqlite3.connect(target)) as dst:
+        src.backup(dst)
+    return target
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply pending database migrations")
+    parser.add_argument('--list', action='store_true',
+                        help="show migration status without applying anything")
+    parser.add_argument('--no-backup', action='store_true',
+                        help="don't copy the SQLite file before rewriting stored data")
+    args = parser.parse_args(argv)
+
+    # Nothing is created or applied until asked for below
+    db = Database(migrate=False)
+    pending = pending_migrations(db)
+    if args.list:
+        for version, _ in MIGRATIONS:
+            manual = ' (manual: rewrites stored data)' if version in MANUAL_MIGRATIONS else ''
+            print(f"[{' ' if version in pending else 'x'}] {version}{manual}")
+        return
+    if not args.no_backup and MANUAL_MIGRATIONS.intersection(pending):
+        backup = backup_database(db)
+        if backup:
+            logger.info("Backed up the database to %s", backup)
+        elif db.engine.url.get_backend_name() != 'sqlite':
+            logger.warning("Rewriting stored data in %s; make sure it has a recent backup",
+                           db.engine.url.get_backend_name())
+    db.prepare_schema(include_manual=True)
+    logger.info("Database schema is up to date")
+
+
+if __name__ == '__main__':
+    main()
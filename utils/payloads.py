@@ -0,0 +1,177 @@
+"""Compact storage for analysis payloads.
+
+Large JSON values are stored compressed inside a small JSON envelope, so
+the column type stays JSON on every backend and old uncompressed rows keep
+reading as before. The codec is zlib; PAYLOAD_CODEC=zstd opts into zstd,
+after which every host reading the database needs the `zstandard` package. Scraped result blocks are content-hashed and stored once in
+`scraped_blobs`; responses keep a `{"$blob": <sha256>}` reference instead.
+"""
+import base64
+import hashlib
+import json
+import os
+import zlib
+
+from sqlalchemy.types import JSON, TypeDecorator
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_KEY = '$codec'
+DATA_KEY = '$data'
+BLOB_REF_KEY = '$blob'
+
+# Payloads smaller than this are left as plain JSON
+COMPRESS_MIN_BYTES = 512
+# Scraped blocks smaller than this aren't worth a separate row
+BLOB_MIN_BYTES = 128
+
+CODECS = ('zlib', 'zstd')
+# Fixed rather than picked by what happens to be installed, so every host
+# writes rows every other host can read
+DEFAULT_CODEC = os.environ.get('PAYLOAD_CODEC', 'zlib')
+if DEFAULT_CODEC not in CODECS:
+    raise ValueError(f"Unknown PAYLOAD_CODEC {DEFAULT_CODEC!r}; expected one of {', '.join(CODECS)}")
+
+
+def _zstandard():
+    if zstandard is None:
+        raise ImportError("zstd payloads require zstandard: pip install zstandard")
+    return zstandard
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'), sort_keys=True, ensure_ascii=False)
+
+
+def compress_json(value, codec=DEFAULT_CODEC, plain_paths=()):
+    """Return value as a compressed envelope, or unchanged if it is small.
+
+    `plain_paths` are key paths copied into the envelope uncompressed so SQL
+    JSON-path filters on them keep working.
+    """
+    if value is None:
+        return None
+    raw = _dumps(value).encode('utf-8')
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return value
+    if codec == 'zstd':
+        packed = _zstandard().ZstdCompressor(level=10).compress(raw)
+    elif codec == 'zlib':
+        packed = zlib.compress(raw, 9)
+    else:
+        raise ValueError(f"Unknown payload codec: {codec}")
+    envelope = {CODEC_KEY: codec, DATA_KEY: base64.b64encode(packed).decode('ascii')}
+    for path in plain_paths:
+        found = value
+        for key in path:
+            found = found.get(key) if isinstance(found, dict) else None
+        if found is not None:
+            target = envelope
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = found
+    return envelope
+
+
+def decompress_json(value):
+    """Decode a value written by compress_json; plain values pass through."""
+    if isinstance(value, str):
+        # Raw SQL hands back the stored JSON text
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return value
+    if not isinstance(value, dict) or CODEC_KEY not in value:
+        return value
+    packed = base64.b64decode(value[DATA_KEY])
+    codec = value[CODEC_KEY]
+    if codec == 'zstd':
+        raw = _zstandard().ZstdDecompressor().decompress(packed)
+    elif codec == 'zlib':
+        raw = zlib.decompress(packed)
+    else:
+        raise ValueError(f"Unknown payload codec: {codec}")
+    return json.loads(raw)
+
+
+class CompressedJSON(TypeDecorator):
+    """JSON column that compresses large values transparently."""
+
+    impl = JSON
+    cache_ok = True
+
+    def __init__(self, plain_paths=(), *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.plain_paths = tuple(tuple(path) for path in plain_paths)
+
+    def process_bind_param(self, value, dialect):
+        return compress_json(value, plain_paths=self.plain_paths)
+
+    def process_result_value(self, value, dialect):
+        return decompress_json(value)
+
+
+def content_hash(value):
+    return hashlib.sha256(_dumps(value).encode('utf-8')).hexdigest()
+
+
+def strip_duplicates(response):
+    """Drop the copy of the API response older rows kept under raw_data."""
+    raw_data = response.get('raw_data') if isinstance(response, dict) else None
+    if isinstance(raw_data, dict) and 'raw_api_response' in raw_data:
+        response = dict(response)
+        response['raw_data'] = {k: v for k, v in raw_data.items() if k != 'raw_api_response'}
+    return response
+
+
+def pack_scraped(response):
+    """Swap scraped blocks for blob references.
+
+    Returns the packed response and a {hash: block} dict of the blocks that
+    were moved out. The input is not modified.
+    """
+    scraped = response.get('scraped_data') if isinstance(response, dict) else None
+    if not isinstance(scraped, dict):
+        return response, {}
+    blobs = {}
+    packed_scraped = {}
+    for source, block in scraped.items():
+        if isinstance(block, (list, dict)) and not is_blob_ref(block) \
+                and len(_dumps(block)) >= BLOB_MIN_BYTES:
+            digest = content_hash(block)
+            blobs[digest] = block
+            packed_scraped[source] = {BLOB_REF_KEY: digest}
+        else:
+            packed_scraped[source] = block
+    if not blobs:
+        return response, {}
+    packed = dict(response)
+    packed['scraped_data'] = packed_scraped
+    return packed, blobs
+
+
+def is_blob_ref(value):
+    return isinstance(value, dict) and len(value) == 1 and BLOB_REF_KEY in value
+
+
+def blob_refs(response):
+    scraped = response.get('scraped_data') if isinstance(response, dict) else None
+    if not isinstance(scraped, dict):
+        return set()
+    return {block[BLOB_REF_KEY] for block in scraped.values() if is_blob_ref(block)}
+
+
+def unpack_scraped(response, blobs):
+    """Replace blob references in response with the blocks from `blobs`."""
+    refs = blob_refs(response)
+    if not refs:
+        return response
+    unpacked = dict(response)
+    unpacked['scraped_data'] = {
+        source: blobs.get(block[BLOB_REF_KEY], block) if is_blob_ref(block) else block
+        for source, block in response['scraped_data'].items()
+    }
+    return unpacked
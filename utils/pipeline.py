@@ -0,0 +1,147 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .instrumentation import PIPELINE_STAGE_SECONDS, get_logger, profile as profile_run
+
+logger = get_logger(__name__)
+
+
+class AnalysisPipeline:
+    """Runs analyze -> tag -> store with scraping overlapped on the LLM calls.
+
+    The scrape only depends on the query, so it is started right away on a
+    worker thread while the analysis request is in flight. Tagging starts as
+    soon as the analysis text is back, and storage waits for both branches.
+    The analysis itself runs on the calling thread so UI code can keep using
+    Streamlit from there.
+
+    In combined mode (LLM_COMBINED_MODE=1, or combined=True per run) one
+    structured-output request returns both the analysis and the tags, so
+    there is no tagging stage; streaming is not available in that mode.
+
+    profile=True (or PROFILE=1) profiles the calling thread for the run and
+    returns the instrumentation.ProfileRun as result['profile'].
+    """
+
+    STAGES = ['analysis', 'tagging', 'scrape', 'storage']
+
+    def __init__(self, gpt_helper, threat_analyzer, max_workers=4, combined=None):
+        self.gpt_helper = gpt_helper
+        self.threat_analyzer = threat_analyzer
+        self.combined = combined if combined is not None else \
+            os.environ.get('LLM_COMBINED_MODE', '0') == '1'
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='analysis')
+
+    def _timed(self, timings, stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[stage] = time.perf_counter() - start
+            PIPELINE_STAGE_SECONDS.observe(timings[stage], stage=stage)
+
+    def run(self, query, render_stream=None, store=True, combined=None, profile=None):
+        with profile_run('pipeline', enabled=profile) as profiled:
+            result = self._run(query, render_stream, store,
+                               self.combined if combined is None else combined)
+        result['profile'] = profiled if profiled.path or profiled.skipped else None
+        return result
+
+    def _run(self, query, render_stream, store, combined):
+        timings = {}
+        start = time.perf_counter()
+
+        scrape_future = self.executor.submit(
+            self._timed, timings, 'scrape',
+            self.threat_analyzer.scrape_threat_data, query)
+
+        if combined:
+            response, tags = self._timed(timings, 'analysis',
+                                         self.gpt_helper.analyze_and_tag, query)
+        else:
+            if render_stream is not None:
+                # Streaming mode: the callback consumes the chunks as they arrive
+                # and the parsed response is available once the stream closes
+                response = self._timed(timings, 'analysis', self._stream_analysis,
+                                       query, render_stream)
+                if response is None:
+                    scrape_future.cancel()
+                    return self._interrupted(timings, start)
+            else:
+                response = self._timed(timings, 'analysis',
+                                       self.gpt_helper.analyze_threat, query)
+            tags = self._timed(timings, 'tagging',
+                               self.gpt_helper.tag_threat_data, response)
+
+        try:
+            scraped_data = scrape_future.result()
+        except Exception as e:
+            logger.error("Error scraping data: %s", e)
+            scraped_data = {'error': str(e)}
+
+        if store:
+            analysis = self._timed(timings, 'storage',
+                                   self.threat_analyzer.store_response,
+                                   query, response, tags,
+                                   scraped_data=scraped_data)
+        else:
+            # The caller persists the record itself, e.g. in bulk
+            analysis = self.threat_analyzer.build_record(query, response, tags,
+                                                         scraped_data)
+
+        timings['total'] = time.perf_counter() - start
+        # What the same stages would have cost run back to back
+        timings['serial'] = sum(timings.get(stage, 0.0) for stage in self.STAGES)
+
+        return {
+            'response': response,
+            'tags': tags,
+            'analysis': analysis,
+            'timings': timings,
+            'usage': self.usage_summary(response, tags)
+        }
+
+    @staticmethod
+    def usage_summary(*responses):
+        """Tokens spent by the LLM calls behind these responses.
+
+        Combined mode returns the same usage on both results and cached
+        responses cost nothing, so each call is counted once at most.
+        """
+        calls = {}
+        for response in responses:
+            usage = response.get('usage') if isinstance(response, dict) else None
+            if usage and not usage.get('cached'):
+                calls[id(usage)] = usage
+        summary = {'llm_calls': len(calls), 'prompt_tokens': 0,
+                   'completion_tokens': 0, 'total_tokens': 0,
+                   'estimated': any(usage.get('estimated') for usage in calls.values())}
+        for usage in calls.values():
+            for key in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+                summary[key] += usage.get(key, 0)
+        return summary
+
+    def _stream_analysis(self, query, render_stream):
+        stream = self.gpt_helper.stream_threat_analysis(query)
+        render_stream(stream)
+        # None if the consumer stopped before the stream finished
+        return stream.response if stream.finished else None
+
+    def _interrupted(self, timings, start):
+        # Nothing complete to tag or store
+        error = "The analysis stream stopped before it finished"
+        logger.warning(error)
+        timings['total'] = time.perf_counter() - start
+        timings['serial'] = sum(timings.get(stage, 0.0) for stage in self.STAGES)
+        return {
+            'response': {'error': error},
+            'tags': {},
+            'analysis': {'error': error},
+            'timings': timings,
+            'usage': self.usage_summary()
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
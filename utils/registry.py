@@ -0,0 +1,88 @@
+"""Process-wide shared services.
+
+Streamlit runs every browser session in the same process, so the database
+engine, the OpenAI client and the caches are built once here and handed to
+all sessions instead of being constructed per session. Every accessor is
+safe to call from any thread; the first caller builds the instance.
+"""
+import os
+import threading
+
+_lock = threading.RLock()
+_instances = {}
+
+
+def _shared(name, factory):
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = factory()
+                _instances[name] = instance
+    return instance
+
+
+def get_database():
+    from .database import Database
+    return _shared('database', Database)
+
+
+def get_threat_analyzer():
+    from .threat_analyzer import ThreatAnalyzer
+    return _shared('threat_analyzer', lambda: ThreatAnalyzer(db=get_database()))
+
+
+def get_response_cache():
+    from .response_cache import ResponseCache
+    return _shared('response_cache', lambda: ResponseCache(db=get_database()))
+
+
+def get_gpt_helper():
+    from .gpt_helper import GPTHelper
+    return _shared('gpt_helper', lambda: GPTHelper(cache=get_response_cache()))
+
+
+def get_pipeline():
+    from .pipeline import AnalysisPipeline
+    # One executor serves the scrapes of every session
+    return _shared('pipeline', lambda: AnalysisPipeline(get_gpt_helper(), get_threat_analyzer(),
+                                                        max_workers=16))
+
+
+def get_job_queue():
+    from .jobs import JobQueue
+    return _shared('job_queue', lambda: JobQueue(get_database()))
+
+
+def get_job_workers():
+    from .jobs import WorkerThreads
+    # JOB_WORKERS=0 when jobs are left to `python -m utils.jobs worker`
+    count = int(os.environ.get('JOB_WORKERS', 1))
+    return _shared('job_workers', lambda: WorkerThreads(get_pipeline(), get_job_queue(), count))
+
+
+def get_visualizer():
+    from components.visualization import ThreatVisualizer
+    # Shared so cached dashboard figures serve every session
+    return _shared('visualizer', lambda: ThreatVisualizer(get_database()))
+
+
+def reset():
+    """Drop every shared instance; the next accessor call rebuilds it."""
+    with _lock:
+        workers = _instances.get('job_workers')
+        if workers is not None:
+            workers.stop(timeout=10)
+        pipeline = _instances.get('pipeline')
+        if pipeline is not None:
+            pipeline.shutdown()
+        threat_analyzer = _instances.get('threat_analyzer')
+        if threat_analyzer is not None:
+            threat_analyzer.shutdown()
+        database = _instances.get('database')
+        if database is not None:
+            if database.write_buffer is not None:
+                database.write_buffer.close()
+            database.engine.dispose()
+        _instances.clear()
@@ -0,0 +1,215 @@
+"""Turn an analysis response into structured report sections.
+
+Runs once when an analysis is stored; the result is kept with the row
+under response['sections'] so rendering and report generation never have
+to re-parse model output. Handles both response shapes the app produces:
+JSON objects with attack_vector/timeline/impact/mitigation fields, and
+free text laid out under the headers the analysis prompt asks for.
+"""
+import ast
+import json
+import re
+from dataclasses import dataclass, field, fields, asdict
+from typing import List
+
+# (field, heading, numbered) in display order
+SECTION_TITLES = [
+    ('attack_vectors', "🎯 Attack Vector Analysis", False),
+    ('ttps', "🧩 Tactics, Techniques and Procedures", False),
+    ('iocs', "🔎 Indicators of Compromise", False),
+    ('cves', "🔍 CVEs", False),
+    ('timeline', "⏱️ Attack Timeline", True),
+    ('impact', "💥 Potential Impact", False),
+    ('mitigations', "🛡️ Recommended Mitigations", True),
+    ('incident_reports', "📁 Incident Reports", False),
+    ('threat_intelligence', "📡 Threat Intelligence", False),
+]
+
+CVE_PATTERN = re.compile(r'\bCVE-\d{4}-\d{4,7}\b', re.IGNORECASE)
+
+# Headers as the model writes them: alone on a line, optionally as markdown
+# headings or bold, optionally followed by a colon and text
+HEADER_PATTERN = re.compile(
+    r'^[ \t]*(?:#{1,6}[ \t]*)?(?:\*\*|__)?[ \t]*'
+    r'(?P<title>attack vectors?|ttps?|tactics,? techniques,? and procedures(?: \(ttps\))?|'
+    r'indicators of compromise(?: \(iocs?\))?|iocs?|cves?|(?:attack )?timeline|'
+    r'(?:potential )?impacts?|(?:recommended )?mitigations?(?: strategies)?|'
+    r'incident reports?|threat intelligence)'
+    r'[ \t]*(?:\*\*|__)?[ \t]*(?::[ \t]*(?:\*\*|__)?[ \t]*(?P<rest>.*?)|(?:\*\*|__)?)[ \t]*$',
+    re.IGNORECASE | re.MULTILINE
+)
+
+BULLET_PATTERN = re.compile(r'^\s*(?:[-*•+]|\d+[.)])\s+')
+
+# Keys of JSON-format responses, mapped to section fields
+JSON_KEYS = {
+    'attack_vector': 'attack_vectors', 'attack_vectors': 'attack_vectors',
+    'ttp': 'ttps', 'ttps': 'ttps',
+    'iocs': 'iocs', 'indicators_of_compromise': 'iocs',
+    'cve': 'cves', 'cves': 'cves',
+    'timeline': 'timeline', 'attack_timeline': 'timeline',
+    'impact': 'impact',
+    'mitigation': 'mitigations', 'mitigations': 'mitigations',
+    'incident_reports': 'incident_reports',
+    'threat_intelligence': 'threat_intelligence',
+    'summary': 'summary', 'analysis': 'summary',
+}
+
+
+@dataclass
+class ReportSections:
+    summary: str = ''
+    attack_vectors: List[str] = field(default_factory=list)
+    ttps: List[str] = field(default_factory=list)
+    iocs: List[str] = field(default_factory=list)
+    cves: List[str] = field(default_factory=list)
+    timeline: List[str] = field(default_factory=list)
+    impact: List[str] = field(default_factory=list)
+    mitigations: List[str] = field(default_factory=list)
+    incident_reports: List[str] = field(default_factory=list)
+    threat_intelligence: List[str] = field(default_factory=list)
+    # Every CVE ID mentioned anywhere in the response
+    cve_ids: List[str] = field(default_factory=list)
+
+    def is_empty(self):
+        return not any(getattr(self, f.name) for f in fields(self))
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        known = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in (data or {}).items() if key in known})
+
+
+def _clean(text):
+    # Models sometimes wrap the whole answer in LaTeX \boxed{...}
+    text = text.strip()
+    if text.startswith('\\boxed{') and text.endswith('}'):
+        text = text[len('\\boxed{'):-1]
+    return text.replace('**', '').strip()
+
+
+def _sentences(text):
+    return [part.strip().rstrip('.') for part in re.split(r'(?<=\.)\s+|\s*->\s*', _clean(text))
+            if part.strip().rstrip('.')]
+
+
+def _items(value):
+    if isinstance(value, list):
+        return [_clean(str(item)) for item in value if str(item).strip()]
+    if isinstance(value, dict):
+        return [f"{key}: {_clean(str(item))}" for key, item in value.items()]
+    return _sentences(str(value))
+
+
+def _list_items(body):
+    """Split a section body into list items (bullets, numbers or paragraphs)."""
+    items = []
+    current = None
+    for line in body.splitlines():
+        if not line.strip():
+            current = None
+            continue
+        if BULLET_PATTERN.match(line):
+            current = BULLET_PATTERN.sub('', line, count=1)
+            items.append(current)
+        elif current is None:
+            current = line.strip()
+            items.append(current)
+        else:
+            items[-1] = f"{items[-1]} {line.strip()}"
+            current = items[-1]
+    return [_clean(item) for item in items if _clean(item)]
+
+
+def _field_for_title(title):
+    title = title.lower()
+    if 'vector' in title:
+        return 'attack_vectors'
+    if 'indicator' in title or title.startswith('ioc'):
+        return 'iocs'
+    if title.startswith('cve'):
+        return 'cves'
+    if 'timeline' in title:
+        return 'timeline'
+    if 'impact' in title:
+        return 'impact'
+    if 'mitigation' in title:
+        return 'mitigations'
+    if 'incident' in title:
+        return 'incident_reports'
+    if 'intelligence' in title:
+        return 'threat_intelligence'
+    return 'ttps'
+
+
+def _from_mapping(data):
+    sections = ReportSections()
+    for key, value in data.items():
+        name = JSON_KEYS.get(str(key).lower().replace(' ', '_'))
+        if name is None or value in (None, ''):
+            continue
+        if name == 'summary':
+            sections.summary = _clean(str(value))
+        else:
+            getattr(sections, name).extend(_items(value))
+    return sections
+
+
+def _from_text(text):
+    # A JSON or Python dict literal in disguise
+    cleaned = _clean(text)
+    if cleaned.startswith('{'):
+        for loader in (json.loads, ast.literal_eval):
+            try:
+                data = loader(cleaned)
+            except (ValueError, SyntaxError):
+                continue
+            if isinstance(data, dict):
+                return _from_mapping(data)
+
+    sections = ReportSections()
+    headers = list(HEADER_PATTERN.finditer(text))
+    # Whatever precedes the first header (or the whole text if there is none)
+    sections.summary = _clean(text[:headers[0].start()] if headers else text)
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        body = (header.group('rest') or '') + '\n' + text[header.end():end]
+        getattr(sections, _field_for_title(header.group('title'))).extend(_list_items(body))
+    return sections
+
+
+def parse_analysis(api_response):
+    """Parse an analysis response into ReportSections, or None if it failed."""
+    if not isinstance(api_response, dict) or 'error' in api_response:
+        return None
+    data = api_response.get('data', api_response) if 'status' in api_response else api_response
+    if not isinstance(data, dict):
+        return None
+
+    if 'content' in data and isinstance(data['content'], str):
+        text = data['content']
+        sections = _from_text(text)
+    else:
+        text = json.dumps(data)
+        sections = _from_mapping(data)
+
+    seen = set()
+    for match in CVE_PATTERN.finditer(text):
+        cve_id = match.group(0).upper()
+        if cve_id not in seen:
+            seen.add(cve_id)
+            sections.cve_ids.append(cve_id)
+    return sections
+
+
+def sections_for(response):
+    """Sections of a stored response: the ingest-time copy, else parsed now."""
+    if not isinstance(response, dict):
+        return None
+    if 'sections' in response and 'api_response' in response:
+        stored = response['sections']
+        return ReportSections.from_dict(stored) if stored is not None else None
+    return parse_analysis(response.get('api_response', response))
@@ -0,0 +1,117 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+
+from .instrumentation import get_logger
+
+logger = get_logger(__name__)
+
+
+class ResponseCache:
+    """Two-tier cache for LLM responses.
+
+    Entries are keyed on a hash of everything that determines the model
+    output (model, system prompt, user prompt, temperature, max_tokens).
+    Lookups hit an in-process LRU first and fall back to the
+    `llm_response_cache` table, so answers survive restarts and are shared
+    between sessions that use the same database.
+    """
+
+    def __init__(self, db=None, ttl=None, max_entries=None, max_persistent_entries=None):
+        self.db = db
+        self.ttl = ttl if ttl is not None else int(os.environ.get('LLM_CACHE_TTL', 24 * 3600))
+        self.max_entries = max_entries if max_entries is not None else int(
+            os.environ.get('LLM_CACHE_MAX_ENTRIES', 256))
+        self.max_persistent_entries = max_persistent_entries if max_persistent_entries is not None else int(
+            os.environ.get('LLM_CACHE_MAX_PERSISTENT_ENTRIES', 10000))
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model, system_prompt, prompt, temperature, max_tokens):
+        payload = json.dumps([model, system_prompt, prompt, temperature, max_tokens],
+                             ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, response = entry
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    # Callers mutate responses, so never hand out the cached object
+                    return copy.deepcopy(response)
+                del self._entries[key]
+
+        if self.db is not None:
+            try:
+                entry = self.db.get_cached_response(key, max_age=self.ttl)
+            except Exception as e:
+                logger.error("Error reading response cache: %s", e)
+                entry = None
+            if entry is not None:
+                response, created_at = entry
+                with self._lock:
+                    self.persistent_hits += 1
+                    # Expires from memory when the stored row does, not a TTL later
+                    self._remember(key, response, created_at.replace(tzinfo=timezone.utc).timestamp())
+                return copy.deepcopy(response)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, model, response):
+        with self._lock:
+            self._remember(key, copy.deepcopy(response), time.time())
+            self._writes_since_prune += 1
+            prune = self._writes_since_prune >= 100
+            if prune:
+                self._writes_since_prune = 0
+
+        if self.db is not None:
+            try:
+                self.db.put_cached_response(key, model, response)
+                if prune:
+                    self.db.prune_cached_responses(max_age=self.ttl,
+                                                   max_entries=self.max_persistent_entries)
+            except Exception as e:
+                logger.error("Error writing response cache: %s", e)
+
+    def _remember(self, key, response, stored_at):
+        self._entries[key] = (stored_at, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.db is not None:
+            self.db.clear_cached_responses()
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.persistent_hits
+            lookups = hits + self.misses
+            return {
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._entries)
+            }
@@ -0,0 +1,172 @@
+"""Running aggregates over stored analyses.
+
+Every stored analysis bumps exact counters in `rollup_counters` (per day,
+severity, actor, sector and day+severity) and adds its indicators to a
+count-min sketch in `rollup_sketch_stripes`, in the same transaction as the
+row itself. Summaries read those few rows instead of scanning the history.
+
+Both are split into ROLLUP_STRIPES stripes (default 8), chosen by analysis
+id, so concurrent writers rarely wait on the same row lock; reads add the
+stripes of a counter up and merge the sketch stripes.
+
+Rebuild them from the stored history (e.g. after deleting rows by hand):
+    python -m utils.rollups rebuild
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from array import array
+
+ROLLUP_STRIPES = max(1, int(os.environ.get('ROLLUP_STRIPES', 8)))
+
+# Exact counters; the key of each is described next to it
+DIMENSIONS = {
+    'total': "'' (all analyses)",
+    'day': "YYYY-MM-DD (UTC)",
+    'severity': "normalized severity",
+    'day_severity': "YYYY-MM-DD|severity",
+    'actor': "normalized threat actor, labelled as first written",
+    'sector': "lowercased target sector, labelled as first written",
+}
+
+# Heavy-hitter sketches: name -> what is counted
+SKETCHES = {
+    'indicators': "analyses mentioning each indicator, keyed 'type:value'",
+}
+
+
+def rollup_increments(timestamp, severity, threat_actor=None, threat_actor_key=None,
+                      target_sector=None):
+    """The (dimension, key, label) counters one analysis adds one to."""
+    day = timestamp.strftime('%Y-%m-%d')
+    increments = [
+        ('total', '', None),
+        ('day', day, None),
+        ('severity', severity, None),
+        ('day_severity', f"{day}|{severity}", None),
+    ]
+    if threat_actor_key:
+        increments.append(('actor', threat_actor_key, threat_actor))
+    if target_sector:
+        increments.append(('sector', target_sector.lower(), target_sector))
+    return increments
+
+
+class CountMinSketch:
+    """Approximate counts for an unbounded set of keys in fixed memory.
+
+    Estimates never undercount; they overcount by at most
+    e/width * total with probability 1 - exp(-depth).
+    """
+
+    def __init__(self, width=2048, depth=4, counts=None):
+        self.width = width
+        self.depth = depth
+        self.counts = counts if counts is not None else array('I', bytes(4 * width * depth))
+
+    def _cells(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=4 * self.depth).digest()
+        return [row * self.width + int.from_bytes(digest[4 * row:4 * row + 4], 'little') % self.width
+                for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        """Count key and return its new estimate."""
+        cells = self._cells(key)
+        for cell in cells:
+            self.counts[cell] += count
+        return min(self.counts[cell] for cell in cells)
+
+    def merge(self, other):
+        """Add another sketch of the same shape into this one."""
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Only sketches of the same width and depth can be merged")
+        counts = self.counts
+        for cell, count in enumerate(other.counts):
+            if count:
+                counts[cell] += count
+
+    def estimate(self, key):
+        return min(self.counts[cell] for cell in self._cells(key))
+
+    def to_bytes(self):
+        counts = self.counts
+        if sys.byteorder == 'big':
+            counts = array('I', counts)
+            counts.byteswap()
+        return counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, width, depth):
+        counts = array('I')
+        counts.frombytes(data)
+        if sys.byteorder == 'big':
+            counts.byteswap()
+        return cls(width, depth, counts)
+
+
+class HeavyHitters:
+    """The k most frequent keys of a stream: a sketch plus k candidates.
+
+    A key enters the candidate list once its estimate beats the smallest
+    candidate, so the list holds the top k without counting every key.
+    """
+
+    def __init__(self, k=50, sketch=None, top=None, total=0):
+        self.k = k
+        self.sketch = sketch or CountMinSketch()
+        self.top = dict(top or {})
+        self.total = total
+
+    def add(self, key, count=1):
+        estimate = self.sketch.add(key, count)
+        self.total += count
+        if key in self.top or len(self.top) < self.k:
+            self.top[key] = estimate
+        else:
+            smallest = min(self.top, key=self.top.get)
+            if estimate > self.top[smallest]:
+                del self.top[smallest]
+                self.top[key] = estimate
+
+    @classmethod
+    def merged(cls, parts, k=50):
+        """Combine heavy hitters kept for parts of one stream (e.g. stripes).
+
+        The candidates of every part are re-ranked on the summed sketch.
+        """
+        parts = list(parts)
+        if not parts:
+            return cls(k=k)
+        sketch = CountMinSketch(parts[0].sketch.width, parts[0].sketch.depth)
+        for part in parts:
+            sketch.merge(part.sketch)
+        candidates = set().union(*(part.top for part in parts))
+        ranked = sorted(candidates, key=lambda key: (-sketch.estimate(key), key))[:k]
+        return cls(k=k, sketch=sketch, top={key: sketch.estimate(key) for key in ranked},
+                   total=sum(part.total for part in parts))
+
+    def top_k(self, k=None):
+        ranked = sorted(self.top.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:k] if k is not None else ranked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the analysis rollups")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild', help="recompute every rollup from the stored analyses")
+    show = commands.add_parser('show', help="print the summary the rollups serve")
+    show.add_argument('--top', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    from .database import Database
+    db = Database()
+    if args.command == 'rebuild':
+        print(f"Rebuilt rollups: {db.rebuild_rollups()}")
+    else:
+        print(json.dumps(db.rollup_summary(top=args.top), indent=2))
+
+
+if __name__ == '__main__':
+    main()
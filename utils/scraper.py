@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .instrumentation import get_logger
+
+logger = get_logger(__name__)
+
+MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+
+class CachedScraper:
+    """HTTP fetcher for the scrape sources with pooling and a disk cache.
+
+    - One pooled requests.Session is reused for every fetch (keep-alive).
+    - Pages are cached on disk per URL for `ttl` seconds (or the server's
+      Cache-Control max-age); stale entries are revalidated with
+      If-None-Match / If-Modified-Since, so an unchanged page costs a 304.
+    - Concurrent fetches of the same URL share one request.
+    - Every PRUNE_EVERY writes the cache drops expired entries that have no
+      validator, then the least recently fetched ones until it holds at most
+      `max_entries` files and `max_bytes` bytes.
+    """
+
+    PRUNE_EVERY = 50
+
+    def __init__(self, cache_dir=None, ttl=None, timeout=10, pool_size=20, headers=None,
+                 max_entries=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.environ.get('SCRAPE_CACHE_DIR', '.scrape_cache')
+        self.ttl = ttl if ttl is not None else int(os.environ.get('SCRAPE_CACHE_TTL', 3600))
+        self.max_entries = max_entries if max_entries is not None else int(
+            os.environ.get('SCRAPE_CACHE_MAX_ENTRIES', 5000))
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            float(os.environ.get('SCRAPE_CACHE_MAX_MB', 200)) * 1024 * 1024)
+        self.timeout = timeout
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._writes_since_prune = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.fetch_seconds = []
+
+    def _cache_path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _read_entry(self, url):
+        try:
+            with open(self._cache_path(url), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_entry(self, url, entry):
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._cache_path(url))
+        except OSError as e:
+            logger.error("Error writing scrape cache: %s", e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self._writes_since_prune += 1
+            prune = self._writes_since_prune >= self.PRUNE_EVERY
+            if prune:
+                self._writes_since_prune = 0
+        if prune:
+            self.prune()
+
+    @staticmethod
+    def _has_validator(entry):
+        return bool(entry.get('etag') or entry.get('last_modified'))
+
+    def prune(self):
+        """Evict cache files as described on the class; returns how many."""
+        now = time.time()
+        files = []
+        removed = 0
+        try:
+            scanned = list(os.scandir(self.cache_dir))
+        except OSError as e:
+            logger.error("Error pruning scrape cache: %s", e)
+            return 0
+        for item in scanned:
+            if not item.name.endswith('.json'):
+                continue
+            try:
+                stat = item.stat()
+            except OSError:
+                continue
+            # Files are rewritten on every fetch and revalidation, so the
+            # mtime is when the entry was last fetched
+            if now - stat.st_mtime >= self.ttl:
+                try:
+                    with open(item.path, encoding='utf-8') as f:
+                        entry = json.load(f)
+                except (OSError, ValueError):
+                    entry = None
+                if entry is None or (not self._is_fresh(entry) and not self._has_validator(entry)):
+                    self._remove(item.path)
+                    removed += 1
+                    continue
+            files.append((stat.st_mtime, stat.st_size, item.path))
+
+        files.sort()
+        count = len(files)
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._remove(path)
+            removed += 1
+            count -= 1
+            total -= size
+        return removed
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _is_fresh(self, entry):
+        return time.time() - entry['fetched_at'] < entry.get('ttl', self.ttl)
+
+    def fetch(self, url):
+        """Return the page body for url, or None if the server didn't answer 200."""
+        entry = self._read_entry(url)
+        if entry is not None and self._is_fresh(entry):
+            with self._lock:
+                self.hits += 1
+            return entry['body']
+        if entry is not None and not self._has_validator(entry):
+            # Stale and can't be revalidated: no use keeping it
+            self._remove(self._cache_path(url))
+            entry = None
+
+        with self._lock:
+            future = self._in_flight.get(url)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[url] = future
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            body = self._fetch_remote(url, entry)
+            future.set_result(body)
+            return body
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[url]
+
+    def _fetch_remote(self, url, entry):
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.fetch_seconds.append(elapsed)
+            if len(self.fetch_seconds) > 1000:
+                del self.fetch_seconds[:-1000]
+
+        if response.status_code == 304 and entry is not None:
+            with self._lock:
+                self.revalidated += 1
+            entry['fetched_at'] = time.time()
+            self._write_entry(url, entry)
+            return entry['body']
+
+        with self._lock:
+            self.misses += 1
+        if response.status_code != 200:
+            return None
+
+        cache_control = response.headers.get('Cache-Control', '')
+        if 'no-store' not in cache_control:
+            max_age = MAX_AGE_PATTERN.search(cache_control)
+            self._write_entry(url, {
+                'url': url,
+                'body': response.text,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'fetched_at': time.time(),
+                'ttl': int(max_age.group(1)) if max_age else self.ttl
+            })
+        return response.text
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.revalidated + self.coalesced
+            served_locally = self.hits + self.revalidated + self.coalesced
+            latencies = sorted(self.fetch_seconds)
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidated': self.revalidated,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'hit_rate': served_locally / lookups if lookups else 0.0,
+                'fetches': len(latencies),
+                'fetch_p50': latencies[len(latencies) // 2] if latencies else 0.0,
+                'fetch_max': latencies[-1] if latencies else 0.0
+            }
@@ -0,0 +1,148 @@
+import re
+
+from sqlalchemy import text
+
+# Keys of a stored response that are not worth indexing. raw_data is request
+# metadata (and in older rows a second copy of api_response), sections are
+# parsed from api_response; status/format/usage are envelope bookkeeping.
+SKIPPED_RESPONSE_KEYS = {'raw_data', 'sections', 'status', 'format', 'usage'}
+
+TOKEN_PATTERN = re.compile(r'[^\s"]+')
+
+
+def document_text(value):
+    """Flatten the strings of a stored response into one searchable document."""
+    parts = []
+
+    def walk(item):
+        if isinstance(item, str):
+            if item.strip():
+                parts.append(item)
+        elif isinstance(item, dict):
+            for key, child in item.items():
+                if key not in SKIPPED_RESPONSE_KEYS:
+                    walk(child)
+        elif isinstance(item, (list, tuple)):
+            for child in item:
+                walk(child)
+
+    walk(value)
+    return '\n'.join(parts)
+
+
+class SearchIndex:
+    """Full-text index over analysis queries and response text.
+
+    Uses an FTS5 virtual table on SQLite and a tsvector column with a GIN
+    index on Postgres. Rows are added in the same transaction that stores
+    the analysis, so the index is always in sync with threat_analyses.
+    """
+
+    TABLE = 'analysis_search'
+
+    def __init__(self, engine):
+        self.dialect = engine.dialect.name
+        self.engine = engine
+
+    @property
+    def available(self):
+        return self.dialect in ('sqlite', 'postgresql')
+
+    def create(self):
+        if not self.available:
+            return
+        with self.engine.begin() as conn:
+            if self.dialect == 'sqlite':
+                # rowid is the analysis id
+                conn.execute(text(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.TABLE} "
+                    "USING fts5(query, body, tokenize='porter unicode61')"
+                ))
+            else:
+                conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {self.TABLE} ("
+                    "analysis_id INTEGER PRIMARY KEY REFERENCES threat_analyses(id) ON DELETE CASCADE, "
+                    "query TEXT NOT NULL, "
+                    "body TEXT NOT NULL, "
+                    "document TSVECTOR NOT NULL)"
+                ))
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{self.TABLE}_document "
+                    f"ON {self.TABLE} USING GIN (document)"
+                ))
+
+    def index(self, session, analysis_id, query, response):
+        if not self.available:
+            return
+        params = {'id': analysis_id, 'query': query, 'body': document_text(response)}
+        if self.dialect == 'sqlite':
+            session.execute(text(
+                f"INSERT INTO {self.TABLE} (rowid, query, body) VALUES (:id, :query, :body)"
+            ), params)
+        else:
+            # Matches in the query text rank above matches in the response
+            session.execute(text(
+                f"INSERT INTO {self.TABLE} (analysis_id, query, body, document) VALUES "
+                "(:id, :query, :body, "
+                "setweight(to_tsvector('english', :query), 'A') || "
+                "setweight(to_tsvector('english', :body), 'B'))"
+            ), params)
+
+    def unindexed_ids_sql(self):
+        key = 'rowid' if self.dialect == 'sqlite' else 'analysis_id'
+        return (
+            f"SELECT id, query, response FROM threat_analyses "
+            f"WHERE id > :after_id AND id NOT IN (SELECT {key} FROM {self.TABLE}) "
+            f"ORDER BY id LIMIT :limit"
+        )
+
+    def _fts5_query(self, search_text):
+        # Quote every token so user input can't break FTS5 query syntax;
+        # tokens are ANDed, and something like CVE-2024-3400 becomes a phrase
+        tokens = TOKEN_PATTERN.findall(search_text)
+        return ' '.join('"' + token.replace('"', '""') + '"' for token in tokens)
+
+    def search(self, session, search_text, limit=20):
+        if not self.available or not search_text.strip():
+            return []
+
+        if self.dialect == 'sqlite':
+            match = self._fts5_query(search_text)
+            if not match:
+                return []
+            rows = session.execute(text(
+                "SELECT a.id, a.timestamp, a.query, s.rank, s.snippet FROM ("
+                f"  SELECT rowid AS id, bm25({self.TABLE}, 2.0, 1.0) AS rank, "
+                f"  snippet({self.TABLE}, -1, '**', '**', '…', 16) AS snippet "
+                f"  FROM {self.TABLE} WHERE {self.TABLE} MATCH :match "
+                "  ORDER BY rank LIMIT :limit"
+                ") s JOIN threat_analyses a ON a.id = s.id ORDER BY s.rank"
+            ), {'match': match, 'limit': limit}).all()
+            # bm25 is lower-is-better; flip it so callers can sort descending
+            return [self._result(row, -row.rank) for row in rows]
+
+        rows = session.execute(text(
+            "SELECT a.id, a.timestamp, a.query, s.rank, "
+            "ts_headline('english', s.body, q, 'StartSel=**, StopSel=**, MaxFragments=1, MaxWords=24') AS snippet "
+            "FROM ("
+            f"  SELECT analysis_id, body, ts_rank(document, q) AS rank, q FROM {self.TABLE}, "
+            "  websearch_to_tsquery('english', :q) q WHERE document @@ q "
+            "  ORDER BY rank DESC LIMIT :limit"
+            ") s JOIN threat_analyses a ON a.id = s.analysis_id ORDER BY s.rank DESC"
+        ), {'q': search_text, 'limit': limit}).all()
+        return [self._result(row, row.rank) for row in rows]
+
+    def _result(self, row, rank):
+        timestamp = row.timestamp
+        if hasattr(timestamp, 'isoformat'):
+            timestamp = timestamp.isoformat()
+        elif isinstance(timestamp, str):
+            # SQLite hands back the stored text for raw queries
+            timestamp = timestamp.replace(' ', 'T', 1)
+        return {
+            'id': row.id,
+            'timestamp': timestamp,
+            'query': row.query,
+            'rank': float(rank),
+            'snippet': row.snippet
+        }
@@ -0,0 +1,149 @@
+import re
+import threading
+import zlib
+
+import numpy as np
+
+STOPWORDS = {
+    'a', 'about', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'could',
+    'do', 'does', 'for', 'from', 'get', 'gets', 'how', 'i', 'in', 'into', 'is',
+    'it', 'its', 'me', 'most', 'of', 'on', 'or', 'some', 'tell', 'that', 'the',
+    'their', 'there', 'these', 'they', 'this', 'to', 'typical', 'typically',
+    'usually', 'was', 'what', 'when', 'which', 'who', 'why', 'with', 'you'
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-.][a-z0-9]+)*")
+
+
+def _stem(token):
+    # Just enough folding for plurals ("attacks" ~ "attack")
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def query_features(text):
+    """Weighted features of a query: terms, term bigrams and character 4-grams."""
+    terms = [_stem(t) for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+    features = {}
+
+    def add(feature, weight):
+        features[feature] = features.get(feature, 0.0) + weight
+
+    for term in terms:
+        add('w:' + term, 1.0)
+        if len(term) > 4:
+            padded = f"<{term}>"
+            for i in range(len(padded) - 3):
+                add('c:' + padded[i:i + 4], 0.25)
+    for first, second in zip(terms, terms[1:]):
+        add(f"b:{first} {second}", 0.5)
+    return features
+
+
+class QueryIndex:
+    """Similarity index over past queries using hashed n-gram vectors.
+
+    Each query becomes a sparse vector of hashed features, stored CSR-style
+    in NumPy arrays. Features are IDF-weighted at lookup time from document
+    frequencies kept per hash bucket, so rare words like an actor name count
+    for more than "attack" or "vector". Cosine top-k over every stored query
+    is a handful of vectorized array operations. Rows can be appended at
+    any time.
+    """
+
+    def __init__(self, dim=2 ** 18):
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._doc_freq = np.zeros(dim, dtype=np.int32)
+        self._ids = []
+        self._queries = []
+        # Pending rows are appended to Python lists and folded into the
+        # arrays on the next search
+        self._pending_indices = []
+        self._pending_values = []
+        self._indices = np.zeros(0, dtype=np.int32)
+        self._values = np.zeros(0, dtype=np.float32)
+        self._offsets = np.zeros(1, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _vectorize(self, text):
+        buckets = {}
+        for feature, weight in query_features(text).items():
+            bucket = zlib.crc32(feature.encode('utf-8')) % self.dim
+            buckets[bucket] = buckets.get(bucket, 0.0) + weight
+        if not buckets:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        indices = np.fromiter(buckets.keys(), dtype=np.int32, count=len(buckets))
+        # Sublinear term frequency
+        values = 1.0 + np.log(np.fromiter(buckets.values(), dtype=np.float32, count=len(buckets)))
+        return indices, values
+
+    def add(self, analysis_id, query):
+        indices, values = self._vectorize(query)
+        with self._lock:
+            self._ids.append(analysis_id)
+            self._queries.append(query)
+            self._pending_indices.append(indices)
+            self._pending_values.append(values)
+            self._doc_freq[indices] += 1
+
+    def add_many(self, rows):
+        for analysis_id, query in rows:
+            self.add(analysis_id, query)
+
+    def _consolidate(self):
+        if not self._pending_indices:
+            return
+        lengths = np.fromiter((len(i) for i in self._pending_indices), dtype=np.int64,
+                              count=len(self._pending_indices))
+        self._offsets = np.concatenate([self._offsets, self._offsets[-1] + np.cumsum(lengths)])
+        self._indices = np.concatenate([self._indices] + self._pending_indices)
+        self._values = np.concatenate([self._values] + self._pending_values)
+        self._pending_indices = []
+        self._pending_values = []
+
+    def search(self, query, k=5):
+        """Return up to k (analysis_id, similarity, query) tuples, best first."""
+        q_indices, q_values = self._vectorize(query)
+        with self._lock:
+            self._consolidate()
+            n = len(self._ids)
+            if n == 0 or len(q_indices) == 0:
+                return []
+
+            idf = np.log((1.0 + n) / (1.0 + self._doc_freq)).astype(np.float32) + 1.0
+            query_vec = np.zeros(self.dim, dtype=np.float32)
+            query_vec[q_indices] = q_values * idf[q_indices]
+            query_norm = np.linalg.norm(query_vec[q_indices])
+
+            row_weights = self._values * idf[self._indices]
+            starts = self._offsets[:-1]
+            nonempty = self._offsets[1:] > starts
+            dots = np.zeros(n, dtype=np.float32)
+            norms = np.zeros(n, dtype=np.float32)
+            if nonempty.any():
+                # reduceat sums each row's slice; empty rows are left out
+                # because their zero-length slices would alias the next row
+                row_starts = starts[nonempty]
+                dots[nonempty] = np.add.reduceat(row_weights * query_vec[self._indices], row_starts)
+                norms[nonempty] = np.add.reduceat(row_weights * row_weights, row_starts)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores = np.where(norms > 0, dots / (np.sqrt(norms) * query_norm), 0.0)
+
+            k = min(k, n)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[i], float(scores[i]), self._queries[i])
+                    for i in top if scores[i] > 0]
+
+    def best_match(self, query, threshold):
+        matches = self.search(query, k=1)
+        if matches and matches[0][1] >= threshold:
+            return matches[0]
+        return None
@@ -0,0 +1,73 @@
+import ast
+import json
+
+SEVERITY_LEVELS = ('Critical', 'High', 'Medium', 'Low')
+
+# Tag names produced by GPTHelper.tag_threat_data and the analysis_tags
+# column each one is stored in
+TAG_FIELDS = {
+    'Severity Level': 'severity',
+    'threat_actor': 'threat_actor',
+    'target_sector': 'target_sector',
+    'attack_vector': 'attack_vector',
+    'TTP': 'ttp'
+}
+
+
+def unwrap_tags(tags):
+    """Return the tag dict from whatever shape it was stored in.
+
+    Older rows hold the tag fields directly; newer ones keep the whole API
+    envelope with the fields under "data". Strings are parsed as JSON or as
+    a Python literal, never evaluated.
+    """
+    if isinstance(tags, str):
+        try:
+            tags = json.loads(tags)
+        except ValueError:
+            try:
+                tags = ast.literal_eval(tags)
+            except (ValueError, SyntaxError):
+                return {}
+    if not isinstance(tags, dict):
+        return {}
+    if isinstance(tags.get('data'), dict) and 'status' in tags:
+        return tags['data']
+    return tags
+
+
+def normalize_severity(value):
+    if not value:
+        return 'Unknown'
+    text = str(value).lower()
+    for level in SEVERITY_LEVELS:
+        if level.lower() in text:
+            return level
+    return 'Unknown'
+
+
+def _as_text(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        value = ', '.join(str(v) for v in value if v)
+    elif isinstance(value, dict):
+        value = json.dumps(value)
+    value = str(value).strip()
+    return value or None
+
+
+def normalize_tags(tags):
+    """Flatten tagging output into the analysis_tags columns."""
+    data = unwrap_tags(tags)
+    fields = {column: _as_text(data.get(name)) for name, column in TAG_FIELDS.items()}
+    fields['severity'] = normalize_severity(fields['severity'])
+    fields['threat_actor_key'] = actor_key(fields['threat_actor'])
+    return fields
+
+
+def actor_key(threat_actor):
+    # Case- and whitespace-insensitive form used for indexed lookups
+    if not threat_actor:
+        return None
+    return ' '.join(str(threat_actor).lower().split())
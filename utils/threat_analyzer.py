@@ -1,68 +1,193 @@
 from datetime import datetime
-import pandas as pd
+import os
 from .database import Database
+from .scraper import CachedScraper
+from .cve_store import CVEStore, mirror_configured
+from .extractors import SOURCE_EXTRACTORS, extract_items
+from .report_parser import SECTION_TITLES, parse_analysis, sections_for
+from .instrumentation import SCRAPE_SECONDS, get_logger
 
-from bs4 import BeautifulSoup
-import requests
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+logger = get_logger(__name__)
+
+# Threads for the per-source scrapes; each analysis runs one per source, so
+# this bounds how many analyses scrape at once (SCRAPE_WORKERS, default 32)
+SCRAPE_WORKERS = int(os.environ.get('SCRAPE_WORKERS', 32))
 
 class ThreatAnalyzer:
-    def __init__(self):
-        self.db = Database()
+    def __init__(self, db=None, cve_store=None):
+        # Pass a shared Database to reuse its engine and connection pool
+        self.db = db if db is not None else Database()
+        # Overridable to point at local fixtures (see benchmarks/stub_servers.py)
         self.scrape_sources = {
-            'cve': 'https://cve.mitre.org/cgi-bin/cvekey.cgi?keyword=',
-            'exploitdb': 'https://www.exploit-db.com/search?q='
+            'cve': os.environ.get('SCRAPE_CVE_URL',
+                                  'https://cve.mitre.org/cgi-bin/cvekey.cgi?keyword='),
+            'exploitdb': os.environ.get('SCRAPE_EXPLOITDB_URL',
+                                        'https://www.exploit-db.com/search?q=')
         }
+        # Local NVD mirror (CVE_MIRROR_URL); CVE lookups scrape MITRE when
+        # none is set up or it has nothing for the query
+        if cve_store is None and mirror_configured():
+            cve_store = CVEStore()
+        self.cve_store = cve_store
+        # Kept for the analyzer's lifetime and shared by every caller;
+        # threads are only started once scrapes are submitted
+        self._scrape_executor = ThreadPoolExecutor(max_workers=SCRAPE_WORKERS,
+                                                   thread_name_prefix='scrape')
+        self.scraper = CachedScraper(headers={
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        })
+        # Built from the database on first lookup, then kept current by
+        # the store listener
+        self.query_index = None
+        self._query_index_lock = threading.Lock()
+        # Rows stored while the index is being built, which its snapshot of
+        # the database may have missed; guarded by _stored_lock
+        self._stored_during_build = None
+        self._stored_lock = threading.Lock()
+        self.db.add_store_listener(self._index_stored_queries)
+
+    def _get_query_index(self):
+        with self._query_index_lock:
+            if self.query_index is None:
+                # numpy is only loaded once similarity lookups are used
+                from .similarity import QueryIndex
+                with self._stored_lock:
+                    self._stored_during_build = []
+                index = QueryIndex()
+                indexed = set()
+                for analysis_id, query in self.db.iter_successful_queries():
+                    indexed.add(analysis_id)
+                    index.add(analysis_id, query)
+                with self._stored_lock:
+                    index.add_many(row for row in self._stored_during_build if row[0] not in indexed)
+                    self._stored_during_build = None
+                    self.query_index = index
+            return self.query_index
+
+    def _index_stored_queries(self, results):
+        rows = []
+        for result in results:
+            response = result.get('response') or {}
+            api_response = response.get('api_response') or {}
+            if 'error' not in response and not (isinstance(api_response, dict) and 'error' in api_response):
+                rows.append((result['id'], result['query']))
+        with self._stored_lock:
+            if self.query_index is not None:
+                self.query_index.add_many(rows)
+            elif self._stored_during_build is not None:
+                self._stored_during_build.extend(rows)
+            # Otherwise no build has started; it will read these rows itself
+
+    def find_similar_analysis(self, query, threshold=0.7):
+        """Return the stored analysis of the most similar past query, if close enough.
+
+        The result is the stored row plus a `similarity` score in [0, 1].
+        """
+        match = self._get_query_index().best_match(query, threshold)
+        if match is None:
+            return None
+        analysis = self.db.get_analysis(match[0])
+        if analysis is not None:
+            analysis['similarity'] = match[1]
+        return analysis
+
+    def _lookup_cve(self, query):
+        if self.cve_store is not None and self.cve_store.available:
+            results = self.cve_store.search(query, limit=5)
+            if results:
+                return [CVEStore.format_result(result) for result in results]
+        return self._scrape_cve(query)
+
+    def _scrape_cve(self, query):
+        # Search CVE database
+        cve_url = self.scrape_sources['cve'] + query.replace(' ', '+')
+        page = self.scraper.fetch(cve_url)
+        if page is not None:
+            # First 5 CVE rows; parsing stops once they are read
+            return extract_items(page, SOURCE_EXTRACTORS['cve'])
+        return None
+
+    def _scrape_exploitdb(self, query):
+        # Search ExploitDB
+        exploit_url = self.scrape_sources['exploitdb'] + query.replace(' ', '+')
+        page = self.scraper.fetch(exploit_url)
+        if page is not None:
+            # First 5 exploit cards
+            return extract_items(page, SOURCE_EXTRACTORS['exploitdb'])
+        return None
+
+    @staticmethod
+    def _timed_scrape(source, scraper, query):
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            items = scraper(query)
+            outcome = 'empty' if items is None else 'ok'
+            return items
+        finally:
+            SCRAPE_SECONDS.observe(time.perf_counter() - start, source=source, outcome=outcome)
 
     def scrape_threat_data(self, query):
         scraped_data = {}
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-        
-        try:
-            # Search CVE database
-            cve_url = self.scrape_sources['cve'] + query.replace(' ', '+')
-            response = requests.get(cve_url, headers=headers, timeout=10)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                cve_items = soup.find_all('tr')[1:6]  # Get first 5 CVEs
-                scraped_data['cve_data'] = [item.get_text(strip=True) for item in cve_items if item]
-
-            # Search ExploitDB
-            exploit_url = self.scrape_sources['exploitdb'] + query.replace(' ', '+')
-            response = requests.get(exploit_url, headers=headers, timeout=10)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                exploit_items = soup.find_all('div', class_='card')[:5]  # Get first 5 exploits
-                scraped_data['exploit_data'] = [item.get_text(strip=True) for item in exploit_items if item]
+        scrapers = {
+            'cve_data': self._lookup_cve,
+            'exploit_data': self._scrape_exploitdb
+        }
 
-        except Exception as e:
-            print(f"Error scraping data: {str(e)}")
-            scraped_data['error'] = str(e)
+        # Both sources are independent, so fetch them in parallel instead of
+        # paying for two sequential 10 s timeouts
+        futures = {
+            key: self._scrape_executor.submit(self._timed_scrape, key, scraper, query)
+            for key, scraper in scrapers.items()
+        }
+        for key, future in futures.items():
+            try:
+                items = future.result()
+                if items is not None:
+                    scraped_data[key] = items
+            except Exception as e:
+                logger.error("Error scraping %s: %s", key, e)
+                scraped_data['error'] = str(e)
 
         return scraped_data
 
-    def store_response(self, query, response, tags):
-        try:
-            # Store raw API response
-            raw_response = {
-                'timestamp': datetime.utcnow().isoformat(),
-                'raw_api_response': response,
-                'query': query
-            }
-            
-            # Get scraped data
+    def shutdown(self):
+        self._scrape_executor.shutdown(wait=False)
+
+    def build_record(self, query, response, tags, scraped_data=None):
+        # Request metadata; the API response itself is only kept once, under api_response
+        raw_response = {
+            'timestamp': datetime.utcnow().isoformat(),
+            'query': query
+        }
+
+        # Get scraped data, unless the caller already fetched it concurrently
+        if scraped_data is None:
             scraped_data = self.scrape_threat_data(query)
-            
-            # Combine API response with scraped data
-            combined_response = {
-                'api_response': response,
-                'scraped_data': scraped_data,
-                'raw_data': raw_response
-            }
-            
-            return self.db.store_analysis(query, combined_response, tags)
+
+        # Parsed once here so readers never re-parse the model output
+        sections = parse_analysis(response)
+
+        # Combine API response with scraped data
+        combined_response = {
+            'api_response': response,
+            'sections': sections.to_dict() if sections is not None else None,
+            'scraped_data': scraped_data,
+            'raw_data': raw_response
+        }
+
+        return {'query': query, 'response': combined_response, 'tags': tags}
+
+    def store_response(self, query, response, tags, scraped_data=None):
+        try:
+            record = self.build_record(query, response, tags, scraped_data)
+            return self.db.store_analysis(record['query'], record['response'], record['tags'])
         except Exception as e:
-            print(f"Error storing analysis: {str(e)}")
+            logger.error("Error storing analysis: %s", e)
             return {
                 'timestamp': datetime.utcnow().isoformat(),
                 'query': query,
@@ -71,11 +196,25 @@ class ThreatAnalyzer:
                 'error': str(e)
             }
 
+    def store_responses(self, records):
+        """Bulk-store records produced by build_record in one transaction."""
+        return self.db.store_analyses(records)
+
     def get_historical_analysis(self):
         return self.db.to_dataframe()
 
-    def export_analysis(self, format='csv'):
-        return self.db.export_analysis(format)
+    def get_analysis_page(self, columns=('timestamp', 'query'), limit=50, cursor=None, **filters):
+        """Return one page of stored analyses; see Database.query_analyses."""
+        return self.db.query_analyses(columns=columns, limit=limit, cursor=cursor, **filters)
+
+    def search_analyses(self, search_text, limit=20):
+        return self.db.search_analyses(search_text, limit=limit)
+
+    def find_analyses_by_ioc(self, value, ioc_type=None, limit=50):
+        return self.db.find_analyses_by_ioc(value, ioc_type=ioc_type, limit=limit)
+
+    def export_analysis(self, path, format='csv', compress=False):
+        return self.db.export_analysis(path, format, compress=compress)
 
     def generate_threat_report(self, analysis_data):
         """Generate a complete formatted threat analysis report."""
@@ -84,45 +223,22 @@ class ThreatAnalyzer:
         report.append("📊 THREAT ANALYSIS REPORT")
         report.append("=" * 50)
 
-        # Process API Response
-        if 'api_response' in analysis_data:
-            api_data = analysis_data['api_response']
-            
-            # Handle both JSON and text responses
-            if isinstance(api_data, dict):
-                if 'data' in api_data:
-                    data = api_data['data']
-                elif 'content' in api_data:
-                    try:
-                        # Try parsing content as JSON
-                        import json
-                        data = json.loads(api_data['content'].replace('\\boxed{', '').replace('}', ''))
-                    except:
-                        data = {'content': api_data['content']}
-                
-                if 'attack_vector' in data:
-                    report.append("\n🎯 Attack Vector Analysis")
-                    report.append("-" * 30)
-                    vectors = data['attack_vector'].replace('\\boxed{', '').replace('}', '').split(". ")
-                    report.extend([f"• {v.strip()}" for v in vectors if v.strip()])
-
-                if 'timeline' in data:
-                    report.append("\n⏱️ Attack Timeline")
-                    report.append("-" * 30)
-                    timeline = data['timeline'].replace('\\boxed{', '').replace('}', '').split(". ")
-                    report.extend([f"{i}. {step.strip()}" for i, step in enumerate(timeline, 1) if step.strip()])
-
-                if 'impact' in data:
-                    report.append("\n💥 Potential Impact")
-                    report.append("-" * 30)
-                    impacts = data['impact'].replace('\\boxed{', '').replace('}', '').split(".")
-                    report.extend([f"• {imp.strip()}" for imp in impacts if imp.strip()])
-
-                if 'mitigation' in data:
-                    report.append("\n🛡️ Recommended Mitigations")
-                    report.append("-" * 30)
-                    mitigations = data['mitigation'].replace('\\boxed{', '').replace('}', '').split(". ")
-                    report.extend([f"{i}. {mit.strip()}" for i, mit in enumerate(mitigations, 1) if mit.strip()])
+        # Sections were parsed when the analysis was stored
+        sections = sections_for(analysis_data)
+        if sections is not None:
+            if sections.summary:
+                report.append("")
+                report.append(sections.summary)
+            for name, title, numbered in SECTION_TITLES:
+                items = getattr(sections, name)
+                if not items:
+                    continue
+                report.append(f"\n{title}")
+                report.append("-" * 30)
+                if numbered:
+                    report.extend(f"{i}. {item}" for i, item in enumerate(items, 1))
+                else:
+                    report.extend(f"• {item}" for item in items)
 
         # Process Scraped Data
         if 'scraped_data' in analysis_data:
@@ -0,0 +1,117 @@
+import atexit
+import threading
+import time
+from concurrent.futures import Future
+
+from .instrumentation import get_logger
+
+logger = get_logger(__name__)
+
+
+class BufferedWriter:
+    """Groups analysis writes into bulk inserts with one commit per batch.
+
+    Callers submit rows from any thread and get a Future for the stored
+    row. A background thread writes the buffer through
+    Database.store_analyses once it holds `max_rows` rows or its oldest row
+    has waited `max_delay_ms`, so concurrent writers share one commit (one
+    fsync on SQLite) instead of paying for one each. Anything still
+    buffered is written on close() and at interpreter exit.
+    """
+
+    def __init__(self, db, max_rows=50, max_delay_ms=5):
+        self.db = db
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000.0
+        self._pending = []
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._closed = False
+        self.batches = 0
+        self.rows = 0
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, query, response, tags):
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("BufferedWriter is closed")
+            first = not self._pending
+            if first:
+                self._oldest = time.monotonic()
+            self._pending.append(({'query': query, 'response': response, 'tags': tags}, future))
+            # Wake the writer to start the delay timer, or to write a full batch
+            if first or len(self._pending) >= self.max_rows:
+                self._condition.notify()
+        return future
+
+    def store(self, query, response, tags):
+        """Submit a row and wait until its batch is committed."""
+        return self.submit(query, response, tags).result()
+
+    def _take_batch(self):
+        # Called with the condition held; waits until a batch is due
+        while True:
+            if self._pending:
+                if self._closed or len(self._pending) >= self.max_rows:
+                    break
+                remaining = self._oldest + self.max_delay - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            elif self._closed:
+                return None
+            else:
+                self._condition.wait()
+        batch = self._pending[:self.max_rows]
+        del self._pending[:self.max_rows]
+        self._oldest = time.monotonic() if self._pending else None
+        return batch
+
+    def _run(self):
+        while True:
+            with self._condition:
+                batch = self._take_batch()
+            if batch is None:
+                return
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            results = self.db.store_analyses([record for record, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # Retry row by row so one bad row doesn't fail the whole batch
+            logger.warning("Error writing batch of %d analyses, retrying individually: %s", len(batch), e)
+            for item in batch:
+                self._write([item])
+            return
+        self.batches += 1
+        self.rows += len(results)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def flush(self):
+        """Write everything buffered so far and wait for it."""
+        with self._condition:
+            futures = [future for _, future in self._pending]
+            self._oldest = time.monotonic() - self.max_delay
+            self._condition.notify()
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                pass
+
+    def close(self):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        atexit.unregister(self.close)